@@ -0,0 +1,797 @@
+"""
+Benchmarks for the steganography API
+
+Usage:
+    python benchmark.py encode [--size 1024x1024] [--repeat 3]
+    python benchmark.py decode [--size 1024x1024] [--repeat 3]
+    python benchmark.py codec [--repeat 3]
+    python benchmark.py info [--repeat 3]
+    python benchmark.py bits [--size 1024x1024] [--repeat 3]
+    python benchmark.py compression [--repeat 3]
+    python benchmark.py threads [--size 4096x4096] [--repeat 3]
+    python benchmark.py stream [--size 7300x5500] [--repeat 3]
+    python benchmark.py gigapixel [--size 16384x12288] [--rss-limit 256]
+    python benchmark.py uploads [--size 2300x2300] [--repeat 3]
+    python benchmark.py raw [--size 1024x1024] [--repeat 3]
+    python benchmark.py download [--size 4000x3000]
+    python benchmark.py output [--repeat 3]
+    python benchmark.py deflate [--size 4000x3000] [--repeat 3]
+    python benchmark.py inplace [--size 4000x3000] [--repeat 3]
+    python benchmark.py modes [--size 2048x2048] [--repeat 3]
+    python benchmark.py frames [--size 640x480] [--repeat 3]
+    python benchmark.py batch [--size 1024x768] [--items 32] [--repeat 3]
+    python benchmark.py jobs [--size 4000x3000] [--repeat 3]
+    python benchmark.py cache [--size 2048x2048] [--repeat 3]
+    python benchmark.py copies [--size 4000x3000]
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import resource
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from main import (OUTPUT_PROFILES, FrameSequence, PNGStreamImage, PNGStreamWriter, RGBChannelSteganography, app,
+                  encode_output, encode_output_frames, peak_rss, reset_peak_rss, result_cache, shared_cache)
+
+CHANNELS = ['R', 'G', 'B', 'ALL']
+
+
+def make_cover(width, height, seed=0):
+    """Random RGB cover image"""
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def make_smooth_cover(width, height, seed=2):
+    """Gradient cover with mild noise, so PNG output has a realistic size"""
+    rng = np.random.default_rng(seed)
+    gradient = np.add.outer(np.arange(height) // 16, np.arange(width) // 16).astype(np.uint8)
+    pixels = np.repeat(gradient[:, :, None], 3, axis=2) + rng.integers(0, 4, (height, width, 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def timed(func, repeat):
+    """Best wall-clock time of func() over repeat runs"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_encode(args):
+    """Per-megapixel throughput of each engine for each channel mode"""
+    cover = make_cover(args.width, args.height)
+    megapixels = args.width * args.height / 1e6
+    print(f"encode: {args.width}x{args.height} ({megapixels:.2f} MP), message fills the cover")
+    print(f"{'channel':<8}{'engine':<12}{'seconds':>10}{'MP/s':>12}")
+
+    for channel in CHANNELS:
+        # Fill the whole capacity so every pixel of the mode is touched
+        message = 'x' * RGBChannelSteganography.capacity_bytes(args.width, args.height, channel)
+        outputs = {}
+        for engine in ('legacy', 'vectorized'):
+            seconds, (ok, result) = timed(
+                lambda: RGBChannelSteganography.encode_message(cover, message, channel, engine=engine),
+                args.repeat if engine == 'vectorized' else 1
+            )
+            assert ok, result
+            outputs[engine] = result.tobytes()
+            print(f"{channel:<8}{engine:<12}{seconds:>10.4f}{megapixels / seconds:>12.2f}")
+        assert outputs['legacy'] == outputs['vectorized'], f"output mismatch on channel {channel}"
+
+
+def bench_decode(args):
+    """Decode time for a short message, legacy full scan vs early termination"""
+    cover = make_cover(args.width, args.height)
+    print(f"decode: {args.width}x{args.height}, 20-character message")
+    print(f"{'channel':<8}{'engine':<12}{'seconds':>10}")
+
+    for channel in CHANNELS:
+        ok, encoded = RGBChannelSteganography.encode_message(cover, 'tracking-id-00000001', channel)
+        assert ok, encoded
+        for engine in ('legacy', 'vectorized'):
+            seconds, (ok, message) = timed(
+                lambda: RGBChannelSteganography.decode_message(encoded, channel, engine=engine),
+                args.repeat if engine == 'vectorized' else 1
+            )
+            assert ok and message == 'tracking-id-00000001', message
+            print(f"{channel:<8}{engine:<12}{seconds:>10.4f}")
+
+
+def measured(func, repeat):
+    """Best time and peak traced allocation of func()"""
+    seconds, result = timed(func, repeat)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+def bench_codec(args):
+    """Payload codec: '0'/'1' strings vs packed bytes, for 1 KB, 1 MB and 10 MB"""
+    S = RGBChannelSteganography
+    print(f"{'payload':<9}{'codec':<8}{'step':<8}{'seconds':>10}{'peak MB':>10}")
+
+    for label, size in (('1 KB', 1 << 10), ('1 MB', 1 << 20), ('10 MB', 10 << 20)):
+        message = ('lorem ipsum ' * (size // 12 + 1))[:size]
+        # Flat LSB carrier, allocated outside the measured region
+        carrier = np.zeros((size + S.HEADER_SIZE + 2) * 8, dtype=np.uint8)
+
+        def string_write():
+            binary = S.string_to_binary(message)
+            bits = np.frombuffer(binary.encode('ascii'), dtype=np.uint8) - ord('0')
+            carrier[:bits.size] = (carrier[:bits.size] & 0xFE) | bits
+
+        def string_read():
+            return S.binary_to_string(((carrier & 1) + ord('0')).tobytes().decode('ascii'))
+
+        def bytes_write():
+            data = message.encode('utf-8')
+            offset = S.write_bytes(carrier, 0, S.build_header(data))
+            S.write_bytes(carrier, offset, data)
+
+        def bytes_read():
+            return S.read_bytes(carrier, S.HEADER_SIZE * 8, size).decode('utf-8')
+
+        codecs = [('string', string_write, string_read), ('bytes', bytes_write, bytes_read)]
+        if size > args.string_limit:
+            # The string codec needs tens of seconds and GBs at this size
+            codecs = codecs[1:]
+        for codec, write, read in codecs:
+            repeat = args.repeat if codec == 'bytes' else 1
+            for step, func in (('write', write), ('read', read)):
+                seconds, peak, result = measured(func, repeat)
+                print(f"{label:<9}{codec:<8}{step:<8}{seconds:>10.4f}{peak / 1e6:>10.1f}")
+            assert read()[:size] == message
+
+
+def bench_info(args):
+    """/info latency against pixel count, for full uploads and 64 KB prefixes"""
+    client = app.test_client()
+    print(f"{'megapixels':<12}{'upload':<10}{'bytes':>12}{'seconds':>10}")
+
+    for megapixels in (1, 4, 16, 48):
+        width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+        height = int(megapixels * 1e6 / width)
+        # Flat cover so the PNG stays small enough to upload at any size
+        buffer = io.BytesIO()
+        Image.new('RGB', (width, height), (90, 120, 200)).save(buffer, format='PNG')
+        data = buffer.getvalue()
+
+        for upload, body in (('full', data), ('prefix', data[:64 * 1024])):
+            seconds, response = timed(
+                lambda: client.post('/info', data={'image': (io.BytesIO(body), 'cover.png')}),
+                args.repeat
+            )
+            assert response.status_code == 200, response.get_json()
+            print(f"{megapixels:<12}{upload:<10}{len(body):>12}{seconds:>10.4f}")
+
+
+def bench_bits(args):
+    """Encode/decode time of one payload at 1-4 bits per channel"""
+    S = RGBChannelSteganography
+    cover = make_cover(args.width, args.height)
+    # Payload that needs the whole single-bit ALL capacity
+    message = 'x' * S.capacity_bytes(args.width, args.height, 'ALL', 1)
+    print(f"bits: {args.width}x{args.height}, {len(message)}-byte payload on ALL")
+    print(f"{'bits':<6}{'rows':>8}{'encode s':>10}{'decode s':>10}")
+
+    for bits in range(1, S.MAX_BITS_PER_CHANNEL + 1):
+        encode_seconds, (ok, encoded) = timed(lambda: S.encode_message(cover, message, 'ALL', bits), args.repeat)
+        assert ok, encoded
+        decode_seconds, (ok, decoded) = timed(lambda: S.decode_message(encoded, 'ALL'), args.repeat)
+        assert ok and decoded == message
+        samples = S.HEADER_BITS + -(-len(message) * 8 // bits)
+        rows = -(-samples // (args.width * 3))
+        print(f"{bits:<6}{rows:>8}{encode_seconds:>10.4f}{decode_seconds:>10.4f}")
+
+
+def bench_compression(args):
+    """Stored size and encode time of a JSON log payload per compression codec"""
+    S = RGBChannelSteganography
+    records = [
+        {'ts': 1700000000 + i, 'level': 'info', 'path': '/encode', 'status': 200, 'latency_ms': i % 97}
+        for i in range(20000)
+    ]
+    message = json.dumps(records)
+    cover = make_cover(2048, 2048)
+    print(f"compression: {len(message)}-byte JSON payload, 2048x2048 cover, channel ALL")
+    print(f"{'codec':<11}{'stored':>10}{'rows':>8}{'encode s':>10}{'decode s':>10}")
+
+    for compression in ['auto'] + S.CODECS:
+        report = {}
+        seconds, (ok, encoded) = timed(
+            lambda: S.encode_message(cover, message, 'ALL', compression=compression, report=report),
+            args.repeat
+        )
+        if not ok:
+            print(f"{compression:<11}{'-':>10}{'-':>8}  {encoded}")
+            continue
+        decode_seconds, (ok, decoded) = timed(lambda: S.decode_message(encoded, 'ALL'), args.repeat)
+        assert ok and decoded == message
+        rows = -(-(S.HEADER_BITS + report['stored_bytes'] * 8) // (2048 * 3))
+        label = compression if compression != 'auto' else f"auto:{report['codec']}"
+        print(f"{label:<11}{report['stored_bytes']:>10}{rows:>8}{seconds:>10.4f}{decode_seconds:>10.4f}")
+
+
+def bench_threads(args):
+    """Scaling of embedding/extraction across 1, 2, 4 and 8 threads"""
+    S = RGBChannelSteganography
+    cover = make_cover(args.width, args.height)
+    # Incompressible payload filling the ALL channel capacity at 2 bits
+    rng = np.random.default_rng(1)
+    message = ''.join(map(chr, rng.integers(32, 127, S.capacity_bytes(args.width, args.height, 'ALL', 2))))
+    print(f"threads: {args.width}x{args.height}, {len(message)}-byte payload, ALL, 2 bits per channel")
+    print(f"{'threads':<9}{'encode s':>10}{'speedup':>9}{'decode s':>10}{'speedup':>9}")
+
+    baseline = None
+    reference = None
+    for threads in (1, 2, 4, 8):
+        encode_seconds, (ok, encoded) = timed(
+            lambda: S.encode_message(cover, message, 'ALL', 2, threads=threads), args.repeat
+        )
+        assert ok, encoded
+        decode_seconds, (ok, decoded) = timed(
+            lambda: S.decode_message(encoded, 'ALL', threads=threads), args.repeat
+        )
+        assert ok and decoded == message
+        # Output must be bit-identical to the sequential path
+        output = encoded.tobytes()
+        reference = reference or output
+        assert output == reference, f"output differs with {threads} threads"
+        baseline = baseline or (encode_seconds, decode_seconds)
+        print(f"{threads:<9}{encode_seconds:>10.4f}{baseline[0] / encode_seconds:>9.2f}"
+              f"{decode_seconds:>10.4f}{baseline[1] / decode_seconds:>9.2f}")
+
+
+def bench_stream(args):
+    """Decode of a 1 KB message from a large PNG: full Pillow decode vs row streaming"""
+    S = RGBChannelSteganography
+    message = 'x' * 1024
+    ok, encoded = S.encode_message(make_smooth_cover(args.width, args.height), message, 'R')
+    assert ok, encoded
+    buffer = io.BytesIO()
+    encoded.save(buffer, format='PNG')
+    data = buffer.getvalue()
+    print(f"stream: {args.width}x{args.height} PNG ({len(data) / 1e6:.1f} MB), 1 KB message on R")
+
+    def pillow():
+        return S.decode_message(Image.open(io.BytesIO(data)), 'R')
+
+    def streaming():
+        return S.decode_message(PNGStreamImage.open(io.BytesIO(data)), 'R')
+
+    for label, func in (('pillow', pillow), ('streaming', streaming)):
+        seconds, (ok, decoded) = timed(func, args.repeat)
+        assert ok and decoded == message
+        print(f"{label:<10}{seconds:>10.4f} s")
+
+
+def bench_gigapixel(args):
+    """Strip-wise encode and decode of a huge PNG, checking peak RSS stays bounded"""
+    S = RGBChannelSteganography
+    strip_rows = PNGStreamImage.STRIP_ROWS
+    rng = np.random.default_rng(3)
+    noise = rng.integers(0, 4, (strip_rows, args.width, 3), dtype=np.uint8)
+    message = 'x' * (1 << 20)
+
+    with tempfile.TemporaryFile() as cover, tempfile.TemporaryFile() as encoded:
+        # Synthetic cover written strip by strip, so it never exists in memory
+        start = time.perf_counter()
+        writer = PNGStreamWriter(cover, args.width, args.height, compress_level=1, filter='up')
+        for top in range(0, args.height, strip_rows):
+            rows = min(strip_rows, args.height - top)
+            writer.write_rows(noise[:rows] + np.uint8(top // strip_rows % 200))
+        writer.close()
+        print(f"gigapixel: {args.width}x{args.height} ({args.width * args.height / 1e6:.0f} MP), "
+              f"cover PNG {cover.tell() / 1e6:.1f} MB written in {time.perf_counter() - start:.1f} s")
+
+        cover.seek(0)
+        start = time.perf_counter()
+        ok, strips = S.encode_stream(PNGStreamImage.open(cover), message, 'R')
+        assert ok, strips
+        for chunk in PNGStreamWriter.iter_png(args.width, args.height, strips, compress_level=1, filter='up'):
+            encoded.write(chunk)
+        print(f"{'encode':<10}{time.perf_counter() - start:>10.2f} s")
+
+        encoded.seek(0)
+        start = time.perf_counter()
+        ok, decoded = S.decode_message(PNGStreamImage.open(encoded), 'R')
+        assert ok and decoded == message
+        print(f"{'decode':<10}{time.perf_counter() - start:>10.2f} s")
+
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"peak RSS {peak:.0f} MB (limit {args.rss_limit} MB)")
+    assert peak < args.rss_limit, f"peak RSS {peak:.0f} MB exceeds {args.rss_limit} MB"
+
+
+def bench_uploads(args):
+    """Peak traced allocation per request with uploads buffered in memory vs spooled and mapped"""
+    client = app.test_client()
+    buffer = io.BytesIO()
+    make_cover(args.width, args.height).save(buffer, format='PNG')
+    data = buffer.getvalue()
+    print(f"uploads: {args.width}x{args.height} PNG ({len(data) / 1e6:.1f} MB)")
+    print(f"{'endpoint':<10}{'upload':<10}{'seconds':>10}{'peak MB':>10}")
+
+    spool_bytes = app.config['UPLOAD_SPOOL_BYTES']
+    requests = (
+        ('/info', {}),
+        ('/decode', {}),
+        ('/encode', {'message': 'x' * 1024}),
+    )
+    try:
+        for path, fields in requests:
+            for upload, threshold in (('memory', float('inf')), ('spooled', spool_bytes)):
+                app.config['UPLOAD_SPOOL_BYTES'] = threshold
+
+                def post():
+                    return client.post(path, data={**fields, 'image': (io.BytesIO(data), 'cover.png')})
+
+                seconds, peak, response = measured(post, args.repeat)
+                assert response.status_code in (200, 400), response.get_json()
+                print(f"{path:<10}{upload:<10}{seconds:>10.4f}{peak / 1e6:>10.1f}")
+    finally:
+        app.config['UPLOAD_SPOOL_BYTES'] = spool_bytes
+
+
+def bench_raw(args):
+    """Bytes on the wire and server CPU per request: multipart/JSON endpoints vs raw bodies"""
+    from werkzeug.test import EnvironBuilder
+
+    client = app.test_client()
+    buffer = io.BytesIO()
+    make_cover(args.width, args.height).save(buffer, format='PNG')
+    cover = buffer.getvalue()
+    message = 'x' * 1024
+    ok, encoded = RGBChannelSteganography.encode_message(Image.open(io.BytesIO(cover)), message, 'R')
+    assert ok, encoded
+    buffer = io.BytesIO()
+    encoded.save(buffer, format='PNG')
+    stego = buffer.getvalue()
+    print(f"raw: {args.width}x{args.height} PNG ({len(cover) / 1e6:.2f} MB), 1 KB message on R")
+    print(f"{'request':<22}{'sent bytes':>12}{'received':>12}{'cpu s':>10}")
+
+    requests = (
+        ('/encode (json)', '/encode', lambda: {
+            'data': {'image': (io.BytesIO(cover), 'cover.png'), 'message': message}
+        }),
+        ('/encode/raw', '/encode/raw', lambda: {
+            'data': cover, 'query_string': {'message': message}, 'content_type': 'application/octet-stream'
+        }),
+        ('/decode (json)', '/decode', lambda: {
+            'data': {'image': (io.BytesIO(stego), 'stego.png')}
+        }),
+        ('/decode/raw', '/decode/raw', lambda: {
+            'data': stego, 'content_type': 'application/octet-stream'
+        }),
+    )
+    for label, path, kwargs in requests:
+        environ = EnvironBuilder(path=path, method='POST', **kwargs()).get_environ()
+        sent = int(environ['CONTENT_LENGTH']) + len(environ.get('QUERY_STRING', ''))
+
+        def post():
+            return client.post(path, **kwargs())
+
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.process_time()
+            response = post()
+            best = min(best, time.process_time() - start)
+        assert response.status_code == 200, response.get_json()
+        received = len(response.get_data()) + sum(len(k) + len(v) for k, v in response.headers if k.startswith('X-Stego'))
+        print(f"{label:<22}{sent:>12}{received:>12}{best:>10.4f}")
+
+
+def bench_download(args):
+    """/encode-download output: time to first byte, total time and peak allocation, buffered vs streamed PNG"""
+    ok, encoded = RGBChannelSteganography.encode_message(make_cover(args.width, args.height), 'x' * 1024, 'R')
+    assert ok, encoded
+    print(f"download: {args.width}x{args.height}, 1 KB message on R")
+    print(f"{'response':<10}{'first byte s':>14}{'total s':>10}{'peak MB':>10}{'bytes':>12}")
+
+    def buffered():
+        output = io.BytesIO()
+        encoded.save(output, format='PNG')
+        # Nothing can be sent before the whole PNG is saved
+        yield output.getvalue()
+
+    def streamed():
+        width, height = encoded.size
+        yield from PNGStreamWriter.iter_png(width, height, PNGStreamWriter.image_strips(encoded))
+
+    for label, func in (('buffered', buffered), ('streamed', streamed)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        first_byte = None
+        sent = 0
+        for chunk in func():
+            first_byte = first_byte or time.perf_counter() - start
+            sent += len(chunk)
+        total = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{label:<10}{first_byte:>14.4f}{total:>10.4f}{peak / 1e6:>10.1f}{sent:>12}")
+
+
+def bench_output(args):
+    """Encode time and size of the result image for each output profile across image sizes"""
+    print(f"{'megapixels':<12}{'profile':<10}{'seconds':>10}{'MP/s':>8}{'MB':>8}")
+    for megapixels in (1, 4, 16):
+        width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+        height = int(megapixels * 1e6 / width)
+        cover = make_smooth_cover(width, height)
+        for profile in OUTPUT_PROFILES:
+            seconds, (buffer, _) = timed(lambda: encode_output(cover, profile), args.repeat)
+            assert np.array_equal(np.asarray(Image.open(buffer).convert('RGB')), np.asarray(cover))
+            print(f"{megapixels:<12}{profile:<10}{seconds:>10.4f}{width * height / 1e6 / seconds:>8.1f}"
+                  f"{buffer.getbuffer().nbytes / 1e6:>8.2f}")
+
+
+def bench_deflate(args):
+    """PNG output time across 1, 2, 4 and 8 deflate threads (balanced profile)"""
+    cover = make_smooth_cover(args.width, args.height)
+    settings = OUTPUT_PROFILES['balanced']
+    print(f"deflate: {args.width}x{args.height}, balanced profile")
+    print(f"{'threads':<9}{'seconds':>10}{'speedup':>9}{'MB':>8}")
+
+    def write(threads):
+        output = io.BytesIO()
+        writer = PNGStreamWriter(output, args.width, args.height, settings['compress_level'], settings['filter'], threads)
+        for strip in PNGStreamWriter.image_strips(cover):
+            writer.write_rows(strip)
+        writer.close()
+        return output
+
+    baseline = None
+    for threads in (1, 2, 4, 8):
+        seconds, output = timed(lambda: write(threads), args.repeat)
+        # Segmented output must still be a standard PNG
+        assert np.array_equal(np.asarray(Image.open(output)), np.asarray(cover))
+        baseline = baseline or seconds
+        print(f"{threads:<9}{seconds:>10.4f}{baseline / seconds:>9.2f}{output.getbuffer().nbytes / 1e6:>8.2f}")
+
+
+def bench_inplace(args):
+    """/encode-download of a BMP cover: in-place edit vs Pillow decode and BMP or PNG re-encode"""
+    client = app.test_client()
+    buffer = io.BytesIO()
+    make_smooth_cover(args.width, args.height).save(buffer, format='BMP')
+    cover = buffer.getvalue()
+    print(f"inplace: {args.width}x{args.height} BMP ({len(cover) / 1e6:.1f} MB), 1 KB message on R")
+    print(f"{'output':<10}{'seconds':>10}{'MB out':>9}")
+
+    for output in ('same', 'bmp', 'fastest'):
+        def post():
+            response = client.post('/encode-download', data={
+                'image': (io.BytesIO(cover), 'cover.bmp'), 'message': 'x' * 1024, 'output': output
+            })
+            return response, response.get_data()
+
+        seconds, (response, body) = timed(post, args.repeat)
+        assert response.status_code == 200, body[:200]
+        print(f"{output:<10}{seconds:>10.4f}{len(body) / 1e6:>9.1f}")
+
+
+def bench_modes(args):
+    """Encode/decode in each native mode vs converting the cover to RGB first"""
+    rng = np.random.default_rng(4)
+    width, height = args.width, args.height
+    covers = {
+        'RGB': make_cover(width, height),
+        'RGBA': Image.fromarray(rng.integers(0, 256, (height, width, 4), dtype=np.uint8), 'RGBA'),
+        'L': Image.fromarray(rng.integers(0, 256, (height, width), dtype=np.uint8), 'L'),
+        'P': make_smooth_cover(width, height).quantize(64),
+        'I;16': Image.fromarray(rng.integers(0, 1 << 16, (height, width), dtype=np.uint16)),
+    }
+    message = 'x' * 1024
+    print(f"modes: {width}x{height}, 1 KB message on ALL (frame MB: pixel storage of the embedded image)")
+    print(f"{'mode':<6}{'frame MB':>10}{'encode s':>10}{'decode s':>10}{'as RGB s':>10}")
+
+    for mode, cover in covers.items():
+        encode_seconds, (ok, encoded) = timed(
+            lambda: RGBChannelSteganography.encode_message(cover, message, 'ALL'), args.repeat
+        )
+        assert ok and encoded.mode == mode, encoded
+        decode_seconds, (ok, decoded) = timed(lambda: RGBChannelSteganography.decode_message(encoded, 'ALL'), args.repeat)
+        assert ok and decoded == message
+        rgb_seconds, _ = timed(
+            lambda: RGBChannelSteganography.encode_message(cover.convert('RGB'), message, 'ALL', in_place=True),
+            args.repeat
+        )
+        frame_bytes = np.asarray(encoded).nbytes
+        print(f"{mode:<6}{frame_bytes / 1e6:>10.1f}{encode_seconds:>10.4f}{decode_seconds:>10.4f}{rgb_seconds:>10.4f}")
+
+
+def bench_frames(args):
+    """Encode/decode payloads spread over APNG frames at 1 thread vs the pool"""
+    rng = np.random.default_rng(5)
+    width, height = args.width, args.height
+    frames = [Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)) for _ in range(16)]
+    cover = io.BytesIO()
+    frames[0].save(cover, format='PNG', save_all=True, append_images=frames[1:], duration=40)
+    capacity = sum(RGBChannelSteganography.frame_capacities([((width, height), 'RGB')] * len(frames), 'ALL'))
+    print(f"frames: {len(frames)} frames of {width}x{height}, balanced APNG output, channel ALL")
+    print(f"{'payload':<10}{'threads':>8}{'encode s':>10}{'decode s':>10}")
+
+    for label, size in [('1 frame', capacity // len(frames) // 2), ('all', capacity * 3 // 4)]:
+        message = 'x' * size
+        for threads in (1, None):
+            def encode():
+                sequence = FrameSequence.open(Image.open(io.BytesIO(cover.getvalue())))
+                ok, images = RGBChannelSteganography.encode_frames(sequence, message, 'ALL', threads=threads)
+                assert ok, images
+                return encode_output_frames(sequence, images, 'balanced')[0]
+            encode_seconds, encoded = timed(encode, args.repeat)
+
+            def decode():
+                sequence = FrameSequence.open(Image.open(io.BytesIO(encoded.getvalue())))
+                return RGBChannelSteganography.decode_frames(sequence, 'ALL', threads=threads)
+            decode_seconds, (ok, decoded) = timed(decode, args.repeat)
+            assert ok and decoded == message
+            print(f"{label:<10}{threads or 'pool':>8}{encode_seconds:>10.4f}{decode_seconds:>10.4f}")
+
+
+def bench_batch(args):
+    """Images per second: one /encode or /decode request per image vs the batch endpoints"""
+    client = app.test_client()
+    covers = []
+    for index in range(args.items):
+        buffer = io.BytesIO()
+        make_cover(args.width, args.height, seed=index).save(buffer, format='PNG')
+        covers.append(buffer.getvalue())
+    messages = [f'tracking-id-{index:08d}' for index in range(args.items)]
+    print(f"batch: {args.items} {args.width}x{args.height} PNG covers, {app.config['BATCH_PROCESSES']} worker processes")
+    print(f"{'requests':<22}{'seconds':>10}{'images/s':>10}")
+
+    def one_by_one():
+        for cover, message in zip(covers, messages):
+            response = client.post('/encode', data={'image': (io.BytesIO(cover), 'cover.png'), 'message': message})
+            assert response.status_code == 200, response.get_json()
+
+    def batch(response_format):
+        def post():
+            response = client.post('/encode/batch', data={
+                'image': [(io.BytesIO(cover), 'cover.png') for cover in covers],
+                'message': messages,
+                'format': response_format,
+            })
+            assert response.status_code == 200 and len(response.data) > 0
+        return post
+
+    stegos = []
+    for cover, message in zip(covers, messages):
+        ok, encoded = RGBChannelSteganography.encode_message(Image.open(io.BytesIO(cover)), message, 'R')
+        assert ok, encoded
+        buffer = io.BytesIO()
+        encoded.save(buffer, format='PNG')
+        stegos.append(buffer.getvalue())
+
+    def decode_one_by_one():
+        for stego in stegos:
+            response = client.post('/decode', data={'image': (io.BytesIO(stego), 'stego.png'), 'channel': 'AUTO'})
+            assert response.status_code == 200, response.get_json()
+
+    def decode_batch():
+        response = client.post('/decode/batch', data={
+            'image': [(io.BytesIO(stego), 'stego.png') for stego in stegos],
+            'channel': 'AUTO',
+        })
+        assert all(json.loads(line)['success'] for line in response.data.splitlines())
+
+    batch('ndjson')()  # start the worker processes
+    for label, func in [('/encode x N', one_by_one), ('/encode/batch (zip)', batch('zip')),
+                        ('/encode/batch (ndjson)', batch('ndjson')), ('/decode x N', decode_one_by_one),
+                        ('/decode/batch', decode_batch)]:
+        seconds, _ = timed(func, args.repeat)
+        print(f"{label:<22}{seconds:>10.3f}{args.items / seconds:>10.1f}")
+
+
+def bench_jobs(args):
+    """Time until the response of synchronous /encode vs /jobs/encode, and until the job's result"""
+    client = app.test_client()
+    buffer = io.BytesIO()
+    make_smooth_cover(args.width, args.height).save(buffer, format='JPEG', quality=95)
+    cover = buffer.getvalue()
+    print(f"jobs: {args.width}x{args.height} JPEG, 1 KB message, {app.config['JOB_STORE']} job store")
+    print(f"{'request':<22}{'response s':>12}{'result s':>10}")
+
+    def form():
+        return {'image': (io.BytesIO(cover), 'cover.jpg'), 'message': 'x' * 1024}
+
+    def sync():
+        response = client.post('/encode', data=form())
+        assert response.status_code == 200, response.get_json()
+
+    def job():
+        start = time.perf_counter()
+        response = client.post('/jobs/encode', data=form())
+        assert response.status_code == 202, response.get_json()
+        accepted = time.perf_counter() - start
+        while True:
+            status = client.get(response.headers['Location']).get_json()
+            if status['status'] in ('done', 'failed'):
+                break
+            time.sleep(0.05)
+        assert status['status'] == 'done', status
+        assert client.get(status['result_url']).status_code == 200
+        return accepted
+
+    sync_seconds, _ = timed(sync, args.repeat)
+    print(f"{'/encode':<22}{sync_seconds:>12.3f}{sync_seconds:>10.3f}")
+    job_seconds, accepted = timed(job, args.repeat)
+    print(f"{'/jobs/encode':<22}{accepted:>12.3f}{job_seconds:>10.3f}")
+
+
+def bench_cache(args):
+    """Latency of requests answered by the result cache vs computed, and of covers reused from the shared cache"""
+    client = app.test_client()
+    buffer = io.BytesIO()
+    make_smooth_cover(args.width, args.height).save(buffer, format='JPEG', quality=95)
+    cover = buffer.getvalue()
+    print(f"cache: {args.width}x{args.height} JPEG, 1 KB message, {app.config['CACHE_BYTES'] >> 20} MB cache")
+    print(f"{'request':<16}{'miss s':>10}{'hit s':>10}{'speedup':>9}")
+    misses = iter(range(1, 1 << 30))
+
+    def encode(message):
+        response = client.post('/encode-download', data={'image': (io.BytesIO(cover), 'cover.jpg'), 'message': message})
+        assert response.status_code == 200, response.get_json()
+        response.data  # streamed PNGs are cached once the whole body has been sent
+        return response
+
+    def decode(max_length):
+        response = client.post('/decode/raw?channel=R&max_length=%d' % max_length, data=encoded)
+        assert response.status_code == 200, response.get_json()
+        return response
+
+    encoded = encode('x' * 1024).data
+    for name, request, key in [('/encode-download', encode, lambda n: 'x' * 1023 + str(n)),
+                               ('/decode/raw', decode, lambda n: (1 << 20) + n)]:
+        miss_seconds, response = timed(lambda: request(key(next(misses))), args.repeat)
+        assert response.headers['X-Cache'] == 'MISS'
+        request(key(0))
+        hit_seconds, response = timed(lambda: request(key(0)), args.repeat)
+        assert response.headers['X-Cache'] == 'HIT'
+        print(f"{name:<16}{miss_seconds:>10.4f}{hit_seconds:>10.4f}{miss_seconds / hit_seconds:>8.1f}x")
+    print(json.dumps(result_cache().stats()))
+
+    # A new message for a known cover misses the result cache but reuses the
+    # PNG cover decoded into the shared cache (TIFF output, so decoding dominates)
+    shared_bytes = app.config['SHARED_CACHE_BYTES']
+    if not shared_bytes:
+        return
+    print(f"\n{'new message':<16}{'decode s':>10}{'shared s':>10}{'speedup':>9}")
+
+    buffer = io.BytesIO()
+    make_smooth_cover(args.width, args.height).save(buffer, format='PNG')
+    png_cover = buffer.getvalue()
+
+    def encode_tiff():
+        response = client.post('/encode/raw?output=tiff&message=%d' % next(misses), data=png_cover)
+        assert response.status_code == 200, response.get_json()
+
+    app.config['SHARED_CACHE_BYTES'] = 0
+    decode_seconds, _ = timed(encode_tiff, args.repeat)
+    app.config['SHARED_CACHE_BYTES'] = shared_bytes
+    encode_tiff()  # a cover is published the second time it is seen
+    encode_tiff()
+    shared_seconds, _ = timed(encode_tiff, args.repeat)
+    print(f"{'/encode/raw':<16}{decode_seconds:>10.4f}{shared_seconds:>10.4f}{decode_seconds / shared_seconds:>8.1f}x")
+    print(json.dumps(shared_cache().stats()))
+
+
+def copies_case(name, width, height):
+    """
+    Peak resident bytes one copies benchmark case adds, on a single thread
+    
+    Run in a fresh process per case, so memory freed by an earlier case
+    cannot hide allocations; RSS counts Pillow's and NumPy's C buffers.
+    """
+    RGBChannelSteganography.THREADS = 1
+    app.config['CACHE_BYTES'] = app.config['SHARED_CACHE_BYTES'] = 0
+    app.config['ASYNC_PROMOTE_SECONDS'] = 0
+    client = app.test_client()
+    cover = make_smooth_cover(width, height)
+    ok, encoded = RGBChannelSteganography.encode_message(cover, 'x' * 1024, 'R')
+    assert ok, encoded
+    buffer = io.BytesIO()
+    (encoded if name == 'POST /decode' else cover).save(buffer, format='PNG', compress_level=1)
+    data = buffer.getvalue()
+
+    def convert_and_copy():
+        # The pipeline before copy-free embedding: convert, array, astype, fromarray
+        pixels = np.array(cover.convert('RGB'))
+        return Image.fromarray(pixels.astype(np.uint8))
+
+    def post(path, **fields):
+        response = client.post(path, data={**fields, 'image': (io.BytesIO(data), 'cover.png')})
+        assert response.status_code == 200, response.get_json()
+        return response
+
+    func = {
+        'convert + copy': convert_and_copy,
+        'encode_message': lambda: RGBChannelSteganography.encode_message(cover, 'x' * 1024, 'R'),
+        'encode in place': lambda: RGBChannelSteganography.encode_message(cover, 'x' * 1024, 'R', in_place=True),
+        'decode_message': lambda: RGBChannelSteganography.decode_message(encoded, 'R'),
+        'POST /encode': lambda: post('/encode', message='x' * 1024),
+        'POST /decode': lambda: post('/decode'),
+    }[name]
+    baseline = reset_peak_rss()
+    assert baseline is not None, 'the copies benchmark needs /proc/self/clear_refs (Linux)'
+    func()
+    return peak_rss() - baseline
+
+
+def bench_copies(args):
+    """Full-frame copies per operation: peak RSS growth (C allocations included) in frames, single-threaded"""
+    frame = args.width * args.height * 3
+    print(f"copies: {args.width}x{args.height} RGB cover ({frame / 1e6:.1f} MB frame), 1 KB message, 1 thread")
+    print(f"{'operation':<18}{'peak MB':>10}{'frames':>8}")
+    context = multiprocessing.get_context('spawn')
+    for name in ['convert + copy', 'encode_message', 'encode in place', 'decode_message',
+                 'POST /encode', 'POST /decode']:
+        with context.Pool(1) as pool:
+            grown = pool.apply(copies_case, (name, args.width, args.height))
+        print(f"{name:<18}{grown / 1e6:>10.1f}{grown / frame:>8.2f}")
+
+
+def parse_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmark', choices=['encode', 'decode', 'codec', 'info', 'bits', 'compression', 'threads',
+                                              'stream', 'gigapixel', 'uploads', 'raw',
+                                              'download', 'output', 'deflate',
+                                              'inplace', 'modes', 'frames', 'batch', 'jobs', 'cache',
+                                              'copies'])
+    parser.add_argument('--size', type=parse_size, default=(1024, 1024), help='cover size as WIDTHxHEIGHT')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--string-limit', type=int, default=1 << 20,
+                        help='largest payload (bytes) run through the string codec in the codec benchmark')
+    parser.add_argument('--items', type=int, default=32, help='images per request in the batch benchmark')
+    parser.add_argument('--rss-limit', type=int, default=256,
+                        help='peak resident memory (MB) allowed by the gigapixel benchmark')
+    args = parser.parse_args()
+    args.width, args.height = args.size
+
+    {
+        'encode': bench_encode,
+        'decode': bench_decode,
+        'codec': bench_codec,
+        'info': bench_info,
+        'bits': bench_bits,
+        'compression': bench_compression,
+        'threads': bench_threads,
+        'stream': bench_stream,
+        'gigapixel': bench_gigapixel,
+        'uploads': bench_uploads,
+        'raw': bench_raw,
+        'download': bench_download,
+        'output': bench_output,
+        'deflate': bench_deflate,
+        'inplace': bench_inplace,
+        'modes': bench_modes,
+        'frames': bench_frames,
+        'batch': bench_batch,
+        'jobs': bench_jobs,
+        'cache': bench_cache,
+        'copies': bench_copies,
+    }[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,141 +1,2100 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Request, request, jsonify, send_file, g, abort
 from flask_cors import CORS
 import numpy as np
-from PIL import Image
+from PIL import Image, TiffImagePlugin
 import io
 import base64
 import os
 import tempfile
 import uuid
+import struct
+import math
+import threading
+import itertools
+import time
+import json
+import sqlite3
+import zipfile
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, deque
+import zlib
+import hashlib
+import bz2
+import lzma
+import mmap
+import shutil
+from urllib.parse import unquote
 from werkzeug.utils import secure_filename
 
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=[
+    'X-Stego-Channel', 'X-Stego-Channel-Detected', 'X-Stego-Bits-Per-Channel', 'X-Stego-Message-Length',
+    'X-Stego-Compression', 'X-Stego-Payload-Bytes', 'X-Stego-Compressed-Bytes', 'X-Stego-Output-Profile',
+    'X-Stego-Encode-Seconds', 'X-Stego-Frames', 'X-Stego-Batch-Items', 'X-Cache',
+])
 
 # Configuration
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Upload size limits: a default plus per-endpoint overrides, enforced while
+# the body is read (SpoolingRequest.max_content_length). MAX_CONTENT_LENGTH,
+# the largest limit, applies to requests that match no endpoint.
+app.config['UPLOAD_LIMIT'] = int(os.environ.get('STEGO_UPLOAD_LIMIT_MB', 16)) * 1024 * 1024  # 16MB max file size
+app.config['UPLOAD_LIMITS'] = {
+    'encode_download': int(os.environ.get('STEGO_STREAM_UPLOAD_LIMIT_MB', 1024)) * 1024 * 1024,
+    'encode_batch': int(os.environ.get('STEGO_BATCH_UPLOAD_LIMIT_MB', 256)) * 1024 * 1024,
+    'decode_batch': int(os.environ.get('STEGO_BATCH_UPLOAD_LIMIT_MB', 256)) * 1024 * 1024,
+    'create_encode_job': int(os.environ.get('STEGO_JOB_UPLOAD_LIMIT_MB', 1024)) * 1024 * 1024,
+    'create_decode_job': int(os.environ.get('STEGO_JOB_UPLOAD_LIMIT_MB', 1024)) * 1024 * 1024,
+}
+app.config['MAX_CONTENT_LENGTH'] = max([app.config['UPLOAD_LIMIT']] + list(app.config['UPLOAD_LIMITS'].values()))
 
-# Allowed file extensions
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp'}
+# PNG covers with at least this many pixels are encoded strip by strip by
+# /encode-download instead of being decoded whole
+app.config['STREAM_MIN_PIXELS'] = int(os.environ.get('STEGO_STREAM_MIN_PIXELS', 50_000_000))
+
+# Uploads larger than UPLOAD_SPOOL_BYTES are written straight to an unlinked
+# temp file in UPLOAD_SPOOL_DIR and memory-mapped, instead of buffered in RAM
+app.config['UPLOAD_SPOOL_BYTES'] = int(os.environ.get('STEGO_UPLOAD_SPOOL_KB', 512)) * 1024
+app.config['UPLOAD_SPOOL_DIR'] = os.environ.get('STEGO_UPLOAD_SPOOL_DIR') or tempfile.gettempdir()
+
+# Debugging aid: report the peak resident memory a request added (X-Allocated-
+# Bytes header), for requests that ran alone in their worker (Linux only)
+app.config['ALLOCATION_REPORT'] = os.environ.get('STEGO_ALLOCATION_REPORT') == '1'
+
+# Seconds the 'auto' output profile may spend encoding the result image
+app.config['OUTPUT_LATENCY_BUDGET'] = float(os.environ.get('STEGO_OUTPUT_LATENCY_BUDGET', 1.0))
+
+# /encode/batch and /decode/batch: worker processes items are spread over, and
+# images per request
+app.config['BATCH_PROCESSES'] = int(os.environ.get('STEGO_BATCH_PROCESSES', os.cpu_count() or 1))
+app.config['BATCH_MAX_ITEMS'] = int(os.environ.get('STEGO_BATCH_MAX_ITEMS', 1000))
+
+# Result cache: repeated encode/decode requests (same upload bytes and
+# parameters) are answered from a per-worker LRU of CACHE_BYTES; 0 disables it
+app.config['CACHE_BYTES'] = int(os.environ.get('STEGO_CACHE_MB', 64)) * 1024 * 1024
+app.config['CACHE_TTL'] = float(os.environ.get('STEGO_CACHE_TTL_SECONDS', 600))
+
+# Shared cache: a second tier behind the result cache, shared by every worker
+# of a host, holding results and decoded covers (of SHARED_COVER_MIN_PIXELS or
+# more) as files in SHARED_CACHE_DIR (a tmpfs such as /dev/shm keeps them in
+# memory); SHARED_CACHE_BYTES 0 disables it
+app.config['SHARED_CACHE_DIR'] = os.environ.get('STEGO_SHARED_CACHE_DIR') or os.path.join(tempfile.gettempdir(),
+                                                                                        'stego-cache')
+app.config['SHARED_CACHE_BYTES'] = int(os.environ.get('STEGO_SHARED_CACHE_MB', 256)) * 1024 * 1024
+app.config['SHARED_COVER_MIN_PIXELS'] = int(os.environ.get('STEGO_SHARED_COVER_MIN_PIXELS', 1 << 20))
+
+# Jobs: where job state lives ('sqlite', shared by the workers of a host and
+# kept across restarts, or 'memory'), the threads running jobs per worker and
+# how long finished jobs are kept
+app.config['JOB_STORE'] = os.environ.get('STEGO_JOB_STORE', 'sqlite')
+app.config['JOB_DIR'] = os.environ.get('STEGO_JOB_DIR') or os.path.join(tempfile.gettempdir(), 'stego-jobs')
+app.config['JOB_WORKERS'] = int(os.environ.get('STEGO_JOB_WORKERS', 2))
+app.config['JOB_TTL'] = int(os.environ.get('STEGO_JOB_TTL_SECONDS', 3600))
+
+# /encode, /encode-download and /decode answer 202 with a job instead when the
+# estimated work exceeds this many seconds (0 never promotes); kept well
+# below gunicorn's --timeout
+app.config['ASYNC_PROMOTE_SECONDS'] = float(os.environ.get('STEGO_ASYNC_PROMOTE_SECONDS', 30))
+
+# Allowed file extensions (WebP and TIFF so lossless outputs can be decoded
+# again, GIF/APNG for animations)
+ALLOWED_EXTENSIONS = {'png', 'apng', 'jpg', 'jpeg', 'bmp', 'webp', 'tif', 'tiff', 'ppm', 'gif'}
+# Pillow formats accepted from raw bodies, which carry no filename
+ALLOWED_FORMATS = {'PNG', 'JPEG', 'BMP', 'WEBP', 'TIFF', 'PPM', 'GIF'}
+
+# Lossless output encodings; megapixels_per_second is the encode throughput
+# measured with `benchmark.py output` and drives the 'auto' profile
+OUTPUT_PROFILES = {
+    'fastest': {'format': 'PNG', 'compress_level': 1, 'filter': 'up', 'megapixels_per_second': 12},
+    'balanced': {'format': 'PNG', 'compress_level': 6, 'filter': 'adaptive', 'megapixels_per_second': 1.2},
+    'smallest': {'format': 'PNG', 'compress_level': 9, 'filter': 'adaptive', 'megapixels_per_second': 0.5},
+    'webp': {'format': 'WEBP', 'options': {'lossless': True, 'quality': 100, 'method': 4, 'exact': True}, 'megapixels_per_second': 0.15},
+    'bmp': {'format': 'BMP', 'options': {}, 'megapixels_per_second': 300},
+    'tiff': {'format': 'TIFF', 'options': {}, 'megapixels_per_second': 300},
+}
+# Modes each output format stores losslessly (WebP has no palette or grayscale,
+# BMP no alpha or 16-bit samples)
+OUTPUT_MODES = {
+    'PNG': {'RGB', 'RGBA', 'L', 'P', 'I;16', 'I;16B'},
+    'WEBP': {'RGB', 'RGBA'},
+    'BMP': {'RGB', 'L', 'P'},
+    'TIFF': {'RGB', 'RGBA', 'L', 'P', 'I;16', 'I;16B'},
+}
+OUTPUT_MIMETYPES = {
+    'PNG': 'image/png', 'WEBP': 'image/webp', 'BMP': 'image/bmp', 'TIFF': 'image/tiff',
+    'PPM': 'image/x-portable-pixmap',
+}
+# output=same keeps the input format; uncompressed BMP/PPM/TIFF inputs are
+# edited in place (RawPixelImage), others map to a lossless profile
+SAME_FORMAT_PROFILES = {'WEBP': 'webp', 'BMP': 'bmp', 'TIFF': 'tiff'}
+# Tried by 'auto' from smallest to largest output
+AUTO_OUTPUT_ORDER = ['smallest', 'balanced', 'fastest']
+# Decode throughput of input formats (single core, 4 MP photo-like image),
+# used to estimate the work of a request
+DECODE_MEGAPIXELS_PER_SECOND = {'PNG': 25, 'JPEG': 150, 'WEBP': 17, 'GIF': 50, 'BMP': 190, 'TIFF': 190, 'PPM': 190}
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-class RGBChannelSteganography:
+def upload_limit(endpoint=None):
+    """Upload size limit in bytes for an endpoint (the current one by default)"""
+    return app.config['UPLOAD_LIMITS'].get(endpoint or request.endpoint, app.config['UPLOAD_LIMIT'])
+
+def upload_stream(file):
     """
-    RGB Channel Steganography implementation
-    Hides messages by modifying the least significant bit of RGB channels
+    Seekable stream over an uploaded file
+    
+    Spooled uploads are memory-mapped read-only, so decoders page the file in
+    from the page cache instead of copying it; the map is closed at request
+    end. Small in-memory uploads are returned as they are.
+    """
+    return map_stream(file.stream)
+
+def map_stream(stream):
+    """Memory-map a file-backed stream for the rest of the request, if it has a file"""
+    try:
+        fileno = stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return stream
+    
+    stream.flush()
+    if os.fstat(fileno).st_size == 0:
+        return stream
+    upload_map = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    g.setdefault('upload_maps', []).append(upload_map)
+    return upload_map
+
+def writable_upload(stream):
     """
+    Private writable copy of an upload, for editing pixels in place
     
-    @staticmethod
-    def string_to_binary(message):
-        """Convert string to binary with delimiter"""
-        binary = ''.join(format(ord(char), '08b') for char in message)
-        return binary + '1111111111111110'  # End delimiter
+    File-backed uploads are mapped copy-on-write, so only the pages that are
+    modified get copied; in-memory (small) uploads are copied. The map is
+    closed at request end unless detached with detach_upload.
+    """
+    try:
+        fileno = stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return bytearray(stream.getvalue())
     
-    @staticmethod
-    def binary_to_string(binary):
-        """Convert binary to string, stopping at delimiter"""
-        delimiter = '1111111111111110'
-        if delimiter in binary:
-            binary = binary[:binary.index(delimiter)]
+    stream.flush()
+    upload_map = mmap.mmap(fileno, 0, access=mmap.ACCESS_COPY)
+    g.setdefault('upload_maps', []).append(upload_map)
+    return upload_map
+
+def raw_pixel_target(image, stream, output, length=None):
+    """
+    RawPixelImage for encoding an upload in place, or None
+    
+    Only used when output is unset or 'same' and the lazily opened image
+    stores uncompressed RGB(A) rows; stream is the underlying upload file.
+    """
+    if output not in (None, 'same') or RGBChannelSteganography.ENGINE == 'legacy':
+        return None
+    layout = RawPixelImage.layout(image)
+    if layout is None:
+        return None
+    return RawPixelImage(writable_upload(stream), image.format, image.size, layout, length, image.mode)
+
+def raw_pixel_source(image, stream):
+    """
+    Read-only RawPixelImage over an upload for decoding, or image itself
+    
+    stream is what upload_stream/raw_upload_stream returned; images that are
+    not stored as uncompressed RGB(A) rows are returned unchanged.
+    """
+    layout = RawPixelImage.layout(image) if RGBChannelSteganography.ENGINE != 'legacy' else None
+    if layout is None:
+        return image
+    buffer = stream if isinstance(stream, mmap.mmap) else stream.getvalue()
+    return RawPixelImage(buffer, image.format, image.size, layout, mode=image.mode)
+
+def detach_upload(stream):
+    """
+    Take ownership of an upload stream so it outlives the request
+    
+    Streamed responses are generated after teardown has closed the upload;
+    a memory map stays valid on its own and is no longer closed at request
+    end, and an in-memory upload is copied. The caller closes the result.
+    """
+    maps = g.get('upload_maps', [])
+    for index, upload_map in enumerate(maps):
+        if upload_map is stream:
+            del maps[index]
+            return stream
+    copy = io.BytesIO(stream.getvalue())
+    copy.seek(stream.tell())
+    return copy
+
+def raw_upload_stream():
+    """
+    Seekable stream over a raw (non-multipart) request body
+    
+    Bodies above UPLOAD_SPOOL_BYTES, or without a Content-Length, are
+    copied to a spooled temp file and memory-mapped like multipart uploads;
+    smaller ones are read into memory. A body already spooled by
+    check_upload_limit is returned as is.
+    """
+    if 'raw_upload_stream' in g:
+        return g.pop('raw_upload_stream')
+    if request.content_length is not None and request.content_length <= app.config['UPLOAD_SPOOL_BYTES']:
+        return io.BytesIO(request.get_data(cache=False))
+    
+    spool = tempfile.TemporaryFile('w+b', dir=app.config['UPLOAD_SPOOL_DIR'])
+    request._spool_files = getattr(request, '_spool_files', []) + [spool]
+    g.raw_upload_file = spool
+    shutil.copyfileobj(request.stream, spool, 1 << 20)
+    spool.seek(0)
+    return map_stream(spool)
+
+def stream_length(stream):
+    """Length in bytes of a seekable stream, which is left at its start"""
+    stream.seek(0, os.SEEK_END)
+    length = stream.tell()
+    stream.seek(0)
+    return length
+
+def raw_upload_file(stream):
+    """Underlying file of a stream from raw_upload_stream (the spool file if spooled)"""
+    return g.get('raw_upload_file', stream)
+
+def raw_param(name, default=None):
+    """
+    Parameter of a raw endpoint, from the query string or an X-Stego-* header
+    
+    'bits_per_channel' is read from ?bits_per_channel= or the
+    X-Stego-Bits-Per-Channel header; header values are percent-decoded.
+    """
+    if name in request.args:
+        return request.args[name]
+    header = 'X-Stego-' + '-'.join(part.capitalize() for part in name.split('_'))
+    if header in request.headers:
+        return unquote(request.headers[header])
+    return default
+
+def parse_bits_per_channel(value):
+    """Parse the bits_per_channel form field; returns None if it is invalid"""
+    try:
+        bits = int(value)
+    except (TypeError, ValueError):
+        return None
+    return bits if 1 <= bits <= RGBChannelSteganography.MAX_BITS_PER_CHANNEL else None
+
+def output_profile(name, width, height, budget=None, source_format=None):
+    """
+    Resolve the output parameter to a profile name
+    
+    'auto' picks the profile with the smallest output whose estimated encode
+    time for the image fits the latency budget (OUTPUT_LATENCY_BUDGET by
+    default), falling back to 'fastest'. 'same' picks the profile matching
+    source_format ('balanced' PNG if there is none). Returns None for
+    unknown names.
+    """
+    if name == 'same':
+        return SAME_FORMAT_PROFILES.get(source_format, 'balanced')
+    if name != 'auto':
+        return name if name in OUTPUT_PROFILES else None
+    
+    budget = app.config['OUTPUT_LATENCY_BUDGET'] if budget is None else budget
+    megapixels = width * height / 1e6
+    for candidate in AUTO_OUTPUT_ORDER:
+        if megapixels / OUTPUT_PROFILES[candidate]['megapixels_per_second'] <= budget:
+            return candidate
+    return 'fastest'
+
+def estimate_seconds(megapixels, source_format, profile=None):
+    """
+    Estimated seconds to decode an image and, with a profile, write the output
+    
+    Embedding itself is cheap next to decoding and encoding the image file,
+    so it is left out.
+    """
+    seconds = megapixels / DECODE_MEGAPIXELS_PER_SECOND.get(source_format, 25)
+    if profile is not None:
+        seconds += megapixels / OUTPUT_PROFILES[profile]['megapixels_per_second']
+    return seconds
+
+def parse_latency_budget(value):
+    """Parse the latency_budget field (seconds); returns None if it is invalid"""
+    try:
+        budget = float(value)
+    except (TypeError, ValueError):
+        return None
+    return budget if budget > 0 else None
+
+def encode_output(image, profile):
+    """
+    Encode a PIL image with an output profile, keeping its mode
+    
+    PNGStreamWriter writes RGB, RGBA and grayscale PNGs; palette and 16-bit
+    images are saved by Pillow at the profile's compression level. Raises
+    ValueError if the profile's format cannot store the mode losslessly.
+    
+    Returns:
+        (BytesIO positioned at 0, seconds spent encoding)
+    """
+    settings = OUTPUT_PROFILES[profile]
+    if image.mode not in OUTPUT_MODES[settings['format']]:
+        raise ValueError(f"{settings['format']} cannot store {image.mode} images losslessly; use a PNG or TIFF profile")
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    if settings['format'] == 'PNG' and image.mode in PNGStreamWriter.COLOR_TYPES:
+        width, height = image.size
+        writer = PNGStreamWriter(buffer, width, height, settings['compress_level'], settings['filter'], mode=image.mode,
+                                 transparency=image.info.get('transparency'))
+        for strip in PNGStreamWriter.image_strips(image):
+            writer.write_rows(strip)
+        writer.close()
+    elif settings['format'] == 'PNG':
+        image.save(buffer, format='PNG', compress_level=settings['compress_level'])
+    else:
+        image.save(buffer, format=settings['format'], **settings['options'])
+    buffer.seek(0)
+    return buffer, time.perf_counter() - start
+
+def frames_output_profile(frames, output=None, budget=None):
+    """
+    Resolve the output parameter for a multi-frame result, or None
+    
+    Animations default to 'same' (APNG with the balanced profile) and may
+    also be written as multi-page TIFF; TIFF pages differ in size and mode,
+    so they are always written as TIFF. None if output cannot hold the frames.
+    """
+    if not frames.animated and output in (None, 'same', 'auto'):
+        return 'tiff'
+    width, height = frames.size
+    profile = output_profile(output or 'same', width, height * len(frames), budget, frames.format)
+    if profile is None or OUTPUT_PROFILES[profile]['format'] not in frames.output_formats:
+        return None
+    return profile
+
+def encode_output_frames(frames, images, profile):
+    """
+    Encode the frames of a FrameSequence with an output profile
+    
+    PNG profiles write an APNG with PNGStreamWriter, tiff a multi-page TIFF;
+    images (the encoded frames) are consumed one at a time.
+    
+    Returns:
+        (BytesIO positioned at 0, seconds spent embedding and encoding)
+    """
+    settings = OUTPUT_PROFILES[profile]
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    if settings['format'] == 'PNG':
+        width, height = frames.size
+        writer = PNGStreamWriter(buffer, width, height, settings['compress_level'], settings['filter'],
+                                 mode=frames.mode, frames=len(frames), loops=frames.loop)
+        for image in images:
+            writer.start_frame(image.info.get('duration', FrameSequence.DURATION))
+            for strip in PNGStreamWriter.image_strips(image):
+                writer.write_rows(strip)
+        writer.close()
+    else:
+        tiff = TiffImagePlugin.AppendingTiffWriter(buffer)
+        for image in images:
+            image.save(tiff, format='TIFF')
+            tiff.newFrame()
+        # The writer is a BytesIO whose close() (run when it is collected)
+        # seeks buffer, so drop it before rewinding
+        del tiff
+    buffer.seek(0)
+    return buffer, time.perf_counter() - start
+
+def encode_metadata(channel, bits_per_channel, message, payload_report, output_format, profile, encode_seconds,
+                    frames=1):
+    """Metadata of an encode result as returned by /encode, without original_filename"""
+    return {
+        'channel_used': channel,
+        'bits_per_channel': bits_per_channel,
+        'message_length': len(message),
+        'compression': payload_report['codec'],
+        'payload_bytes': payload_report['payload_bytes'],
+        'compressed_bytes': payload_report['stored_bytes'],
+        'output_format': output_format,
+        'output_profile': profile,
+        'output_encode_seconds': round(encode_seconds, 4),
+        'frames': frames
+    }
+
+def decode_metadata(channel, channel_detected, message, frames=1):
+    """Metadata of a decode result as returned by /decode, without original_filename"""
+    return {
+        'channel_used': channel,
+        'channel_detected': channel_detected,
+        'message_length': len(message),
+        'frames': frames
+    }
+
+def encode_headers(metadata):
+    """X-Stego-* headers describing an encode result (/encode/raw)"""
+    headers = {
+        'X-Stego-Channel': metadata['channel_used'],
+        'X-Stego-Bits-Per-Channel': str(metadata['bits_per_channel']),
+        'X-Stego-Message-Length': str(metadata['message_length']),
+        'X-Stego-Compression': metadata['compression'],
+        'X-Stego-Payload-Bytes': str(metadata['payload_bytes']),
+        'X-Stego-Compressed-Bytes': str(metadata['compressed_bytes']),
+        'X-Stego-Output-Profile': metadata['output_profile'],
+        'X-Stego-Encode-Seconds': f"{metadata['output_encode_seconds']:.4f}",
+    }
+    if metadata['frames'] > 1:
+        headers['X-Stego-Frames'] = str(metadata['frames'])
+    return headers
+
+def decode_headers(metadata):
+    """X-Stego-* headers describing a decode result (/decode/raw)"""
+    return {
+        'X-Stego-Channel': metadata['channel_used'],
+        'X-Stego-Channel-Detected': str(metadata['channel_detected']).lower(),
+        'X-Stego-Message-Length': str(metadata['message_length']),
+        'X-Stego-Frames': str(metadata['frames']),
+    }
+
+def upload_digest(stream, length=None):
+    """
+    Content hash of an upload (its first length bytes), for result cache keys
+    
+    Memory-mapped and in-memory uploads are hashed in place, without a copy.
+    """
+    if not isinstance(stream, (mmap.mmap, io.BytesIO)):
+        position = stream.tell()
+        stream.seek(0)
+        data = stream.read()
+        stream.seek(position)
+        stream = io.BytesIO(data)
+    with (memoryview(stream) if isinstance(stream, mmap.mmap) else stream.getbuffer()) as view:
+        with view[:length] as content:
+            return hashlib.blake2b(content, digest_size=32).digest()
+
+def cache_key(kind, digest, *params):
+    """Result cache key for an upload digest and the request parameters ('encode' or 'decode')"""
+    key = hashlib.blake2b(digest_size=32)
+    key.update(kind.encode('ascii'))
+    key.update(digest)
+    # The message is among params, so keys hold its hash rather than the text
+    key.update(repr(params).encode('utf-8'))
+    return key.hexdigest()
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def result_cache():
+    """This worker's ResultCache, created on first use"""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(app.config['CACHE_BYTES'], app.config['CACHE_TTL'])
+        return _result_cache
+
+_shared_cache = None
+
+def shared_cache():
+    """The host's SharedCache, or None if SHARED_CACHE_BYTES is 0"""
+    global _shared_cache
+    if app.config['SHARED_CACHE_BYTES'] <= 0:
+        return None
+    with _result_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = SharedCache(app.config['SHARED_CACHE_DIR'], app.config['SHARED_CACHE_BYTES'],
+                                        app.config['CACHE_TTL'])
+        return _shared_cache
+
+def cached_result(key):
+    """
+    Cached value for key or None, recorded for the X-Cache response header
+    
+    Values found in the shared cache (stored by another worker) are copied
+    into this worker's result cache.
+    """
+    value = result_cache().get(key)
+    shared = shared_cache() if value is None else None
+    if shared is not None:
+        entry = shared.get(key)
+        if entry is not None:
+            info, data = entry
+            value = (str(data, 'utf-8') if info['text'] else bytes(data), info['metadata'])
+            result_cache().put(key, value, len(data))
+    g.cache_status = 'HIT' if value is not None else 'MISS'
+    return value
+
+def result_fits(size):
+    """Whether a result of size bytes can be cached by either tier"""
+    shared = shared_cache()
+    return result_cache().fits(size) or (shared is not None and shared.fits(size))
+
+def store_result(key, value, size):
+    """
+    Cache value ((encoded bytes or message, metadata), size bytes) in both tiers
+    """
+    result_cache().put(key, value, size)
+    shared = shared_cache()
+    if shared is not None:
+        data, metadata = value
+        text = isinstance(data, str)
+        shared.put(key, {'text': text, 'metadata': metadata}, data.encode('utf-8') if text else data)
+
+def shared_cover(digest, image):
+    """
+    Cover image in its native mode, decoded by any worker that saw the upload
+    
+    Covers of SHARED_COVER_MIN_PIXELS or more that any worker has seen
+    before are published to the shared cache, and later requests in any
+    worker (e.g. the same cover with other messages) rebuild the image from
+    the mapped entry. A cover seen once is not copied or written, so
+    single-use covers keep the copy-free pipeline. Palette images, smaller
+    covers and the legacy engine get image back unchanged.
+    
+    Args:
+        digest: upload_digest of the upload
+        image: The upload opened by Pillow (not loaded yet)
+    """
+    cache = shared_cache()
+    if (cache is None or RGBChannelSteganography.ENGINE == 'legacy'
+            or image.size[0] * image.size[1] < app.config['SHARED_COVER_MIN_PIXELS']
+            or RGBChannelSteganography.native_mode(image.mode) == 'P'):
+        return image
+    key = cache_key('cover', digest)
+    entry = cache.get(key)
+    if entry is not None:
+        info, data = entry
+        cover = Image.frombytes(info['mode'], tuple(info['size']), data)
+        cover.format = info['format']
+        return cover
+    if not cache.seen_before(key):
+        return image
+    cover = RGBChannelSteganography.native_image(image)
+    cache.put(key, {'mode': cover.mode, 'size': cover.size, 'format': image.format}, cover.tobytes())
+    cover.format = image.format
+    return cover
+
+class SpoolingRequest(Request):
+    """
+    Request that spools large multipart uploads to UPLOAD_SPOOL_DIR
+    
+    Its body is limited to the endpoint's upload_limit while it is read, so
+    chunked uploads without a Content-Length get the same limit (413).
+    """
+    
+    @property
+    def max_content_length(self):
+        if self.url_rule is None:
+            return app.config['MAX_CONTENT_LENGTH']
+        return upload_limit(self.url_rule.endpoint)
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is None or total_content_length > app.config['UPLOAD_SPOOL_BYTES']:
+            # Unlinked on creation, so the space is reclaimed even if the worker dies
+            return tempfile.TemporaryFile('w+b', dir=app.config['UPLOAD_SPOOL_DIR'])
+        return io.BytesIO()
+
+app.request_class = SpoolingRequest
+
+class ImageLSBSource:
+    """
+    Lazy sample sequence over the selected channel(s) of a native-mode PIL image
+    
+    Behaves like the flat array returned by channel_view for slicing with
+    step 1, but each slice only crops and converts the rows it covers, so
+    reading a short payload never materializes the full frame in NumPy.
+    """
+    
+    def __init__(self, image, channel='R'):
+        self.image = image
+        self.channel = channel
+        self.width, self.height = image.size
+        self.samples_per_row = self.width * RGBChannelSteganography.samples_per_pixel(image.mode, channel)
+        self.size = self.samples_per_row * self.height
+    
+    def __getitem__(self, key):
+        start, stop, _ = key.indices(self.size)
+        if stop <= start:
+            return np.empty(0, dtype=np.uint8)
         
-        message = ''
-        for i in range(0, len(binary), 8):
-            byte = binary[i:i+8]
-            if len(byte) == 8:
-                try:
-                    message += chr(int(byte, 2))
-                except ValueError:
-                    continue
-        return message
+        first_row = start // self.samples_per_row
+        last_row = (stop - 1) // self.samples_per_row + 1
+        band = np.asarray(self.image.crop((0, first_row, self.width, last_row)))
+        offset = first_row * self.samples_per_row
+        return RGBChannelSteganography.channel_view(band, self.channel)[start - offset:stop - offset]
+
+class PNGStreamImage:
+    """
+    Read-only stand-in for an RGB, RGBA or L PIL image, decoded from a PNG stream on demand
+    
+    Supports size, mode, info (a tRNS color key, as Pillow reports it) and crop of full-width row bands, which is all that
+    ImageLSBSource and detect_channel need, plus iter_strips for one pass
+    over the whole image. Scanlines are inflated with zlib only as rows are
+    requested, so a payload in the first rows is read without inflating the
+    rest of the file, and unfiltered by Pillow one strip at a time.
+    
+    The inflate stream is shared state, so reads are serialized by a lock:
+    parallel extraction (read_bytes) crops row bands from several threads,
+    and rows are always inflated in order up to the highest one requested.
+    """
+    
+    SIGNATURE = b'\x89PNG\r\n\x1a\n'
+    STRIP_ROWS = 64
+    READ_BYTES = 64 * 1024
+    INFLATE_BYTES = 256 * 1024
+    RAW_MODES = {0: 'L', 2: 'RGB', 6: 'RGBA'}
     
     @staticmethod
-    def encode_message(image_data, message, channel='R'):
+    def open(stream):
         """
-        Encode message into image data
+        Start streaming an 8-bit, non-interlaced RGB, RGBA or grayscale PNG
+        
+        Returns None, with the stream rewound, for anything else, including
+        palette PNGs and APNGs (an acTL chunk before the first IDAT), whose
+        frames are read by FrameSequence.
+        """
+        start = stream.tell()
+        signature = stream.read(8)
+        length, chunk_type = struct.unpack('>I4s', stream.read(8).rjust(8, b'\0'))
+        if signature != PNGStreamImage.SIGNATURE or chunk_type != b'IHDR' or length != 13:
+            stream.seek(start)
+            return None
+        
+        width, height, depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', stream.read(13))
+        stream.read(4)  # IHDR CRC
+        if depth != 8 or color_type not in PNGStreamImage.RAW_MODES or interlace:
+            stream.seek(start)
+            return None
+        
+        # Skip the (small) chunks before the image data, looking for acTL and tRNS
+        image_data = stream.tell()
+        info = {}
+        while True:
+            length, chunk_type = struct.unpack('>I4s', stream.read(8).rjust(8, b'\0'))
+            if chunk_type == b'acTL':
+                stream.seek(start)
+                return None
+            if chunk_type in (b'IDAT', b'IEND', b'\0\0\0\0'):
+                break
+            if chunk_type == b'tRNS' and color_type == 0 and length == 2:
+                info['transparency'] = struct.unpack('>H', stream.read(2))[0]
+                stream.seek(4, os.SEEK_CUR)
+            elif chunk_type == b'tRNS' and color_type == 2 and length == 6:
+                info['transparency'] = struct.unpack('>HHH', stream.read(6))
+                stream.seek(4, os.SEEK_CUR)
+            else:
+                stream.seek(length + 4, os.SEEK_CUR)
+        stream.seek(image_data)
+        image = PNGStreamImage(stream, width, height, PNGStreamImage.RAW_MODES[color_type])
+        image.info = info
+        return image
+    
+    def __init__(self, stream, width, height, raw_mode):
+        self.stream = stream
+        self.size = (width, height)
+        self.mode = self.raw_mode = raw_mode
+        self.info = {}
+        self.stride = 1 + width * len(raw_mode)
+        self._inflater = zlib.decompressobj()
+        self._pending = bytearray()
+        self._chunk_remaining = 0
+        self._finished = False
+        self._previous = bytes(self.stride - 1)
+        self._rows_read = 0
+        self._strips = []
+        self._strip_rows = 0
+        self._lock = threading.RLock()
+    
+    def crop(self, box):
+        """Rows box[1]:box[3] (always full width) as an (h, w, bands) uint8 array"""
+        _, first_row, _, last_row = box
+        with self._lock:
+            while self._strip_rows < last_row:
+                strip = self.read_strip(last_row - self._strip_rows)
+                if not len(strip):
+                    raise ValueError("Truncated PNG image data")
+                self._strips.append(strip)
+                self._strip_rows += len(strip)
+            strips = list(self._strips)
+        
+        pieces = []
+        row = 0
+        for strip in strips:
+            if row < last_row and row + len(strip) > first_row:
+                pieces.append(strip[max(first_row - row, 0):last_row - row])
+            row += len(strip)
+        if not pieces:
+            return self._empty()
+        return pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+    
+    def iter_strips(self, rows=None):
+        """Yield the remaining rows as (h, w, bands) strips without retaining them"""
+        while True:
+            strip = self.read_strip(rows or self.STRIP_ROWS)
+            if not len(strip):
+                return
+            yield strip
+    
+    def read_strip(self, rows):
+        """
+        Decode the next rows (fewer at the end of the image)
+        
+        The previous row is prepended unfiltered, so Pillow's PNG decoder
+        can undo Up/Average/Paeth filters of the strip's first row.
+        """
+        with self._lock:
+            return self._read_strip(rows)
+    
+    def _empty(self):
+        """A strip of no rows, shaped like the others"""
+        shape = (0, self.size[0]) if self.mode == 'L' else (0, self.size[0], len(self.mode))
+        return np.empty(shape, dtype=np.uint8)
+    
+    def _read_strip(self, rows):
+        rows = min(rows, self.size[1] - self._rows_read)
+        if rows <= 0:
+            return self._empty()
+        
+        needed = rows * self.stride
+        while len(self._pending) < needed:
+            data = self._inflater.unconsumed_tail or self._read_idat()
+            if not data:
+                raise ValueError("Truncated PNG image data")
+            self._pending += self._inflater.decompress(data, self.INFLATE_BYTES)
+        
+        filtered = b'\0' + self._previous + self._pending[:needed]
+        del self._pending[:needed]
+        strip = Image.frombytes(
+            self.raw_mode, (self.size[0], rows + 1), zlib.compress(filtered, 0), 'zip', self.raw_mode
+        )
+        pixels = np.asarray(strip)[1:]
+        self._previous = pixels[-1].tobytes()
+        self._rows_read += rows
+        return pixels
+    
+    def _read_idat(self):
+        """Next piece of compressed image data, b'' after IEND"""
+        while self._chunk_remaining == 0:
+            if self._finished:
+                return b''
+            header = self.stream.read(8)
+            if len(header) < 8:
+                raise ValueError("Truncated PNG file")
+            length, chunk_type = struct.unpack('>I4s', header)
+            if chunk_type == b'IDAT':
+                self._chunk_remaining = length
+                if length == 0:
+                    self.stream.read(4)
+            elif chunk_type == b'IEND':
+                self._finished = True
+            else:
+                self.stream.read(length + 4)
         
+        data = self.stream.read(min(self.READ_BYTES, self._chunk_remaining))
+        if not data:
+            raise ValueError("Truncated PNG file")
+        self._chunk_remaining -= len(data)
+        if self._chunk_remaining == 0:
+            self.stream.read(4)  # CRC
+        return data
+
+class PNGStreamWriter:
+    """
+    Write an 8-bit RGB, RGBA or grayscale PNG strip by strip
+    
+    Rows are filtered with NumPy over the whole strip and deflated; IDAT
+    chunks are emitted as compressed output accumulates, so only the current
+    strip is held in memory.
+    
+    Large images are deflated pigz-style: the filtered data is cut into
+    SEGMENT_BYTES segments compressed independently on the shared thread
+    pool (zlib releases the GIL), each primed with the previous segment's
+    last 32 KB and ended with a sync flush, so the raw deflate pieces
+    concatenate into one standard zlib stream.
+    
+    With frames > 1 the file is an APNG: call start_frame before the rows
+    of each frame. Every frame covers the whole canvas and replaces the
+    previous one (no disposal, no blending), so decoders see exactly the
+    rows written.
+    """
+    
+    IDAT_BYTES = 256 * 1024
+    FILTERS = ['none', 'up', 'adaptive']
+    # PNG colour type of each PIL mode the writer accepts
+    COLOR_TYPES = {'L': 0, 'RGB': 2, 'RGBA': 6}
+    SEGMENT_BYTES = 1 << 20
+    DICTIONARY_BYTES = 32 * 1024
+    PARALLEL_MIN_PIXELS = 2_000_000
+    
+    def __init__(self, fileobj, width, height, compress_level=6, filter='adaptive', threads=None, mode='RGB',
+                 frames=1, loops=0, transparency=None):
+        """
         Args:
-            image_data: PIL Image object
-            message: Message to hide
-            channel: RGB channel to use ('R', 'G', 'B', or 'ALL')
+            fileobj: Writable binary file object
+            width, height: Image size in pixels
+            compress_level: zlib level (0-9)
+            filter: 'none', 'up', or 'adaptive' (per row, the PNG filter with
+                the smallest sum of absolute signed bytes, as libpng does)
+            threads: Deflate threads for images of PARALLEL_MIN_PIXELS or
+                more (defaults to RGBChannelSteganography.THREADS)
+            mode: 'RGB', 'RGBA', or 'L' (a key of COLOR_TYPES)
+            frames: Number of APNG frames (1 writes a plain PNG)
+            loops: APNG loop count (0 loops forever)
+            transparency: tRNS color key for 'L' (a gray level) or 'RGB'
+                (an (r, g, b) tuple), as found in a PIL image's info
+        """
+        self.fileobj = fileobj
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.filter = filter
+        self.compress_level = compress_level
+        self._buffer = bytearray()
+        self._frame = None if frames == 1 else -1
+        self._sequence = 0
         
-        Returns:
-            (success, result_image_data_or_error)
+        threads = threads or RGBChannelSteganography.THREADS
+        self.threads = threads if threads > 1 and width * height >= self.PARALLEL_MIN_PIXELS else 1
+        
+        fileobj.write(PNGStreamImage.SIGNATURE)
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, self.COLOR_TYPES[mode], 0, 0, 0))
+        if transparency is not None and mode == 'L':
+            self._write_chunk(b'tRNS', struct.pack('>H', transparency))
+        elif transparency is not None and mode == 'RGB':
+            self._write_chunk(b'tRNS', struct.pack('>HHH', *transparency))
+        if frames > 1:
+            self._write_chunk(b'acTL', struct.pack('>II', frames, loops))
+        else:
+            self._start_stream()
+    
+    def start_frame(self, duration=100):
+        """Begin the next APNG frame, shown for duration milliseconds"""
+        if self._frame >= 0:
+            self._finish_stream()
+        self._frame += 1
+        self._write_chunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB', self._next_sequence(), self.width, self.height, 0, 0, round(duration), 1000, 0, 0
+        ))
+        self._start_stream()
+    
+    def _start_stream(self):
+        """Reset the filter and deflate state for a new zlib stream (one per frame)"""
+        self._previous = np.zeros(self.width * len(self.mode), dtype=np.uint8)
+        if self.threads > 1:
+            self._deflater = None
+            self._segment = bytearray()
+            self._segments = deque()
+            self._dictionary = b''
+            self._adler = zlib.adler32(b'')
+            self._buffer += zlib.compress(b'', self.compress_level)[:2]  # zlib header
+        else:
+            self._deflater = zlib.compressobj(self.compress_level)
+    
+    def _next_sequence(self):
+        self._sequence += 1
+        return self._sequence - 1
+    
+    @staticmethod
+    def iter_png(width, height, strips, compress_level=6, filter='adaptive', threads=None, mode='RGB',
+                 transparency=None):
         """
-        try:
-            # Convert to RGB if needed
-            if image_data.mode != 'RGB':
-                image_data = image_data.convert('RGB')
-            
-            img_array = np.array(image_data)
-            binary_message = RGBChannelSteganography.string_to_binary(message)
-            message_length = len(binary_message)
-            
-            # Calculate capacity
-            height, width, channels = img_array.shape
-            max_capacity = height * width * (3 if channel == 'ALL' else 1)
-            
-            if message_length > max_capacity:
-                return False, f"Message too long. Max: {max_capacity} bits, needed: {message_length} bits"
-            
-            # Select channels
-            if channel == 'R':
-                channel_indices = [0]
-            elif channel == 'G':
-                channel_indices = [1]
-            elif channel == 'B':
-                channel_indices = [2]
-            else:  # ALL
-                channel_indices = [0, 1, 2]
-            
-            # Encode message
-            bit_index = 0
-            for i in range(height):
-                for j in range(width):
-                    for c in channel_indices:
-                        if bit_index < message_length:
-                            pixel_value = img_array[i, j, c]
-                            message_bit = int(binary_message[bit_index])
-                            new_pixel_value = (pixel_value & 0xFE) | message_bit
-                            img_array[i, j, c] = new_pixel_value
-                            bit_index += 1
-                        else:
-                            break
-                    if bit_index >= message_length:
-                        break
-                if bit_index >= message_length:
-                    break
-            
-            # Convert back to PIL Image
-            result_img = Image.fromarray(img_array.astype(np.uint8))
-            return True, result_img
-            
-        except Exception as e:
-            return False, str(e)
+        Yield a PNG of the given (h, w, bands) strips as bytes pieces
+        
+        Pieces are produced as IDAT chunks fill up, so a response can start
+        sending before the last strip is compressed.
+        """
+        sink = io.BytesIO()
+        writer = PNGStreamWriter(sink, width, height, compress_level, filter, threads, mode,
+                                 transparency=transparency)
+        for strip in strips:
+            writer.write_rows(strip)
+            if sink.tell():
+                yield sink.getvalue()
+                sink.seek(0)
+                sink.truncate()
+        writer.close()
+        yield sink.getvalue()
     
     @staticmethod
-    def decode_message(image_data, channel='R'):
+    def image_strips(image, rows=None):
+        """Yield a PIL image as (h, w, bands) strips, converting one strip at a time"""
+        rows = rows or PNGStreamImage.STRIP_ROWS
+        width, height = image.size
+        for top in range(0, height, rows):
+            yield np.asarray(image.crop((0, top, width, min(top + rows, height))))
+    
+    def write_rows(self, rows):
+        """Append an (h, w, bands) uint8 strip ((h, w) for grayscale)"""
+        if not len(rows):
+            return
+        filtered = self.filter_rows(rows, self._previous, self.filter)
+        self._previous = rows[-1].reshape(-1).copy()
+        if self._deflater is not None:
+            self._buffer += self._deflater.compress(filtered)
+        else:
+            self._adler = zlib.adler32(filtered, self._adler)
+            self._segment += filtered.data
+            while len(self._segment) >= self.SEGMENT_BYTES:
+                self._submit_segment(bytes(self._segment[:self.SEGMENT_BYTES]))
+                del self._segment[:self.SEGMENT_BYTES]
+        if len(self._buffer) >= self.IDAT_BYTES:
+            self._flush_idat()
+    
+    @staticmethod
+    def filter_rows(rows, previous, filter='adaptive'):
         """
-        Decode message from image data
+        PNG-filter an (h, w, bands) strip whose preceding row is previous
         
-        Args:
-            image_data: PIL Image object
-            channel: RGB channel used during encoding
+        Returns an (h, 1 + w*bands) uint8 array of filter type bytes and
+        filtered scanlines.
+        """
+        height = len(rows)
+        x = rows.reshape(height, -1)
+        bpp = x.shape[1] // rows.shape[1]  # bytes per pixel, the "left" distance
+        filtered = np.empty((height, 1 + x.shape[1]), dtype=np.uint8)
+        if filter == 'none':
+            filtered[:, 0] = 0
+            filtered[:, 1:] = x
+            return filtered
         
-        Returns:
-            (success, decoded_message_or_error)
+        b = np.concatenate((previous.reshape(1, -1), x[:-1]))  # above
+        if filter == 'up':
+            filtered[:, 0] = 2
+            np.subtract(x, b, out=filtered[:, 1:])
+            return filtered
+        
+        a = np.zeros_like(x)  # left
+        a[:, bpp:] = x[:, :-bpp]
+        c = np.zeros_like(x)  # above left
+        c[:, bpp:] = b[:, :-bpp]
+        a16, b16, c16 = a.astype(np.int16), b.astype(np.int16), c.astype(np.int16)
+        pa = np.abs(b16 - c16)
+        pb = np.abs(a16 - c16)
+        pc = np.abs(a16 + b16 - 2 * c16)
+        paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+        candidates = np.stack((x, x - a, x - b, x - ((a16 + b16) >> 1).astype(np.uint8), x - paeth))
+        scores = np.abs(candidates.view(np.int8).astype(np.int16)).sum(axis=2)
+        best = scores.argmin(axis=0)
+        filtered[:, 0] = best
+        filtered[:, 1:] = candidates[best, np.arange(height)]
+        return filtered
+    
+    def close(self):
+        """Finish the zlib stream and write IEND"""
+        self._finish_stream()
+        self._write_chunk(b'IEND', b'')
+    
+    def _finish_stream(self):
+        """Flush the current zlib stream into IDAT (or fdAT) chunks"""
+        if self._deflater is not None:
+            self._buffer += self._deflater.flush()
+        else:
+            self._submit_segment(bytes(self._segment), final=True)
+            self._segment.clear()
+            while self._segments:
+                self._buffer += self._segments.popleft().result()
+            self._buffer += struct.pack('>I', self._adler)
+        self._flush_idat()
+    
+    def _submit_segment(self, data, final=False):
+        """Deflate a segment on the thread pool, collecting finished segments in order"""
+        pool = RGBChannelSteganography.executor(self.threads)
+        self._segments.append(pool.submit(
+            self._deflate_segment, data, self._dictionary, self.compress_level, final
+        ))
+        self._dictionary = data[-self.DICTIONARY_BYTES:]
+        # Keep at most two segments per thread in flight to bound memory
+        while self._segments and (self._segments[0].done() or len(self._segments) > 2 * self.threads):
+            self._buffer += self._segments.popleft().result()
+    
+    @staticmethod
+    def _deflate_segment(data, dictionary, compress_level, final):
+        """Raw deflate of one segment, byte-aligned by a sync flush unless it is the last"""
+        if dictionary:
+            deflater = zlib.compressobj(compress_level, zlib.DEFLATED, -15, zdict=dictionary)
+        else:
+            deflater = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+        return deflater.compress(data) + deflater.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+    
+    def _flush_idat(self):
+        if self._buffer:
+            if self._frame:  # APNG frames after the first
+                self._write_chunk(b'fdAT', struct.pack('>I', self._next_sequence()) + self._buffer)
+            else:
+                self._write_chunk(b'IDAT', bytes(self._buffer))
+            self._buffer.clear()
+    
+    def _write_chunk(self, chunk_type, data):
+        self.fileobj.write(struct.pack('>I', len(data)))
+        self.fileobj.write(chunk_type)
+        self.fileobj.write(data)
+        self.fileobj.write(struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+class RawPixelImage:
+    """
+    Uncompressed 8-bit RGB(A) pixels edited directly in a file buffer
+    
+    Pillow's lazy Image.open parses the header of BMP, PPM and uncompressed
+    TIFF files into 'raw' tiles (offset, byte order, row stride and
+    orientation); layout turns those into NumPy views over the buffer, so
+    rows are read and written in place (BGR order, row padding and bottom-up
+    layout included) without decoding or re-encoding the file. Supports
+    size, mode and crop like PNGStreamImage, plus paste_rows.
+    """
+    
+    RAW_MODES = {'RGB', 'BGR', 'RGBX', 'BGRX', 'RGBA', 'BGRA'}
+    CHUNK_BYTES = 1 << 20
+    
+    @staticmethod
+    def layout(image):
         """
-        try:
-            # Convert to RGB if needed
-            if image_data.mode != 'RGB':
-                image_data = image_data.convert('RGB')
-            
-            img_array = np.array(image_data)
-            height, width, channels = img_array.shape
-            
+        Full-width row bands of a lazily opened PIL image, if it is stored raw
+        
+        Returns a list of (first_row, last_row, offset, raw_mode, stride,
+        orientation) tuples, or None if any tile is compressed or in an
+        unsupported pixel format. RGBA images must be stored in RGBA order,
+        as BGRA cannot be viewed as R, G, B, A without a copy.
+        """
+        if image.mode not in ('RGB', 'RGBA'):
+            return None
+        width, height = image.size
+        bands = []
+        for tile in image.tile:
+            codec, extents, offset, args = tile[:4]
+            if codec != 'raw':
+                return None
+            if isinstance(args, str):
+                args = (args,)
+            raw_mode, stride, orientation = (tuple(args) + (0, 1))[:3]
+            x0, y0, x1, y1 = extents
+            if raw_mode not in RawPixelImage.RAW_MODES or x0 != 0 or x1 != width:
+                return None
+            if image.mode == 'RGBA' and raw_mode != 'RGBA':
+                return None
+            bands.append((y0, y1, offset, raw_mode, stride or width * len(raw_mode), orientation))
+        
+        bands.sort()
+        if not bands or bands[0][0] != 0 or bands[-1][1] != height:
+            return None
+        if any(previous[1] != band[0] for previous, band in zip(bands, bands[1:])):
+            return None
+        return bands
+    
+    def __init__(self, buffer, format, size, layout, length=None, mode='RGB'):
+        """
+        Args:
+            buffer: Writable bytes-like object holding the whole file
+            format: Pillow format name ('BMP', 'PPM', 'TIFF')
+            size: (width, height)
+            layout: Result of RawPixelImage.layout
+            length: File length within buffer (defaults to len(buffer))
+            mode: PIL mode of the image, 'RGB' or 'RGBA'
+        """
+        self.buffer = buffer
+        self.format = format
+        self.size = size
+        self.mode = mode
+        self.length = len(buffer) if length is None else length
+        width = size[0]
+        self._bands = []
+        for first_row, last_row, offset, raw_mode, stride, orientation in layout:
+            rows = last_row - first_row
+            if offset + stride * rows > self.length:
+                raise ValueError("Truncated image data")
+            pixels = np.frombuffer(buffer, dtype=np.uint8, count=stride * rows, offset=offset)
+            pixels = pixels.reshape(rows, stride)[:, :width * len(raw_mode)].reshape(rows, width, len(raw_mode))
+            if orientation < 0:
+                pixels = pixels[::-1]
+            # View in R, G, B order: BGR data is read backwards
+            pixels = pixels[:, :, 2::-1] if raw_mode.startswith('B') else pixels[:, :, :len(mode)]
+            self._bands.append((first_row, last_row, pixels))
+    
+    def crop(self, box):
+        """Rows box[1]:box[3] (always full width) as an (h, w, bands) uint8 array"""
+        _, first_row, _, last_row = box
+        pieces = [
+            pixels[max(first_row - top, 0):last_row - top]
+            for top, bottom, pixels in self._bands
+            if top < last_row and bottom > first_row
+        ]
+        if not pieces:
+            return np.empty((0, self.size[0], len(self.mode)), dtype=np.uint8)
+        return np.concatenate(pieces)
+    
+    def paste_rows(self, first_row, rows):
+        """Write an (h, w, bands) strip back into the file starting at first_row"""
+        last_row = first_row + len(rows)
+        for top, bottom, pixels in self._bands:
+            if top < last_row and bottom > first_row:
+                start, end = max(first_row, top), min(last_row, bottom)
+                pixels[start - top:end - top] = rows[start - first_row:end - first_row]
+    
+    def iter_bytes(self):
+        """Yield the (edited) file as bytes pieces"""
+        for start in range(0, self.length, self.CHUNK_BYTES):
+            yield bytes(self.buffer[start:min(start + self.CHUNK_BYTES, self.length)])
+    
+    def close(self):
+        """Release the pixel views and close the buffer if it is a memory map"""
+        self._bands = []
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+class FrameSequence:
+    """
+    Frames of an animated GIF/APNG or multi-page TIFF, decoded one at a time
+    
+    Iterating seeks the lazily opened image frame by frame and yields each
+    as a private copy in its embedding mode, so only the frames in flight
+    are held in memory, never the whole animation. Animation frames share
+    one mode (RGBA if the first frame has transparency, else RGB) because
+    they are written back as APNG; TIFF pages keep their own size and mode.
+    """
+    
+    FORMATS = {'GIF', 'PNG', 'TIFF'}
+    # Default frame duration (ms) for animations that carry none
+    DURATION = 100
+    
+    @staticmethod
+    def open(image):
+        """FrameSequence over a lazily opened image with several frames, else None"""
+        if image.format not in FrameSequence.FORMATS or getattr(image, 'n_frames', 1) < 2:
+            return None
+        return FrameSequence(image)
+    
+    @staticmethod
+    def complete(image, stream):
+        """
+        Whether stream holds the whole file, so a frame walk of image saw every frame
+        
+        A walk over a truncated TIFF raises, but Pillow quietly stops counting
+        GIF frames where the data ends, so a GIF only counts as complete if it
+        ends with an image's block terminator and the trailer.
+        """
+        if image.format != 'GIF':
+            return True
+        stream.seek(-2, os.SEEK_END)
+        return stream.read(2) == b'\0;'
+    
+    def __init__(self, image):
+        self.image = image
+        self.format = image.format
+        self.size = image.size
+        self.animated = image.format != 'TIFF'
+        self.loop = image.info.get('loop', 0)
+        if self.animated:
+            self.mode = 'RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB'
+            # (size, embedding mode) of every frame
+            self.frames = [(image.size, self.mode)] * image.n_frames
+            self.output_formats = {'PNG', 'TIFF'}
+        else:
+            self.mode = None
+            self.frames = []
+            for index in range(image.n_frames):
+                image.seek(index)  # reads the page's IFD, not its pixels
+                self.frames.append((image.size, RGBChannelSteganography.native_mode(image.mode)))
+            # Read the pixels with a fresh reader: Pillow applies the palette of
+            # a palette page that was skipped over to the next page it loads
+            image.fp.seek(0)
+            self.image = Image.open(image.fp)
+            self.output_formats = {'TIFF'}
+    
+    def __len__(self):
+        return len(self.frames)
+    
+    def __iter__(self):
+        for index, (_, mode) in enumerate(self.frames):
+            self.image.seek(index)
+            yield self.image.copy() if self.image.mode == mode else self.image.convert(mode)
+
+class ResultCache:
+    """
+    LRU cache of encode/decode results, bounded in bytes, with a TTL
+    
+    Keys come from cache_key (upload content hash plus request parameters);
+    values are what an endpoint needs to answer again without decoding the
+    image: (encoded file bytes, metadata) or (message, metadata). Values are
+    shared between requests and must not be modified. Thread-safe; each
+    worker process has its own.
+    """
+    
+    # Bytes charged per entry on top of its value (key, metadata, bookkeeping)
+    OVERHEAD = 512
+    
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires, size, value), least recently used first
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        """Value for key (now the most recently used), or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+    
+    def put(self, key, value, size):
+        """
+        Store value (size bytes), evicting least recently used entries
+        
+        Returns False if the value is larger than the whole cache.
+        """
+        size += ResultCache.OVERHEAD
+        if size > self.max_bytes:
+            return False
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + self.ttl, size, value)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return True
+    
+    def fits(self, size):
+        """Whether a value of size bytes can be cached at all"""
+        return size + ResultCache.OVERHEAD <= self.max_bytes
+    
+    def stats(self):
+        """Entry count, bytes held and hit/miss/eviction counters"""
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+    
+    def _remove(self, key):
+        self.size -= self.entries.pop(key)[1]
+
+class SharedCache:
+    """
+    Cache shared by the worker processes of a host, one file per entry
+    
+    An entry file holds a magic number, the length of a JSON header (expiry
+    and the caller's info dict) and the payload. Writers fill a temp file in
+    the same directory and rename it over the entry, so readers see either
+    the old or the new entry, never a partial one. Readers map the file and
+    get a memoryview of the payload; it stays valid if the entry is replaced
+    or evicted meanwhile, as the unlinked file lives until it is unmapped.
+    
+    Reads touch the file's mtime, so eviction (oldest mtime first, once the
+    directory exceeds max_bytes) is least recently used across workers. The
+    directory is scanned after each worker has written a sixteenth of
+    max_bytes, so it may briefly exceed the bound by that much per worker.
+    Concurrent evictions in several workers are harmless.
+    
+    seen_before leaves an empty '.seen-<key>' marker, which the scan removes
+    with orphaned temp files, so a key counts as seen for about an hour.
+    """
+    
+    MAGIC = b'STGC'
+    # Temp files older than this were left by a killed writer
+    ORPHAN_SECONDS = 3600
+    
+    def __init__(self, directory, max_bytes, ttl):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.written = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            pass  # every lookup misses and every put fails
+    
+    def get(self, key):
+        """(info, payload memoryview) for key, or None"""
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            entry = None
+        else:
+            entry = self._parse(mapped)
+            if entry is not None and entry[0] < time.time():
+                self._unlink(path)
+                entry = None
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry[1], entry[2]
+    
+    def put(self, key, info, data):
+        """
+        Publish data (bytes-like) with info (JSON-serializable) under key
+        
+        Returns False if the entry is larger than the whole cache or could
+        not be written (e.g. the disk is full); the cache is best effort.
+        """
+        header = json.dumps({'expires': time.time() + self.ttl, 'info': info}).encode('utf-8')
+        size = len(SharedCache.MAGIC) + 4 + len(header) + memoryview(data).nbytes
+        if not self.fits(size):
+            return False
+        try:
+            fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(SharedCache.MAGIC + struct.pack('<I', len(header)) + header)
+                    f.write(data)
+                os.replace(temp_path, os.path.join(self.directory, key))
+            except BaseException:
+                self._unlink(temp_path)
+                raise
+        except OSError:
+            return False
+        with self.lock:
+            self.written += size
+            evict = self.written >= self.max_bytes // 16
+            if evict:
+                self.written = 0
+        if evict:
+            self.evict()
+        return True
+    
+    def fits(self, size):
+        """Whether an entry of size bytes can be cached at all"""
+        return size <= self.max_bytes
+    
+    def seen_before(self, key):
+        """
+        Whether any worker asked seen_before(key) recently
+        
+        The first call creates the key's marker exclusively, so of two
+        workers racing on a new key exactly one gets False; later calls
+        consume the marker and get True. False if the marker cannot be
+        created at all.
+        """
+        marker = os.path.join(self.directory, f'.seen-{key}')
+        try:
+            os.close(os.open(marker, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+        except FileExistsError:
+            self._unlink(marker)
+            return True
+        except OSError:
+            pass
+        return False
+    
+    def evict(self):
+        """Remove least recently used entries until the directory fits max_bytes"""
+        entries, total = self._scan()
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._unlink(path)
+            total -= size
+            with self.lock:
+                self.evictions += 1
+    
+    def stats(self):
+        """Entries and bytes on the host, and this worker's hit/miss/eviction counters"""
+        entries, total = self._scan(remove_orphans=False)
+        with self.lock:
+            return {
+                'directory': self.directory,
+                'entries': len(entries),
+                'bytes': total,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+    
+    def _scan(self, remove_orphans=True):
+        """([(mtime, size, path)] of the entries, their total size)"""
+        entries = []
+        total = 0
+        now = time.time()
+        try:
+            listing = list(os.scandir(self.directory))
+        except OSError:
+            listing = []
+        for entry in listing:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue  # evicted or replaced by another worker
+            if entry.name.startswith('.'):
+                if remove_orphans and stat.st_mtime < now - SharedCache.ORPHAN_SECONDS:
+                    self._unlink(entry.path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        return entries, total
+    
+    @staticmethod
+    def _parse(mapped):
+        """(expires, info, payload memoryview) of a mapped entry, or None if malformed"""
+        start = len(SharedCache.MAGIC) + 4
+        if len(mapped) < start or mapped[:len(SharedCache.MAGIC)] != SharedCache.MAGIC:
+            return None
+        length, = struct.unpack_from('<I', mapped, len(SharedCache.MAGIC))
+        try:
+            header = json.loads(mapped[start:start + length])
+        except ValueError:
+            return None
+        return header['expires'], header['info'], memoryview(mapped)[start + length:]
+    
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+class RGBChannelSteganography:
+    """
+    RGB Channel Steganography implementation
+    Hides messages by modifying the least significant bit(s) of RGB channels
+    (or alpha, grayscale, palette index and 16-bit samples, see NATIVE_BANDS)
+    """
+    
+    @staticmethod
+    def string_to_binary(message):
+        """Convert string to binary with delimiter (legacy payload format)"""
+        binary = ''.join(format(ord(char), '08b') for char in message)
+        return binary + '1111111111111110'  # End delimiter
+    
+    @staticmethod
+    def binary_to_string(binary):
+        """Convert binary to string, stopping at delimiter (legacy payload format)"""
+        delimiter = '1111111111111110'
+        if delimiter in binary:
+            binary = binary[:binary.index(delimiter)]
+        
+        message = ''
+        for i in range(0, len(binary), 8):
+            byte = binary[i:i+8]
+            if len(byte) == 8:
+                try:
+                    message += chr(int(byte, 2))
+                except ValueError:
+                    continue
+        return message
+    
+    # Payload container: magic, version, flags, payload length, CRC32 of payload.
+    # The header always uses 1 bit per sample; the payload uses bits_per_channel.
+    PAYLOAD_MAGIC = b'\x89STG'
+    PAYLOAD_VERSION = 1
+    HEADER_FORMAT = '>4sBBII'
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+    HEADER_BITS = HEADER_SIZE * 8
+    
+    # Header flags: bits 0-1 hold bits_per_channel - 1, bits 2-3 the codec
+    FLAG_BITS_PER_CHANNEL = 0x03
+    FLAG_CODEC_SHIFT = 2
+    FLAG_CODEC = 0x0C
+    MAX_BITS_PER_CHANNEL = 4
+    
+    # Payload compression codecs by header id, tried at their fastest level
+    CODECS = ['none', 'zlib', 'bz2', 'lzma']
+    COMPRESSORS = {
+        'zlib': lambda data: zlib.compress(data, 1),
+        'bz2': lambda data: bz2.compress(data, 1),
+        'lzma': lambda data: lzma.compress(data, preset=0),
+    }
+    # Auto compression: sample size tried per codec, smallest payload worth
+    # trying, and the ratio a codec must beat to be used at all
+    COMPRESSION_SAMPLE_BYTES = 64 * 1024
+    COMPRESSION_MIN_BYTES = 64
+    COMPRESSION_MAX_RATIO = 0.9
+    # Upper bound on decompressed payloads, guarding against zip bombs
+    MAX_DECOMPRESSED_BYTES = 64 * 1024 * 1024
+    
+    # Leading characters that must look like text before a legacy
+    # (delimiter-terminated) image is scanned for its delimiter
+    LEGACY_PROBE_CHARS = 16
+    
+    # Bytes converted to/from bits per step, bounding the 8x unpacked size
+    CODEC_CHUNK_BYTES = 1 << 16
+    
+    @staticmethod
+    def build_header(data, bits_per_channel=1, codec='none'):
+        """Container header for an already encoded (and possibly compressed) payload"""
+        flags = (bits_per_channel - 1) | (
+            RGBChannelSteganography.CODECS.index(codec) << RGBChannelSteganography.FLAG_CODEC_SHIFT
+        )
+        return struct.pack(
+            RGBChannelSteganography.HEADER_FORMAT,
+            RGBChannelSteganography.PAYLOAD_MAGIC,
+            RGBChannelSteganography.PAYLOAD_VERSION,
+            flags,
+            len(data),
+            zlib.crc32(data)
+        )
+    
+    @staticmethod
+    def compress_payload(data, compression='auto'):
+        """
+        Compress a UTF-8 payload before embedding
+        
+        'auto' compresses a sample with every codec, keeps the smallest and
+        only uses it when it beats COMPRESSION_MAX_RATIO on the sample.
+        
+        Returns:
+            (codec, stored_bytes)
+        """
+        compressors = RGBChannelSteganography.COMPRESSORS
+        if compression == 'none' or not data:
+            return 'none', data
+        if compression != 'auto':
+            return compression, compressors[compression](data)
+        
+        if len(data) < RGBChannelSteganography.COMPRESSION_MIN_BYTES:
+            return 'none', data
+        
+        sample = data[:RGBChannelSteganography.COMPRESSION_SAMPLE_BYTES]
+        sizes = {codec: len(compress(sample)) for codec, compress in compressors.items()}
+        codec = min(sizes, key=sizes.get)
+        if sizes[codec] > len(sample) * RGBChannelSteganography.COMPRESSION_MAX_RATIO:
+            return 'none', data
+        
+        stored = compressors[codec](data)
+        if len(stored) >= len(data):
+            return 'none', data
+        return codec, stored
+    
+    @staticmethod
+    def decompress_payload(stored, codec):
+        """Inverse of compress_payload, bounded by MAX_DECOMPRESSED_BYTES"""
+        if codec == 'none':
+            return stored
+        
+        limit = RGBChannelSteganography.MAX_DECOMPRESSED_BYTES
+        if codec == 'zlib':
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(stored, limit)
+            finished = decompressor.eof
+        else:
+            decompressor = bz2.BZ2Decompressor() if codec == 'bz2' else lzma.LZMADecompressor()
+            data = decompressor.decompress(stored, limit)
+            finished = decompressor.eof
+        
+        if not finished:
+            raise ValueError(f"Decompressed payload exceeds {limit} bytes or is truncated")
+        return data
+    
+    @staticmethod
+    def capacity_bits(width, height, channel='R', bits_per_channel=1, mode='RGB'):
+        """Number of bits available in the selected channel(s), header included"""
+        samples = width * height * RGBChannelSteganography.samples_per_pixel(mode, channel)
+        header_bits = RGBChannelSteganography.HEADER_BITS
+        if samples <= header_bits:
+            return samples
+        return header_bits + (samples - header_bits) * bits_per_channel
+    
+    @staticmethod
+    def capacity_bytes(width, height, channel='R', bits_per_channel=1, mode='RGB'):
+        """Largest UTF-8 payload, in bytes, that fits after the header"""
+        capacity = RGBChannelSteganography.capacity_bits(width, height, channel, bits_per_channel, mode)
+        return max(capacity - RGBChannelSteganography.HEADER_BITS, 0) // 8
+    
+    @staticmethod
+    def frame_capacities(frames, channel='R', bits_per_channel=1):
+        """
+        Payload bytes each frame holds, given (size, mode) per frame
+        
+        A payload spanning frames fills them in order, whole bytes per
+        frame; the header sits in the first frame, so a single frame holds
+        capacity_bytes.
+        """
+        capacities = []
+        for index, ((width, height), mode) in enumerate(frames):
+            samples = width * height * RGBChannelSteganography.samples_per_pixel(mode, channel)
+            if index == 0:
+                samples = max(samples - RGBChannelSteganography.HEADER_BITS, 0)
+            capacities.append(samples * bits_per_channel // 8)
+        return capacities
+    
+    @staticmethod
+    def sample_groups(bits_per_channel):
+        """
+        Layout for splitting bytes into k-bit samples without a bit array
+        
+        group_bytes bytes form one big-endian word holding exactly
+        len(shifts) samples, extracted MSB-first with the returned shifts.
+        Single-byte groups (k = 1, 2, 4) stay in uint8 arithmetic.
+        """
+        k = bits_per_channel
+        group_bytes = k // math.gcd(8, k)
+        samples = group_bytes * 8 // k
+        dtype = np.uint8 if group_bytes == 1 else np.uint32
+        shifts = np.arange((samples - 1) * k, -1, -k, dtype=dtype)
+        return group_bytes, shifts
+    
+    # Worker threads sharing the embedding/extraction of large payloads and
+    # the smallest payload (bytes) worth splitting across them
+    THREADS = int(os.environ.get('STEGO_THREADS', os.cpu_count() or 1))
+    PARALLEL_MIN_BYTES = 1 << 20
+    _executors = {}
+    _executors_lock = threading.Lock()
+    
+    @staticmethod
+    def executor(threads):
+        """Shared thread pool with the given number of workers"""
+        with RGBChannelSteganography._executors_lock:
+            pool = RGBChannelSteganography._executors.get(threads)
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='stego')
+                RGBChannelSteganography._executors[threads] = pool
+            return pool
+    
+    @staticmethod
+    def split_ranges(count, bits_per_channel=1, threads=None):
+        """
+        Split count payload bytes into per-thread (begin, end) byte ranges
+        
+        Boundaries are multiples of bits_per_channel bytes, so every range
+        starts on a sample boundary and ranges touch disjoint samples.
+        """
+        threads = threads or RGBChannelSteganography.THREADS
+        if threads <= 1 or count < RGBChannelSteganography.PARALLEL_MIN_BYTES:
+            return [(0, count)]
+        k = bits_per_channel
+        per_thread = -(-count // threads)
+        per_thread = -(-per_thread // k) * k
+        return [(begin, min(begin + per_thread, count)) for begin in range(0, count, per_thread)]
+    
+    @staticmethod
+    def write_bytes(target, offset, data, bits_per_channel=1, threads=None):
+        """
+        Write data MSB-first into the low bits of target, starting at sample offset
+        
+        Each sample receives bits_per_channel bits; the last sample is zero
+        padded. Large payloads are split across threads. Returns the offset
+        of the first sample after the data.
+        """
+        source = np.frombuffer(data, dtype=np.uint8)
+        ranges = RGBChannelSteganography.split_ranges(source.size, bits_per_channel, threads)
+        write = lambda span: RGBChannelSteganography._write_range(
+            target, offset, source, span[0], span[1], bits_per_channel
+        )
+        if len(ranges) == 1:
+            write(ranges[0])
+        else:
+            list(RGBChannelSteganography.executor(len(ranges)).map(write, ranges))
+        return offset + -(-source.size * 8 // bits_per_channel)
+    
+    @staticmethod
+    def _write_range(target, offset, source, begin, end, bits_per_channel):
+        """Embed source[begin:end] (begin a multiple of bits_per_channel)"""
+        k = bits_per_channel
+        mask = (1 << k) - 1
+        group_bytes, shifts = RGBChannelSteganography.sample_groups(k)
+        # Whole k-bit groups per chunk so chunks start on a sample boundary
+        step = (RGBChannelSteganography.CODEC_CHUNK_BYTES // k) * k
+        for start in range(begin, end, step):
+            chunk = source[start:min(start + step, end)]
+            if k == 1:
+                values = np.unpackbits(chunk)
+            else:
+                padded = np.zeros(-(-chunk.size // group_bytes) * group_bytes, dtype=shifts.dtype)
+                padded[:chunk.size] = chunk
+                groups = padded.reshape(-1, group_bytes)
+                words = groups[:, 0]
+                for column in range(1, group_bytes):
+                    words = (words << 8) | groups[:, column]
+                values = ((words[:, None] >> shifts) & mask).astype(np.uint8).reshape(-1)
+                values = values[:-(-chunk.size * 8 // k)]
+            first = offset + start * 8 // k
+            segment = target[first:first + values.size]
+            segment &= ~target.dtype.type(mask)
+            segment |= values
+    
+    # Embedding engine used by encode_message: 'vectorized' or 'legacy'
+    ENGINE = os.environ.get('STEGO_ENGINE', 'vectorized')
+    
+    # Modes embedded in their own samples, with the samples per pixel of
+    # each: alpha is a fourth channel, P embeds in the palette indices and
+    # I;16 in the low bits of 16-bit samples. Other modes are converted.
+    NATIVE_BANDS = {'RGB': 3, 'RGBA': 4, 'L': 1, 'P': 1, 'I;16': 1, 'I;16B': 1}
+    
+    # Scale of palette alpha in parity_sorted: one step of alpha is farther
+    # than the largest RGB distance (sqrt(3) * 255)
+    ALPHA_WEIGHT = 442
+    
+    @staticmethod
+    def native_mode(mode):
+        """Mode an image of the given mode is embedded in: itself, RGBA if it has alpha, else RGB"""
+        if mode in RGBChannelSteganography.NATIVE_BANDS:
+            return mode
+        return 'RGBA' if mode in ('LA', 'La', 'PA', 'RGBa') else 'RGB'
+    
+    @staticmethod
+    def native_image(image_data):
+        """image_data itself if its mode is native, else a converted copy"""
+        mode = RGBChannelSteganography.native_mode(image_data.mode)
+        return image_data if image_data.mode == mode else image_data.convert(mode)
+    
+    @staticmethod
+    def samples_per_pixel(mode, channel='ALL'):
+        """Samples a channel selection uses per pixel: every band for ALL, else one"""
+        return RGBChannelSteganography.NATIVE_BANDS[mode] if channel == 'ALL' else 1
+    
+    @staticmethod
+    def parity_sorted(image_data, bits_per_channel=1):
+        """
+        P image with a parity-sorted palette, for embedding in indices
+        
+        Entries are ordered along a nearest-neighbour path from the darkest
+        one, so changing the low bits of an index moves to a close colour
+        instead of an arbitrary one. Alpha (from an RGBA palette or tRNS)
+        outweighs any colour difference, so entries of equal alpha are
+        visited together and a flipped bit keeps a pixel's transparency
+        wherever the groups allow. The palette is padded to a multiple of
+        2**bits_per_channel entries (repeating the last) so every modified
+        index exists. Indices are remapped in one pass with Image.point; an
+        already sorted image is returned as is.
+        """
+        palette_mode = image_data.palette.mode if image_data.palette else 'RGB'
+        bands = len(palette_mode)
+        palette = np.array(image_data.getpalette(palette_mode), dtype=np.uint8).reshape(-1, bands)
+        group = 1 << bits_per_channel
+        colors = len(palette)
+        padded = min(-(-colors // group) * group, 256)
+        
+        transparency = image_data.info.get('transparency')
+        alpha = np.full(colors, 255, dtype=np.int64)
+        if bands == 4:
+            alpha = palette[:, 3].astype(np.int64)
+        elif isinstance(transparency, int) and transparency < colors:
+            alpha[transparency] = 0
+        elif isinstance(transparency, bytes):
+            alpha[:min(len(transparency), colors)] = np.frombuffer(transparency[:colors], dtype=np.uint8)
+        entries = np.column_stack((palette[:, :3].astype(np.int64), alpha * RGBChannelSteganography.ALPHA_WEIGHT))
+        distances = ((entries[:, None] - entries[None]) ** 2).sum(axis=2)
+        luminance = entries[:, :3] @ np.array([299, 587, 114])
+        order = [int(luminance.argmin())]
+        distances[:, order[0]] = np.iinfo(np.int64).max
+        for _ in range(colors - 1):
+            order.append(int(distances[order[-1]].argmin()))
+            distances[:, order[-1]] = np.iinfo(np.int64).max
+        order = np.array(order)
+        if padded == colors and (order == np.arange(colors)).all():
+            return image_data
+        
+        order = np.concatenate((order, np.full(padded - colors, order[-1])))
+        lut = np.arange(256)
+        lut[order[:colors]] = np.arange(colors)
+        result = image_data.point(lut.tolist())
+        result.putpalette(palette[order].tobytes(), palette_mode)
+        
+        if isinstance(transparency, int):
+            result.info['transparency'] = int(lut[transparency])
+        elif isinstance(transparency, bytes):
+            alpha = np.frombuffer(transparency.ljust(colors, b'\xff')[:colors], dtype=np.uint8)
+            result.info['transparency'] = alpha[order].tobytes()
+        return result
+    
+    @staticmethod
+    def channel_view(img_array, channel='R'):
+        """
+        Return a flat view over the selected channel(s) of a pixel array
+        
+        Single channels are a strided view (every 3rd byte for RGB, every
+        4th for RGBA); ALL is the interleaved sequence of every band in
+        row-major order. Both match the order in which the legacy pixel loop
+        visits the bits. Single-plane (h, w) arrays have one view for every
+        channel name except A.
+        """
+        flat = img_array.reshape(-1)
+        bands = img_array.shape[2] if img_array.ndim == 3 else 1
+        if channel == 'A' and bands != 4:
+            raise ValueError("Channel A needs an image with an alpha channel")
+        if channel == 'ALL' or bands == 1:
+            return flat
+        return flat['RGBA'.index(channel)::bands]
+    
+    @staticmethod
+    def encode_message(image_data, message, channel='R', bits_per_channel=1, engine=None, in_place=False,
+                       compression='none', report=None, threads=None):
+        """
+        Encode message into image data
+        
+        Only the rows that hold the payload are copied into a NumPy buffer;
+        they are embedded there and pasted back through Image.frombuffer, so
+        the full frame is never duplicated as an array. Images in a
+        NATIVE_BANDS mode keep their mode (P images get a parity-sorted
+        palette); others are converted to RGB, or RGBA if they have alpha.
+        
+        Args:
+            image_data: PIL Image object
+            message: Message to hide
+            channel: Channel to use ('R', 'G', 'B', 'A', or 'ALL'); grayscale
+                and palette images have a single channel whatever the name
+            bits_per_channel: Low bits of each sample used for the payload (1-4)
+            engine: 'vectorized' or 'legacy' (defaults to ENGINE)
+            in_place: Modify image_data itself instead of a copy (native modes other than P)
+            compression: 'none', 'auto', or a codec name from CODECS
+            report: Optional dict, filled with the codec and payload sizes
+            threads: Worker threads for large payloads (defaults to THREADS)
+        
+        Returns:
+            (success, result_image_data_or_error)
+        """
+        engine = engine or RGBChannelSteganography.ENGINE
+        try:
+            data = message.encode('utf-8')
+            codec, stored = RGBChannelSteganography.compress_payload(data, compression)
+            if report is not None:
+                report.update({'codec': codec, 'payload_bytes': len(data), 'stored_bytes': len(stored)})
+            data = stored
+            header = RGBChannelSteganography.build_header(data, bits_per_channel, codec)
+            
+            if engine == 'legacy':
+                if bits_per_channel != 1:
+                    return False, "Legacy engine only supports 1 bit per channel"
+                if channel == 'A':
+                    return False, "Legacy engine only supports R, G, B, and ALL"
+                return RGBChannelSteganography._encode_message_legacy(image_data, header + data, channel)
+            
+            # Convert to a native mode if needed (conversion and palette
+            # sorting already yield a private copy)
+            native = RGBChannelSteganography.native_image(image_data)
+            if native.mode == 'P':
+                native = RGBChannelSteganography.parity_sorted(native, bits_per_channel)
+            if native is image_data and not in_place:
+                native = image_data.copy()
+            image_data = native
+            mode = image_data.mode
+            
+            message_length = (len(header) + len(data)) * 8
+            
+            # Calculate capacity
+            width, height = image_data.size
+            max_capacity = RGBChannelSteganography.capacity_bits(width, height, channel, bits_per_channel, mode)
+            
+            if message_length > max_capacity:
+                return False, f"Message too long. Max: {max_capacity} bits, needed: {message_length} bits"
+            
+            RGBChannelSteganography._embed_rows(image_data, header, data, channel, bits_per_channel, threads)
+            return True, image_data
+            
+        except Exception as e:
+            return False, str(e)
+    
+    @staticmethod
+    def _embed_rows(image_data, header, data, channel='R', bits_per_channel=1, threads=None):
+        """
+        Write header (1 bit per sample) then data into a native-mode image in place
+        
+        Only the band of rows the bits occupy is copied out, embedded and
+        pasted back over the original rows.
+        """
+        mode = image_data.mode
+        width = image_data.size[0]
+        samples_per_row = width * RGBChannelSteganography.samples_per_pixel(mode, channel)
+        samples = len(header) * 8 + -(-len(data) * 8 // bits_per_channel)
+        rows = -(-samples // samples_per_row)
+        band = np.array(image_data.crop((0, 0, width, rows)))
+        
+        # Write header and payload bytes into the selected channel(s)
+        target = RGBChannelSteganography.channel_view(band, channel)
+        offset = RGBChannelSteganography.write_bytes(target, 0, header)
+        RGBChannelSteganography.write_bytes(target, offset, data, bits_per_channel, threads)
+        
+        # Paste the band back over the original rows
+        image_data.paste(Image.frombuffer(mode, (width, rows), band, 'raw', mode, 0, 1), (0, 0))
+    
+    @staticmethod
+    def encode_stream(source, message, channel='R', bits_per_channel=1, compression='none',
+                      report=None, strip_rows=None):
+        """
+        Encode message into a PNGStreamImage, producing the result strip by strip
+        
+        Only the rows holding the payload are embedded, as one band; the rest
+        of the image passes through in strips, so peak memory is the payload
+        band plus a few strips regardless of image size. Feed the strips to
+        PNGStreamWriter to write the encoded PNG.
+        
+        Args:
+            source: PNGStreamImage positioned at its first row
+            message: Message to hide
+            channel, bits_per_channel, compression, report: As in encode_message
+            strip_rows: Rows per pass-through strip (defaults to PNGStreamImage.STRIP_ROWS)
+        
+        Returns:
+            (success, strips_iterator_or_error)
+        """
+        try:
+            data = message.encode('utf-8')
+            codec, stored = RGBChannelSteganography.compress_payload(data, compression)
+            if report is not None:
+                report.update({'codec': codec, 'payload_bytes': len(data), 'stored_bytes': len(stored)})
+            header = RGBChannelSteganography.build_header(stored, bits_per_channel, codec)
+            message_length = (len(header) + len(stored)) * 8
+            
+            # Calculate capacity
+            width, height = source.size
+            max_capacity = RGBChannelSteganography.capacity_bits(width, height, channel, bits_per_channel, source.mode)
+            
+            if message_length > max_capacity:
+                return False, f"Message too long. Max: {max_capacity} bits, needed: {message_length} bits"
+            
+            samples_per_row = width * RGBChannelSteganography.samples_per_pixel(source.mode, channel)
+            samples = RGBChannelSteganography.HEADER_BITS + -(-len(stored) * 8 // bits_per_channel)
+            rows = -(-samples // samples_per_row)
+            
+            band = np.array(source.read_strip(rows))
+            target = RGBChannelSteganography.channel_view(band, channel)
+            offset = RGBChannelSteganography.write_bytes(target, 0, header)
+            RGBChannelSteganography.write_bytes(target, offset, stored, bits_per_channel)
+            return True, itertools.chain([band], source.iter_strips(strip_rows))
+            
+        except Exception as e:
+            return False, str(e)
+    
+    @staticmethod
+    def encode_in_place(raw_image, message, channel='R', bits_per_channel=1, compression='none', report=None):
+        """
+        Encode message directly into the pixel bytes of a RawPixelImage
+        
+        Only the rows holding the payload are copied out, embedded and
+        written back; the file keeps its format and is never decoded.
+        
+        Args:
+            raw_image: RawPixelImage over a writable buffer
+            message, channel, bits_per_channel, compression, report: As in encode_message
+        
+        Returns:
+            (success, raw_image_or_error)
+        """
+        try:
+            data = message.encode('utf-8')
+            codec, stored = RGBChannelSteganography.compress_payload(data, compression)
+            if report is not None:
+                report.update({'codec': codec, 'payload_bytes': len(data), 'stored_bytes': len(stored)})
+            header = RGBChannelSteganography.build_header(stored, bits_per_channel, codec)
+            message_length = (len(header) + len(stored)) * 8
+            
+            # Calculate capacity
+            width, height = raw_image.size
+            max_capacity = RGBChannelSteganography.capacity_bits(width, height, channel, bits_per_channel, raw_image.mode)
+            
+            if message_length > max_capacity:
+                return False, f"Message too long. Max: {max_capacity} bits, needed: {message_length} bits"
+            
+            samples_per_row = width * RGBChannelSteganography.samples_per_pixel(raw_image.mode, channel)
+            samples = RGBChannelSteganography.HEADER_BITS + -(-len(stored) * 8 // bits_per_channel)
+            rows = -(-samples // samples_per_row)
+            
+            band = raw_image.crop((0, 0, width, rows))
+            target = RGBChannelSteganography.channel_view(band, channel)
+            offset = RGBChannelSteganography.write_bytes(target, 0, header)
+            RGBChannelSteganography.write_bytes(target, offset, stored, bits_per_channel)
+            raw_image.paste_rows(0, band)
+            return True, raw_image
+            
+        except Exception as e:
+            return False, str(e)
+    
+    @staticmethod
+    def encode_frames(frames, message, channel='R', bits_per_channel=1, compression='none', report=None,
+                      threads=None):
+        """
+        Encode message across the frames of a FrameSequence
+        
+        The header and as much payload as fits go into the first frame, the
+        rest continues in the following frames (see frame_capacities), so a
+        short message only touches the first frame. Frames are read lazily
+        and embedded concurrently on the shared thread pool, at most two per
+        thread in flight; frames past the payload pass through unchanged.
+        
+        Args:
+            frames: FrameSequence
+            message, channel, bits_per_channel, compression, report: As in encode_message
+            threads: Frames embedded concurrently (defaults to THREADS)
+        
+        Returns:
+            (success, iterator_of_frames_or_error), frames as PIL images in order
+        """
+        try:
+            data = message.encode('utf-8')
+            codec, stored = RGBChannelSteganography.compress_payload(data, compression)
+            if report is not None:
+                report.update({'codec': codec, 'payload_bytes': len(data), 'stored_bytes': len(stored)})
+            header = RGBChannelSteganography.build_header(stored, bits_per_channel, codec)
+            
+            if channel == 'A' and any(mode != 'RGBA' for _, mode in frames.frames):
+                return False, "Channel A needs an image with an alpha channel"
+            
+            # Calculate capacity
+            capacities = RGBChannelSteganography.frame_capacities(frames.frames, channel, bits_per_channel)
+            if len(stored) > sum(capacities):
+                needed = (len(header) + len(stored)) * 8
+                available = RGBChannelSteganography.HEADER_BITS + sum(capacities) * 8
+                return False, f"Message too long. Max: {available} bits across {len(frames)} frames, needed: {needed} bits"
+            
+            threads = threads or RGBChannelSteganography.THREADS
+            
+            def embed(frame, frame_header, chunk):
+                if frame.mode == 'P':
+                    frame = RGBChannelSteganography.parity_sorted(frame, bits_per_channel)
+                RGBChannelSteganography._embed_rows(frame, frame_header, chunk, channel, bits_per_channel, 1)
+                return frame
+            
+            def generate():
+                pool = RGBChannelSteganography.executor(threads)
+                pending = deque()
+                offset = 0
+                for index, frame in enumerate(frames):
+                    chunk = stored[offset:offset + capacities[index]]
+                    offset += len(chunk)
+                    if index == 0 or chunk:
+                        pending.append(pool.submit(embed, frame, header if index == 0 else b'', chunk))
+                    else:
+                        # Past the payload: pass the frame through as a finished future
+                        pending.append(Future())
+                        pending[-1].set_result(frame)
+                    while pending and (pending[0].done() or len(pending) > 2 * threads):
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            
+            return True, generate()
+            
+        except Exception as e:
+            return False, str(e)
+    
+    @staticmethod
+    def _encode_message_legacy(image_data, payload, channel='R'):
+        """Original per-pixel encoder, kept for comparison and benchmarking"""
+        try:
+            # Convert to RGB if needed
+            if image_data.mode != 'RGB':
+                image_data = image_data.convert('RGB')
+            
+            img_array = np.array(image_data)
+            binary_message = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
+            message_length = len(binary_message)
+            
+            # Calculate capacity
+            height, width, channels = img_array.shape
+            max_capacity = height * width * (3 if channel == 'ALL' else 1)
+            
+            if message_length > max_capacity:
+                return False, f"Message too long. Max: {max_capacity} bits, needed: {message_length} bits"
+            
             # Select channels
             if channel == 'R':
                 channel_indices = [0]
@@ -146,120 +2105,1999 @@ class RGBChannelSteganography:
             else:  # ALL
                 channel_indices = [0, 1, 2]
             
-            # Extract bits
-            binary_message = ''
-            for i in range(height):
-                for j in range(width):
-                    for c in channel_indices:
-                        pixel_value = img_array[i, j, c]
-                        binary_message += str(pixel_value & 1)
+            # Encode message
+            bit_index = 0
+            for i in range(height):
+                for j in range(width):
+                    for c in channel_indices:
+                        if bit_index < message_length:
+                            pixel_value = img_array[i, j, c]
+                            message_bit = int(binary_message[bit_index])
+                            new_pixel_value = (pixel_value & 0xFE) | message_bit
+                            img_array[i, j, c] = new_pixel_value
+                            bit_index += 1
+                        else:
+                            break
+                    if bit_index >= message_length:
+                        break
+                if bit_index >= message_length:
+                    break
+            
+            # Convert back to PIL Image
+            result_img = Image.fromarray(img_array.astype(np.uint8))
+            return True, result_img
+            
+        except Exception as e:
+            return False, str(e)
+    
+    # Number of LSBs extracted per step while scanning for the delimiter
+    DECODE_CHUNK_BITS = 1 << 16
+    
+    @staticmethod
+    def find_delimiter(bits):
+        """
+        Return the index of the first end delimiter in a 0/1 bit array, or -1
+        
+        The delimiter is fifteen 1 bits followed by a 0 bit and may start at
+        any bit offset, exactly like the str.index search in binary_to_string.
+        """
+        candidates = len(bits) - 15
+        if candidates <= 0:
+            return -1
+        ones = np.concatenate(([0], np.cumsum(bits, dtype=np.int64)))
+        window_sums = ones[15:15 + candidates] - ones[:candidates]
+        hits = np.flatnonzero((window_sums == 15) & (bits[15:15 + candidates] == 0))
+        return int(hits[0]) if hits.size else -1
+    
+    @staticmethod
+    def read_bytes(lsb_source, offset, count, bits_per_channel=1, threads=None):
+        """
+        Pack count bytes from the low bits of lsb_source, starting at sample offset
+        
+        Returns a bytearray (shorter if the source ends); bits are unpacked
+        CODEC_CHUNK_BYTES at a time and large reads are split across threads.
+        """
+        ranges = RGBChannelSteganography.split_ranges(count, bits_per_channel, threads)
+        read = lambda span: RGBChannelSteganography._read_range(
+            lsb_source, offset, span[0], span[1], bits_per_channel
+        )
+        if len(ranges) == 1:
+            return read(ranges[0])
+        
+        data = bytearray()
+        for part in RGBChannelSteganography.executor(len(ranges)).map(read, ranges):
+            data += part
+        return data
+    
+    @staticmethod
+    def _read_range(lsb_source, offset, begin, end, bits_per_channel):
+        """Extract payload bytes [begin, end) (begin a multiple of bits_per_channel)"""
+        k = bits_per_channel
+        mask = (1 << k) - 1
+        group_bytes, shifts = RGBChannelSteganography.sample_groups(k)
+        byte_shifts = np.arange((group_bytes - 1) * 8, -1, -8, dtype=shifts.dtype)
+        data = bytearray()
+        step = (RGBChannelSteganography.CODEC_CHUNK_BYTES // k) * k
+        for start in range(begin, end, step):
+            wanted = min(step, end - start)
+            first = offset + start * 8 // k
+            values = (lsb_source[first:first + -(-wanted * 8 // k)] & mask).astype(np.uint8, copy=False)
+            if k == 1:
+                packed = np.packbits(values[:values.size - values.size % 8])
+            else:
+                # Rebuild each group's word from its samples, then split it into bytes
+                groups = values[:values.size - values.size % shifts.size].reshape(-1, shifts.size)
+                words = groups[:, 0].astype(shifts.dtype) << shifts[0]
+                for column in range(1, shifts.size):
+                    words |= groups[:, column].astype(shifts.dtype) << shifts[column]
+                packed = ((words[:, None] >> byte_shifts) & 0xFF).astype(np.uint8).reshape(-1)
+                if values.size % shifts.size:
+                    # Partial group at the end of the source: fall back to bits
+                    tail = values[groups.size:]
+                    bits = np.unpackbits(tail[:, None], axis=1)[:, 8 - k:].reshape(-1)
+                    packed = np.concatenate((packed, np.packbits(bits[:bits.size - bits.size % 8])))
+            packed = packed[:wanted]
+            data += packed.tobytes()
+            if packed.size < wanted:
+                break
+        return data
+    
+    @staticmethod
+    def looks_like_text(data):
+        """Heuristic for legacy payloads: printable Latin-1 or common whitespace"""
+        return all(byte in (9, 10, 13) or 32 <= byte < 127 or byte >= 160 for byte in data)
+    
+    # Channel layouts probed by detect_channel, in order of preference
+    DETECT_ORDER = ['ALL', 'R', 'G', 'B', 'A']
+    
+    @staticmethod
+    def detect_channel(image_data):
+        """
+        Find the channel layout holding a message, reading only the first rows
+        
+        The rows covering the longest probe are converted once and every
+        layout is checked on that shared band: a payload header wins, then a
+        legacy delimiter found within the probe, then legacy text that
+        continues past it. A is only probed in RGBA images, and single-plane
+        images only have the ALL layout.
+        
+        Returns:
+            'R', 'G', 'B', 'A', 'ALL', or None if no layout holds a message
+        """
+        image_data = RGBChannelSteganography.native_image(image_data)
+        bands = RGBChannelSteganography.NATIVE_BANDS[image_data.mode]
+        
+        width, height = image_data.size
+        probe_bits = max(RGBChannelSteganography.HEADER_BITS, RGBChannelSteganography.LEGACY_PROBE_CHARS * 8 + 16)
+        rows = min(-(-probe_bits // width), height)
+        band = np.asarray(image_data.crop((0, 0, width, rows)))
+        views = {
+            channel: RGBChannelSteganography.channel_view(band, channel)
+            for channel in RGBChannelSteganography.DETECT_ORDER[:1 if bands == 1 else bands + 1]
+        }
+        
+        for channel, view in views.items():
+            header = RGBChannelSteganography.read_bytes(view, 0, RGBChannelSteganography.HEADER_SIZE)
+            if header[:4] == RGBChannelSteganography.PAYLOAD_MAGIC:
+                return channel
+        
+        # Legacy images: prefer a layout whose delimiter ends a short text
+        candidates = []
+        for channel, view in views.items():
+            bits = view[:probe_bits] & 1
+            position = RGBChannelSteganography.find_delimiter(bits)
+            text = np.packbits(bits)[:(position if position >= 0 else bits.size) // 8].tobytes()
+            if text and RGBChannelSteganography.looks_like_text(text):
+                if position >= 0:
+                    return channel
+                candidates.append(channel)
+        return candidates[0] if candidates else None
+    
+    @staticmethod
+    def decode_message(image_data, channel='R', max_length=None, bits_per_channel=None, engine=None, threads=None):
+        """
+        Decode message from image data
+        
+        The container header is read first; its length field tells exactly
+        how many bits to read. Images without the header are treated as the
+        legacy delimiter format, but only scanned when they start with text,
+        so a wrong channel fails after a few dozen pixels either way.
+        
+        Args:
+            image_data: PIL Image object
+            channel: Channel used during encoding ('R', 'G', 'B', 'A', or 'ALL')
+            max_length: Maximum number of characters to return (None for no limit)
+            bits_per_channel: Expected bits per sample (None to take it from the header)
+            engine: 'vectorized' or 'legacy' (defaults to ENGINE)
+            threads: Worker threads for large payloads (defaults to THREADS)
+        
+        Returns:
+            (success, decoded_message_or_error)
+        """
+        engine = engine or RGBChannelSteganography.ENGINE
+        try:
+            if engine == 'legacy':
+                # Convert to RGB if needed
+                if channel == 'A':
+                    return False, "Legacy engine only supports R, G, B, and ALL"
+                if image_data.mode != 'RGB':
+                    image_data = image_data.convert('RGB')
+                lsb_source = RGBChannelSteganography._extract_lsbs_legacy(np.asarray(image_data), channel)
+            else:
+                # Read the samples of the native mode (converting other modes)
+                image_data = RGBChannelSteganography.native_image(image_data)
+                lsb_source = ImageLSBSource(image_data, channel)
+                if channel == 'A' and RGBChannelSteganography.NATIVE_BANDS[image_data.mode] != 4:
+                    return False, "Channel A needs an image with an alpha channel"
+            
+            header = RGBChannelSteganography.read_bytes(
+                lsb_source, 0, RGBChannelSteganography.HEADER_SIZE
+            )
+            if header[:4] == RGBChannelSteganography.PAYLOAD_MAGIC:
+                if engine == 'legacy' and header[5] & RGBChannelSteganography.FLAG_BITS_PER_CHANNEL:
+                    return False, "Legacy engine only supports 1 bit per channel"
+                return RGBChannelSteganography._decode_container(
+                    lsb_source, header, max_length, bits_per_channel, threads
+                )
+            
+            # Delimiter-terminated images predate multi-bit embedding
+            if bits_per_channel not in (None, 1):
+                return True, ''
+            return RGBChannelSteganography._decode_delimited(lsb_source, max_length)
+            
+        except Exception as e:
+            return False, str(e)
+    
+    @staticmethod
+    def _decode_container(lsb_source, header, max_length=None, bits_per_channel=None, threads=None):
+        """Read a versioned payload whose header has already been extracted"""
+        success, fields = RGBChannelSteganography._parse_header(header, bits_per_channel)
+        if not success:
+            return False, fields
+        length, checksum, encoded_bits, codec = fields
+        
+        header_bits = RGBChannelSteganography.HEADER_BITS
+        if header_bits + -(-length * 8 // encoded_bits) > lsb_source.size:
+            return False, "Payload length exceeds image capacity"
+        
+        data = RGBChannelSteganography.read_bytes(lsb_source, header_bits, length, encoded_bits, threads)
+        return RGBChannelSteganography._unpack_payload(data, checksum, codec, max_length)
+    
+    @staticmethod
+    def _parse_header(header, bits_per_channel=None):
+        """
+        Validate an extracted container header
+        
+        Returns:
+            (success, (length, checksum, bits_per_channel, codec) or error)
+        """
+        if len(header) < RGBChannelSteganography.HEADER_SIZE:
+            return False, "Truncated payload header"
+        
+        magic, version, flags, length, checksum = struct.unpack(
+            RGBChannelSteganography.HEADER_FORMAT, header
+        )
+        if version != RGBChannelSteganography.PAYLOAD_VERSION:
+            return False, f"Unsupported payload version: {version}"
+        
+        encoded_bits = (flags & RGBChannelSteganography.FLAG_BITS_PER_CHANNEL) + 1
+        if bits_per_channel is not None and bits_per_channel != encoded_bits:
+            return False, f"Image was encoded with {encoded_bits} bit(s) per channel, not {bits_per_channel}"
+        
+        codec_id = (flags & RGBChannelSteganography.FLAG_CODEC) >> RGBChannelSteganography.FLAG_CODEC_SHIFT
+        return True, (length, checksum, encoded_bits, RGBChannelSteganography.CODECS[codec_id])
+    
+    @staticmethod
+    def _unpack_payload(data, checksum, codec, max_length=None):
+        """Check, decompress and decode the stored payload bytes"""
+        if zlib.crc32(data) != checksum:
+            return False, "Payload checksum mismatch"
+        
+        data = RGBChannelSteganography.decompress_payload(data, codec)
+        
+        message = data.decode('utf-8')
+        if max_length is not None:
+            message = message[:max_length]
+        return True, message
+    
+    @staticmethod
+    def decode_frames(frames, channel='R', max_length=None, bits_per_channel=None, threads=None):
+        """
+        Decode a message spread across the frames of a FrameSequence
+        
+        The header is read from the first frame; frames are then read only
+        as far as the payload extends, with their shares (frame_capacities)
+        extracted concurrently on the shared thread pool. Legacy payloads
+        live in the first frame and are decoded like a single image.
+        
+        Args:
+            frames: FrameSequence
+            channel, max_length, bits_per_channel: As in decode_message
+            threads: Frames extracted concurrently (defaults to THREADS)
+        
+        Returns:
+            (success, decoded_message_or_error)
+        """
+        try:
+            iterator = iter(frames)
+            first = next(iterator)
+            if channel == 'A' and first.mode != 'RGBA':
+                return False, "Channel A needs an image with an alpha channel"
+            lsb_source = ImageLSBSource(first, channel)
+            header = RGBChannelSteganography.read_bytes(lsb_source, 0, RGBChannelSteganography.HEADER_SIZE)
+            if header[:4] != RGBChannelSteganography.PAYLOAD_MAGIC:
+                return RGBChannelSteganography.decode_message(first, channel, max_length, bits_per_channel)
+            
+            success, fields = RGBChannelSteganography._parse_header(header, bits_per_channel)
+            if not success:
+                return False, fields
+            length, checksum, encoded_bits, codec = fields
+            
+            capacities = RGBChannelSteganography.frame_capacities(frames.frames, channel, encoded_bits)
+            if length > sum(capacities):
+                return False, "Payload length exceeds image capacity"
+            
+            threads = threads or RGBChannelSteganography.THREADS
+            pool = RGBChannelSteganography.executor(threads)
+            read = lambda frame, offset, count: RGBChannelSteganography.read_bytes(
+                ImageLSBSource(frame, channel), offset, count, encoded_bits, 1
+            )
+            count = min(length, capacities[0])
+            pending = deque([pool.submit(read, first, RGBChannelSteganography.HEADER_BITS, count)])
+            data = bytearray()
+            remaining = length - count
+            for index, frame in enumerate(iterator, 1):
+                if remaining <= 0:
+                    break
+                count = min(remaining, capacities[index])
+                pending.append(pool.submit(read, frame, 0, count))
+                remaining -= count
+                while len(pending) > 2 * threads:
+                    data += pending.popleft().result()
+            while pending:
+                data += pending.popleft().result()
+            
+            return RGBChannelSteganography._unpack_payload(bytes(data), checksum, codec, max_length)
+            
+        except Exception as e:
+            return False, str(e)
+    
+    @staticmethod
+    def _decode_delimited(lsb_source, max_length=None):
+        """
+        Read a legacy payload: 8-bit characters terminated by the delimiter
+        
+        LSBs are extracted in chunks of DECODE_CHUNK_BITS and packed into bytes
+        as they are read; reading stops as soon as the delimiter is found, so
+        work and memory are proportional to the message, not the image.
+        """
+        # Never read more than the message plus its delimiter
+        bit_limit = lsb_source.size
+        if max_length is not None:
+            bit_limit = min(bit_limit, max_length * 8 + 16)
+        
+        # Bail out early unless the payload starts like a text message
+        probe_bits = lsb_source[:min(RGBChannelSteganography.LEGACY_PROBE_CHARS * 8 + 16, bit_limit)] & 1
+        position = RGBChannelSteganography.find_delimiter(probe_bits)
+        probe_chars = (position if position >= 0 else probe_bits.size) // 8
+        if not RGBChannelSteganography.looks_like_text(np.packbits(probe_bits)[:probe_chars].tobytes()):
+            return True, ''
+        
+        chunk_bits = RGBChannelSteganography.DECODE_CHUNK_BITS
+        packed_chunks = []
+        tail = np.empty(0, dtype=np.uint8)
+        bits_read = 0
+        message_bits = None
+        
+        while bits_read < bit_limit:
+            chunk = lsb_source[bits_read:min(bits_read + chunk_bits, bit_limit)] & 1
+            packed_chunks.append(np.packbits(chunk))
+            
+            # Delimiter may straddle the previous chunk: keep its last 15 bits
+            window = np.concatenate((tail, chunk))
+            position = RGBChannelSteganography.find_delimiter(window)
+            if position >= 0:
+                message_bits = bits_read - tail.size + position
+                break
+            
+            bits_read += chunk.size
+            tail = window[-15:]
+        
+        if message_bits is None:
+            # No delimiter: return everything read, like binary_to_string
+            message_bits = bits_read
+        
+        # Chunks are multiples of 8 bits, so packed bytes line up with the stream
+        message_bytes = np.concatenate(packed_chunks)[:message_bits // 8] if packed_chunks else b''
+        if max_length is not None:
+            message_bytes = message_bytes[:max_length]
+        
+        return True, bytes(message_bytes).decode('latin-1')
+    
+    @staticmethod
+    def _extract_lsbs_legacy(img_array, channel='R'):
+        """Original per-pixel LSB extraction, kept for comparison and benchmarking"""
+        height, width, channels = img_array.shape
+        
+        # Select channels
+        if channel == 'R':
+            channel_indices = [0]
+        elif channel == 'G':
+            channel_indices = [1]
+        elif channel == 'B':
+            channel_indices = [2]
+        else:  # ALL
+            channel_indices = [0, 1, 2]
+        
+        # Extract bits
+        binary_message = ''
+        for i in range(height):
+            for j in range(width):
+                for c in channel_indices:
+                    pixel_value = img_array[i, j, c]
+                    binary_message += str(pixel_value & 1)
+        
+        return np.frombuffer(binary_message.encode('ascii'), dtype=np.uint8) - ord('0')
+
+# API Routes
+
+@app.route('/', methods=['GET'])
+def home():
+    """API information endpoint"""
+    return jsonify({
+        'service': 'Steganography API',
+        'version': '1.1.0',
+        'status': 'running',
+        'description': 'RGB Channel Steganography API',
+        'endpoints': {
+            'GET /': 'API information',
+            'GET /health': 'Health check',
+            'POST /encode': 'Encode message into image (returns JSON with base64)',
+            'POST /encode-download': 'Encode message into image (returns file for download)',
+            'POST /decode': 'Decode message from image',
+            'POST /encode/raw': 'Encode message into a raw image body (returns the PNG bytes)',
+            'POST /decode/raw': 'Decode message from a raw image body (returns the text)',
+            'POST /encode/batch': 'Encode messages into many images (streams a ZIP or NDJSON as items finish)',
+            'POST /decode/batch': 'Decode messages from many images (streams NDJSON as items finish)',
+            'POST /jobs/encode': 'Queue an encode job (returns 202 with a job id)',
+            'POST /jobs/decode': 'Queue a decode job (returns 202 with a job id)',
+            'GET /jobs/<id>': 'Job status and progress (with the message of decode jobs)',
+            'GET /jobs/<id>/result': 'Result of a finished job (the encoded image, or the message as text)',
+            'POST /info': 'Get image capacity information'
+        },
+        'usage': {
+            'encode': 'Send multipart form with "image" file and "message" text, optional "channel" (R/G/B/ALL) and "bits_per_channel" (1-4), "compression" (auto/none/zlib/bz2/lzma), "output" (auto/fastest/balanced/smallest/webp/bmp/tiff) and "latency_budget" (seconds, for output=auto)',
+            'encode-download': 'Same as encode but returns file directly for download',
+            'decode': 'Send multipart form with "image" file, optional "channel" (R/G/B/ALL/AUTO), "bits_per_channel" (1-4, read from the image if omitted) and "max_length" (characters)',
+            'info': 'Send multipart form with "image" file (the first few KB of the file are enough)',
+            'encode/raw': 'Send the image as an application/octet-stream body; "message" (or "message_bytes", the length of a UTF-8 message appended to the body), "channel", "bits_per_channel", "compression", "output" and "latency_budget" go in the query string or X-Stego-* headers; metadata comes back in X-Stego-* headers',
+            'decode/raw': 'Send the image as an application/octet-stream body; "channel", "bits_per_channel" and "max_length" go in the query string or X-Stego-* headers; the message is returned as text/plain',
+            'encode/batch': 'Send multipart form with repeated "image" files and a "message" per image (in the same order); "channel", "bits_per_channel", "compression" and "output" take one value for all images or one per image; "format" (zip/ndjson) picks the response',
+            'decode/batch': 'Send multipart form with repeated "image" files; "channel" (R/G/B/A/ALL/AUTO), "bits_per_channel" and "max_length" take one value for all images or one per image; one NDJSON line comes back per image',
+            'jobs': 'POST /jobs/encode and /jobs/decode take the /encode and /decode forms and return 202 with a job id; poll GET /jobs/<id> for status and progress, then fetch GET /jobs/<id>/result. /encode, /encode-download and /decode return the same 202 when the image would take too long to process synchronously',
+            'cache': 'Repeating an /encode, /encode-download, /decode or raw request with the same image and parameters is answered from a result cache shared by the server workers; the X-Cache response header is HIT or MISS'
+        }
+    })
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Health check endpoint"""
+    return jsonify({
+        'status': 'healthy',
+        'service': 'steganography-api',
+        'cache': result_cache().stats(),
+        'shared_cache': shared_cache().stats() if shared_cache() is not None else None
+    })
+
+@app.route('/encode', methods=['POST'])
+def encode():
+    """Encode message into image - returns JSON with base64"""
+    try:
+        # Validate request
+        if 'image' not in request.files:
+            return jsonify({'error': 'No image file provided'}), 400
+        
+        if 'message' not in request.form:
+            return jsonify({'error': 'No message provided'}), 400
+        
+        file = request.files['image']
+        message = request.form['message']
+        channel = request.form.get('channel', 'R').upper()
+        bits_per_channel = parse_bits_per_channel(request.form.get('bits_per_channel', 1))
+        compression = request.form.get('compression', 'auto').lower()
+        output = request.form.get('output', '').lower() or None
+        latency_budget = request.form.get('latency_budget')
+        
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        
+        if not allowed_file(file.filename):
+            return jsonify({'error': 'File type not supported'}), 400
+        
+        if channel not in ['R', 'G', 'B', 'A', 'ALL']:
+            return jsonify({'error': 'Channel must be R, G, B, A, or ALL'}), 400
+        
+        if bits_per_channel is None:
+            return jsonify({'error': 'bits_per_channel must be 1, 2, 3 or 4'}), 400
+        
+        if compression not in ['auto'] + RGBChannelSteganography.CODECS:
+            return jsonify({'error': 'Compression must be auto, none, zlib, bz2, or lzma'}), 400
+        
+        if output is not None and output not in ['auto', 'same'] + list(OUTPUT_PROFILES):
+            return jsonify({'error': 'Output must be auto, same, fastest, balanced, smallest, webp, bmp, or tiff'}), 400
+        
+        if latency_budget is not None:
+            latency_budget = parse_latency_budget(latency_budget)
+            if latency_budget is None:
+                return jsonify({'error': 'latency_budget must be a positive number of seconds'}), 400
+        
+        if not message.strip():
+            return jsonify({'error': 'Message cannot be empty'}), 400
+        
+        # Repeated requests are answered from the result cache
+        stream = upload_stream(file)
+        digest = upload_digest(stream)
+        key = cache_key('encode', digest, message, channel, bits_per_channel, compression, output,
+                        latency_budget or app.config['OUTPUT_LATENCY_BUDGET'])
+        cached = cached_result(key)
+        if cached is not None:
+            encoded, metadata = cached
+            return jsonify({
+                'success': True,
+                'message': 'Message successfully encoded',
+                'image_base64': base64.b64encode(encoded).decode('ascii'),
+                'metadata': dict(metadata, original_filename=file.filename)
+            })
+        
+        # Load image; animations and multi-page TIFFs are read frame by frame,
+        # uncompressed BMP/PPM/TIFF are edited in place
+        try:
+            image = Image.open(stream)
+            frames = FrameSequence.open(image) if RGBChannelSteganography.ENGINE != 'legacy' else None
+            raw_image = raw_pixel_target(image, file.stream, output) if frames is None else None
+        except Exception as e:
+            return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
+        
+        if frames is not None:
+            profile = frames_output_profile(frames, output, latency_budget)
+            if profile is None:
+                return jsonify({'error': f'Output {output} cannot hold {len(frames)} frames; '
+                                         f'use a PNG profile (animations) or tiff'}), 400
+        
+        # Work estimated to outlast the request timeout runs as a job (202)
+        if raw_image is None:
+            if frames is None:
+                profile = output_profile(output or 'balanced', image.size[0], image.size[1], latency_budget, image.format)
+            estimate = promote_seconds(image, frames, profile)
+            if estimate is not None:
+                job = submit_job('encode', encode_job_params(file, message, channel, bits_per_channel, compression,
+                                                             output, latency_budget), file.stream)
+                return job_accepted(job, estimate)
+        
+        # Encode message
+        payload_report = {}
+        if frames is not None:
+            success, result = RGBChannelSteganography.encode_frames(
+                frames, message, channel, bits_per_channel, compression, payload_report
+            )
+        elif raw_image is not None:
+            success, result = RGBChannelSteganography.encode_in_place(
+                raw_image, message, channel, bits_per_channel, compression, payload_report
+            )
+        else:
+            image = shared_cover(digest, image)
+            source_format = image.format
+            success, result = RGBChannelSteganography.encode_message(
+                image, message, channel, bits_per_channel, in_place=True,
+                compression=compression, report=payload_report
+            )
+        
+        if not success:
+            return jsonify({'error': result}), 400
+        
+        # Write the output file
+        if frames is not None:
+            output_format = OUTPUT_PROFILES[profile]['format']
+            try:
+                img_buffer, encode_seconds = encode_output_frames(frames, result, profile)
+            except Exception as e:
+                return jsonify({'error': f'Could not write {profile} output: {str(e)}'}), 400
+            encoded = img_buffer.getvalue()
+        elif raw_image is not None:
+            profile, output_format, encode_seconds = 'same', raw_image.format, 0.0
+            encoded = bytes(memoryview(raw_image.buffer)[:raw_image.length])
+        else:
+            profile = output_profile(output or 'balanced', result.size[0], result.size[1], latency_budget, source_format)
+            output_format = OUTPUT_PROFILES[profile]['format']
+            try:
+                img_buffer, encode_seconds = encode_output(result, profile)
+            except Exception as e:
+                return jsonify({'error': f'Could not write {profile} output: {str(e)}'}), 400
+            encoded = img_buffer.getvalue()
+        
+        metadata = encode_metadata(channel, bits_per_channel, message, payload_report, output_format, profile,
+                                   encode_seconds, len(frames) if frames is not None else 1)
+        store_result(key, (encoded, metadata), len(encoded))
+        
+        return jsonify({
+            'success': True,
+            'message': 'Message successfully encoded',
+            'image_base64': base64.b64encode(encoded).decode('ascii'),
+            'metadata': dict(metadata, original_filename=file.filename)
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/encode-download', methods=['POST'])
+def encode_download():
+    """Encode message into image - returns file directly for download"""
+    try:
+        # Validate request
+        if 'image' not in request.files:
+            return jsonify({'error': 'No image file provided'}), 400
+        
+        if 'message' not in request.form:
+            return jsonify({'error': 'No message provided'}), 400
+        
+        file = request.files['image']
+        message = request.form['message']
+        channel = request.form.get('channel', 'R').upper()
+        bits_per_channel = parse_bits_per_channel(request.form.get('bits_per_channel', 1))
+        compression = request.form.get('compression', 'auto').lower()
+        output = request.form.get('output', '').lower() or None
+        latency_budget = request.form.get('latency_budget')
+        
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        
+        if not allowed_file(file.filename):
+            return jsonify({'error': 'File type not supported'}), 400
+        
+        if channel not in ['R', 'G', 'B', 'A', 'ALL']:
+            return jsonify({'error': 'Channel must be R, G, B, A, or ALL'}), 400
+        
+        if bits_per_channel is None:
+            return jsonify({'error': 'bits_per_channel must be 1, 2, 3 or 4'}), 400
+        
+        if compression not in ['auto'] + RGBChannelSteganography.CODECS:
+            return jsonify({'error': 'Compression must be auto, none, zlib, bz2, or lzma'}), 400
+        
+        if output is not None and output not in ['auto', 'same'] + list(OUTPUT_PROFILES):
+            return jsonify({'error': 'Output must be auto, same, fastest, balanced, smallest, webp, bmp, or tiff'}), 400
+        
+        if latency_budget is not None:
+            latency_budget = parse_latency_budget(latency_budget)
+            if latency_budget is None:
+                return jsonify({'error': 'latency_budget must be a positive number of seconds'}), 400
+        
+        if not message.strip():
+            return jsonify({'error': 'Message cannot be empty'}), 400
+        
+        # Generate download filename
+        original_name = secure_filename(file.filename)
+        name_without_ext = os.path.splitext(original_name)[0]
+        
+        stream = upload_stream(file)
+        
+        # Large PNGs are encoded strip by strip without decoding the whole image
+        try:
+            stream_image = None
+            if RGBChannelSteganography.ENGINE != 'legacy':
+                stream_image = PNGStreamImage.open(stream)
+        except Exception as e:
+            return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
+        
+        streamed = (stream_image is not None
+                    and stream_image.size[0] * stream_image.size[1] >= app.config['STREAM_MIN_PIXELS'])
+        
+        # Repeated requests are answered from the result cache (strip-encoded
+        # covers are never stored, so they are not hashed either)
+        digest = key = None
+        if not streamed:
+            digest = upload_digest(stream)
+            key = cache_key('encode', digest, message, channel, bits_per_channel, compression, output,
+                            latency_budget or app.config['OUTPUT_LATENCY_BUDGET'])
+            cached = cached_result(key)
+            if cached is not None:
+                encoded, metadata = cached
+                response = send_file(
+                    io.BytesIO(encoded),
+                    mimetype=OUTPUT_MIMETYPES[metadata['output_format']],
+                    as_attachment=True,
+                    download_name=f"encoded_{name_without_ext}_{channel}.{metadata['output_format'].lower()}"
+                )
+                response.headers['X-Stego-Output-Profile'] = metadata['output_profile']
+                response.headers['X-Stego-Encode-Seconds'] = f"{metadata['output_encode_seconds']:.4f}"
+                if metadata['frames'] > 1:
+                    response.headers['X-Stego-Frames'] = str(metadata['frames'])
+                return response
+        
+        owned_stream = None
+        if streamed:
+            profile = output_profile(output or 'balanced', stream_image.size[0], stream_image.size[1], latency_budget, 'PNG')
+            if OUTPUT_PROFILES[profile]['format'] != 'PNG':
+                return jsonify({'error': f'Output {profile} is not available for images of '
+                                         f"{app.config['STREAM_MIN_PIXELS']} pixels or more; use a PNG profile"}), 400
+            
+            # Rows are read while the response is sent, after the request ends
+            owned_stream = detach_upload(stream)
+            stream_image.stream = owned_stream
+            size = stream_image.size
+            success, result = RGBChannelSteganography.encode_stream(
+                stream_image, message, channel, bits_per_channel, compression
+            )
+        else:
+            # Load image; animations and multi-page TIFFs are read frame by
+            # frame, uncompressed BMP/PPM/TIFF are edited in place
+            try:
+                stream.seek(0)
+                image = Image.open(stream)
+                frames = FrameSequence.open(image) if RGBChannelSteganography.ENGINE != 'legacy' else None
+                raw_image = raw_pixel_target(image, file.stream, output) if frames is None else None
+            except Exception as e:
+                return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
+            
+            # Work estimated to outlast the request timeout runs as a job (202)
+            if raw_image is None:
+                if frames is not None:
+                    profile = frames_output_profile(frames, output, latency_budget)
+                else:
+                    profile = output_profile(output or 'balanced', image.size[0], image.size[1], latency_budget,
+                                             image.format)
+                estimate = promote_seconds(image, frames, profile)
+                if estimate is not None:
+                    job = submit_job('encode', encode_job_params(file, message, channel, bits_per_channel,
+                                                                 compression, output, latency_budget), file.stream)
+                    return job_accepted(job, estimate)
             
-            # Convert to string
-            decoded_message = RGBChannelSteganography.binary_to_string(binary_message)
-            return True, decoded_message
+            if frames is not None:
+                profile = frames_output_profile(frames, output, latency_budget)
+                if profile is None:
+                    return jsonify({'error': f'Output {output} cannot hold {len(frames)} frames; '
+                                             f'use a PNG profile (animations) or tiff'}), 400
+                payload_report = {}
+                success, result = RGBChannelSteganography.encode_frames(
+                    frames, message, channel, bits_per_channel, compression, payload_report
+                )
+                if not success:
+                    return jsonify({'error': result}), 400
+                
+                # Frames are embedded and encoded one at a time into the output file
+                settings = OUTPUT_PROFILES[profile]
+                try:
+                    img_buffer, encode_seconds = encode_output_frames(frames, result, profile)
+                except Exception as e:
+                    return jsonify({'error': f'Could not write {profile} output: {str(e)}'}), 400
+                store_result(key, (img_buffer.getvalue(), encode_metadata(
+                    channel, bits_per_channel, message, payload_report, settings['format'], profile, encode_seconds,
+                    len(frames)
+                )), img_buffer.getbuffer().nbytes)
+                response = send_file(
+                    img_buffer,
+                    mimetype=OUTPUT_MIMETYPES[settings['format']],
+                    as_attachment=True,
+                    download_name=f"encoded_{name_without_ext}_{channel}.{settings['format'].lower()}"
+                )
+                response.headers.update({
+                    'X-Stego-Output-Profile': profile,
+                    'X-Stego-Encode-Seconds': f'{encode_seconds:.4f}',
+                    'X-Stego-Frames': str(len(frames)),
+                })
+                return response
+            
+            if raw_image is not None:
+                success, result = RGBChannelSteganography.encode_in_place(
+                    raw_image, message, channel, bits_per_channel, compression
+                )
+                if not success:
+                    return jsonify({'error': result}), 400
+                return raw_image_response(raw_image, {'X-Stego-Output-Profile': 'same'},
+                                          f"encoded_{name_without_ext}_{channel}.{raw_image.format.lower()}")
             
+            # Encode message
+            image = shared_cover(digest, image)
+            source_format = image.format
+            payload_report = {}
+            success, result = RGBChannelSteganography.encode_message(
+                image, message, channel, bits_per_channel, in_place=True, compression=compression,
+                report=payload_report
+            )
+            if success:
+                size = result.size
+                profile = output_profile(output or 'balanced', size[0], size[1], latency_budget, source_format)
+        
+        if not success:
+            if owned_stream is not None:
+                owned_stream.close()
+            return jsonify({'error': result}), 400
+        
+        settings = OUTPUT_PROFILES[profile]
+        download_filename = f"encoded_{name_without_ext}_{channel}.{settings['format'].lower()}"
+        
+        mode = stream_image.mode if owned_stream is not None else result.mode
+        transparency = (stream_image if owned_stream is not None else result).info.get('transparency')
+        
+        if settings['format'] != 'PNG' or mode not in PNGStreamWriter.COLOR_TYPES:
+            # Other formats and modes are written whole, so the length is known up front
+            try:
+                img_buffer, encode_seconds = encode_output(result, profile)
+            except Exception as e:
+                return jsonify({'error': f'Could not write {profile} output: {str(e)}'}), 400
+            store_result(key, (img_buffer.getvalue(), encode_metadata(
+                channel, bits_per_channel, message, payload_report, settings['format'], profile, encode_seconds
+            )), img_buffer.getbuffer().nbytes)
+            response = send_file(
+                img_buffer,
+                mimetype=OUTPUT_MIMETYPES[settings['format']],
+                as_attachment=True,
+                download_name=download_filename
+            )
+            response.headers['X-Stego-Output-Profile'] = profile
+            response.headers['X-Stego-Encode-Seconds'] = f'{encode_seconds:.4f}'
+            return response
+        
+        strips = result if owned_stream is not None else PNGStreamWriter.image_strips(result)
+        
+        # Decoded images are small enough to keep a copy of the PNG for the cache
+        cacheable = owned_stream is None
+        
+        def generate():
+            start = time.perf_counter()
+            chunks = [] if cacheable else None
+            total = 0
+            try:
+                for chunk in PNGStreamWriter.iter_png(
+                    size[0], size[1], strips, settings['compress_level'], settings['filter'], mode=mode,
+                    transparency=transparency
+                ):
+                    if chunks is not None:
+                        chunks.append(chunk)
+                        total += len(chunk)
+                        if not result_fits(total):
+                            chunks = None
+                    yield chunk
+                if chunks is not None:
+                    encoded = b''.join(chunks)
+                    store_result(key, (encoded, encode_metadata(
+                        channel, bits_per_channel, message, payload_report, 'PNG', profile,
+                        time.perf_counter() - start
+                    )), len(encoded))
+            finally:
+                if owned_stream is not None:
+                    owned_stream.close()
+        
+        # Stream the PNG as it is compressed (chunked, no Content-Length)
+        response = app.response_class(generate(), mimetype='image/png')
+        response.headers.set('Content-Disposition', 'attachment', filename=download_filename)
+        response.headers['X-Stego-Output-Profile'] = profile
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+def raw_image_response(raw_image, headers, download_name=None):
+    """
+    Response streaming the file of an in-place encoded RawPixelImage
+    
+    The length is known, so Content-Length is set; a mapped upload is
+    detached from the request and closed once the body is sent.
+    """
+    if isinstance(raw_image.buffer, mmap.mmap):
+        detach_upload(raw_image.buffer)
+    
+    def generate():
+        try:
+            yield from raw_image.iter_bytes()
+        finally:
+            raw_image.close()
+    
+    response = app.response_class(generate(), mimetype=OUTPUT_MIMETYPES[raw_image.format])
+    response.headers['Content-Length'] = str(raw_image.length)
+    if download_name is not None:
+        response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    response.headers.update(headers)
+    return response
+
+@app.route('/decode', methods=['POST'])
+def decode():
+    """Decode message from image"""
+    try:
+        # Validate request
+        if 'image' not in request.files:
+            return jsonify({'error': 'No image file provided'}), 400
+        
+        file = request.files['image']
+        channel = request.form.get('channel', 'R').upper()
+        
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        
+        if not allowed_file(file.filename):
+            return jsonify({'error': 'File type not supported'}), 400
+        
+        if channel not in ['R', 'G', 'B', 'A', 'ALL', 'AUTO']:
+            return jsonify({'error': 'Channel must be R, G, B, A, ALL, or AUTO'}), 400
+        
+        bits_per_channel = request.form.get('bits_per_channel')
+        if bits_per_channel is not None:
+            bits_per_channel = parse_bits_per_channel(bits_per_channel)
+            if bits_per_channel is None:
+                return jsonify({'error': 'bits_per_channel must be 1, 2, 3 or 4'}), 400
+        
+        max_length = request.form.get('max_length')
+        if max_length is not None:
+            try:
+                max_length = int(max_length)
+            except ValueError:
+                return jsonify({'error': 'max_length must be a positive integer'}), 400
+            if max_length <= 0:
+                return jsonify({'error': 'max_length must be a positive integer'}), 400
+        
+        # Repeated requests are answered from the result cache
+        stream = upload_stream(file)
+        key = cache_key('decode', upload_digest(stream), channel, bits_per_channel, max_length)
+        cached = cached_result(key)
+        if cached is not None:
+            result, metadata = cached
+            return jsonify({
+                'success': True,
+                'message': result,
+                'metadata': dict(metadata, original_filename=file.filename)
+            })
+        
+        # Load image (PNGs are streamed so only the rows holding the payload are
+        # inflated; uncompressed BMP/PPM/TIFF rows are read from the file directly;
+        # animations and multi-page TIFFs are read frame by frame)
+        try:
+            image = frames = None
+            if RGBChannelSteganography.ENGINE != 'legacy':
+                image = PNGStreamImage.open(stream)
+            if image is None:
+                image = Image.open(stream)
+                if RGBChannelSteganography.ENGINE != 'legacy':
+                    frames = FrameSequence.open(image)
+                if frames is None:
+                    image = raw_pixel_source(image, stream)
         except Exception as e:
-            return False, str(e)
+            return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
+        
+        # Images decoded whole whose estimated decode outlasts the request
+        # timeout run as a job (202); streamed PNG and raw rows are read as needed
+        if isinstance(image, Image.Image):
+            estimate = promote_seconds(image, frames)
+            if estimate is not None:
+                job = submit_job('decode', decode_job_params(file, channel, bits_per_channel, max_length), file.stream)
+                return job_accepted(job, estimate)
+        
+        # Detect the channel from the first rows (of the first frame) when asked to
+        channel_detected = channel == 'AUTO'
+        if channel_detected:
+            image = next(iter(frames)) if frames is not None else RGBChannelSteganography.native_image(image)
+            channel = RGBChannelSteganography.detect_channel(image)
+            if channel is None:
+                return jsonify({'error': 'No hidden message found in any channel'}), 400
+        
+        # Decode message
+        if frames is not None:
+            success, result = RGBChannelSteganography.decode_frames(frames, channel, max_length, bits_per_channel)
+        else:
+            success, result = RGBChannelSteganography.decode_message(image, channel, max_length, bits_per_channel)
+        
+        if not success:
+            return jsonify({'error': result}), 400
+        
+        if not result.strip():
+            return jsonify({'error': 'No hidden message found or wrong channel'}), 400
+        
+        metadata = decode_metadata(channel, channel_detected, result, len(frames) if frames is not None else 1)
+        store_result(key, (result, metadata), len(result.encode('utf-8')))
+        return jsonify({
+            'success': True,
+            'message': result,
+            'metadata': dict(metadata, original_filename=file.filename)
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
 
-# API Routes
+@app.route('/encode/raw', methods=['POST'])
+def encode_raw():
+    """Encode message into a raw image body - returns the PNG bytes"""
+    try:
+        # Validate request
+        if request.mimetype.startswith('multipart/'):
+            return jsonify({'error': 'Send the image as the request body; use /encode for multipart forms'}), 400
+        
+        message = raw_param('message')
+        message_bytes = raw_param('message_bytes')
+        channel = raw_param('channel', 'R').upper()
+        bits_per_channel = parse_bits_per_channel(raw_param('bits_per_channel', 1))
+        compression = raw_param('compression', 'auto').lower()
+        output = raw_param('output', '').lower() or None
+        latency_budget = raw_param('latency_budget')
+        
+        if message is None and message_bytes is None:
+            return jsonify({'error': 'No message provided'}), 400
+        
+        if message_bytes is not None:
+            try:
+                message_bytes = int(message_bytes)
+            except ValueError:
+                return jsonify({'error': 'message_bytes must be a positive integer'}), 400
+        
+        if channel not in ['R', 'G', 'B', 'A', 'ALL']:
+            return jsonify({'error': 'Channel must be R, G, B, A, or ALL'}), 400
+        
+        if bits_per_channel is None:
+            return jsonify({'error': 'bits_per_channel must be 1, 2, 3 or 4'}), 400
+        
+        if compression not in ['auto'] + RGBChannelSteganography.CODECS:
+            return jsonify({'error': 'Compression must be auto, none, zlib, bz2, or lzma'}), 400
+        
+        if output is not None and output not in ['auto', 'same'] + list(OUTPUT_PROFILES):
+            return jsonify({'error': 'Output must be auto, same, fastest, balanced, smallest, webp, bmp, or tiff'}), 400
+        
+        if latency_budget is not None:
+            latency_budget = parse_latency_budget(latency_budget)
+            if latency_budget is None:
+                return jsonify({'error': 'latency_budget must be a positive number of seconds'}), 400
+        
+        # Read the body (chunked bodies have no Content-Length, so it is
+        # measured once spooled); a trailing message is ignored by the decoders
+        stream = raw_upload_stream()
+        body_length = stream_length(stream)
+        if not body_length:
+            return jsonify({'error': 'No image provided'}), 400
+        if message_bytes is not None:
+            if not 0 < message_bytes < body_length:
+                return jsonify({'error': 'message_bytes must be a positive integer smaller than the body'}), 400
+            try:
+                stream.seek(-message_bytes, os.SEEK_END)
+                message = stream.read(message_bytes).decode('utf-8')
+                stream.seek(0)
+            except UnicodeDecodeError:
+                return jsonify({'error': 'Message must be UTF-8'}), 400
+        
+        # Repeated requests are answered from the result cache
+        digest = upload_digest(stream, body_length - (message_bytes or 0))
+        key = cache_key('encode', digest, message, channel, bits_per_channel, compression, output,
+                        latency_budget or app.config['OUTPUT_LATENCY_BUDGET'])
+        cached = cached_result(key)
+        if cached is not None:
+            encoded, metadata = cached
+            response = send_file(io.BytesIO(encoded), mimetype=OUTPUT_MIMETYPES[metadata['output_format']])
+            response.headers.update(encode_headers(metadata))
+            return response
+        
+        # Load image
+        try:
+            image = Image.open(stream)
+        except Exception as e:
+            return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
+        
+        if image.format not in ALLOWED_FORMATS:
+            return jsonify({'error': 'File type not supported'}), 400
+        
+        if not message.strip():
+            return jsonify({'error': 'Message cannot be empty'}), 400
+        
+        # Animations and multi-page TIFFs are read frame by frame; uncompressed
+        # BMP/PPM/TIFF are edited in place (without the trailing message)
+        try:
+            frames = FrameSequence.open(image) if RGBChannelSteganography.ENGINE != 'legacy' else None
+            raw_image = None
+            if frames is None:
+                raw_image = raw_pixel_target(
+                    image, raw_upload_file(stream), output, body_length - (message_bytes or 0)
+                )
+        except Exception as e:
+            return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
+        
+        if frames is not None:
+            profile = frames_output_profile(frames, output, latency_budget)
+            if profile is None:
+                return jsonify({'error': f'Output {output} cannot hold {len(frames)} frames; '
+                                         f'use a PNG profile (animations) or tiff'}), 400
+        
+        # Encode message
+        payload_report = {}
+        if frames is not None:
+            success, result = RGBChannelSteganography.encode_frames(
+                frames, message, channel, bits_per_channel, compression, payload_report
+            )
+        elif raw_image is not None:
+            success, result = RGBChannelSteganography.encode_in_place(
+                raw_image, message, channel, bits_per_channel, compression, payload_report
+            )
+        else:
+            image = shared_cover(digest, image)
+            source_format = image.format
+            success, result = RGBChannelSteganography.encode_message(
+                image, message, channel, bits_per_channel, in_place=True,
+                compression=compression, report=payload_report
+            )
+        
+        if not success:
+            return jsonify({'error': result}), 400
+        
+        # Images edited in place are streamed from the spooled body, not cached
+        if raw_image is not None:
+            metadata = encode_metadata(
+                channel, bits_per_channel, message, payload_report, image.format, 'same', 0
+            )
+            return raw_image_response(raw_image, encode_headers(metadata))
+        
+        try:
+            if frames is not None:
+                img_buffer, encode_seconds = encode_output_frames(frames, result, profile)
+            else:
+                profile = output_profile(output or 'balanced', result.size[0], result.size[1], latency_budget, source_format)
+                img_buffer, encode_seconds = encode_output(result, profile)
+        except Exception as e:
+            return jsonify({'error': f'Could not write {profile} output: {str(e)}'}), 400
+        
+        metadata = encode_metadata(
+            channel, bits_per_channel, message, payload_report, OUTPUT_PROFILES[profile]['format'], profile,
+            encode_seconds, len(frames) if frames is not None else 1
+        )
+        store_result(key, (img_buffer.getvalue(), metadata), img_buffer.getbuffer().nbytes)
+        response = send_file(img_buffer, mimetype=OUTPUT_MIMETYPES[metadata['output_format']])
+        response.headers.update(encode_headers(metadata))
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/decode/raw', methods=['POST'])
+def decode_raw():
+    """Decode message from a raw image body - returns the message as text"""
+    try:
+        # Validate request
+        if request.mimetype.startswith('multipart/'):
+            return jsonify({'error': 'Send the image as the request body; use /decode for multipart forms'}), 400
+        
+        channel = raw_param('channel', 'R').upper()
+        
+        if channel not in ['R', 'G', 'B', 'A', 'ALL', 'AUTO']:
+            return jsonify({'error': 'Channel must be R, G, B, A, ALL, or AUTO'}), 400
+        
+        bits_per_channel = raw_param('bits_per_channel')
+        if bits_per_channel is not None:
+            bits_per_channel = parse_bits_per_channel(bits_per_channel)
+            if bits_per_channel is None:
+                return jsonify({'error': 'bits_per_channel must be 1, 2, 3 or 4'}), 400
+        
+        max_length = raw_param('max_length')
+        if max_length is not None:
+            try:
+                max_length = int(max_length)
+            except ValueError:
+                return jsonify({'error': 'max_length must be a positive integer'}), 400
+            if max_length <= 0:
+                return jsonify({'error': 'max_length must be a positive integer'}), 400
+        
+        # Read the body (chunked bodies have no Content-Length to check)
+        stream = raw_upload_stream()
+        if not stream_length(stream):
+            return jsonify({'error': 'No image provided'}), 400
+        
+        # Repeated requests are answered from the result cache
+        key = cache_key('decode', upload_digest(stream), channel, bits_per_channel, max_length)
+        cached = cached_result(key)
+        if cached is not None:
+            result, metadata = cached
+            response = app.response_class(result, mimetype='text/plain')
+            response.headers.update(decode_headers(metadata))
+            return response
+        
+        # Load image (PNGs are streamed so only the rows holding the payload are
+        # inflated; uncompressed BMP/PPM/TIFF rows are read from the file directly)
+        try:
+            image = frames = None
+            if RGBChannelSteganography.ENGINE != 'legacy':
+                image = PNGStreamImage.open(stream)
+            if image is None:
+                image = Image.open(stream)
+                if image.format not in ALLOWED_FORMATS:
+                    return jsonify({'error': 'File type not supported'}), 400
+                if RGBChannelSteganography.ENGINE != 'legacy':
+                    frames = FrameSequence.open(image)
+                if frames is None:
+                    image = raw_pixel_source(image, stream)
+        except Exception as e:
+            return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
+        
+        # Detect the channel from the first rows (of the first frame) when asked to
+        channel_detected = channel == 'AUTO'
+        if channel_detected:
+            image = next(iter(frames)) if frames is not None else RGBChannelSteganography.native_image(image)
+            channel = RGBChannelSteganography.detect_channel(image)
+            if channel is None:
+                return jsonify({'error': 'No hidden message found in any channel'}), 400
+        
+        # Decode message
+        if frames is not None:
+            success, result = RGBChannelSteganography.decode_frames(frames, channel, max_length, bits_per_channel)
+        else:
+            success, result = RGBChannelSteganography.decode_message(image, channel, max_length, bits_per_channel)
+        
+        if not success:
+            return jsonify({'error': result}), 400
+        
+        if not result.strip():
+            return jsonify({'error': 'No hidden message found or wrong channel'}), 400
+        
+        metadata = decode_metadata(channel, channel_detected, result, len(frames) if frames is not None else 1)
+        store_result(key, (result, metadata), len(result.encode('utf-8')))
+        response = app.response_class(result, mimetype='text/plain')
+        response.headers.update(decode_headers(metadata))
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+# Batch encoding
+
+BATCH_DEFAULTS = {'channel': 'R', 'bits_per_channel': 1, 'compression': 'auto', 'output': ''}
+
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+
+def batch_pool():
+    """
+    Process pool running /encode/batch items, created on first use
+    
+    Workers are spawned rather than forked, since the parent holds thread
+    pools, and embed with a single thread each so processes don't
+    oversubscribe the cores.
+    """
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            _batch_pool = ProcessPoolExecutor(
+                max_workers=app.config['BATCH_PROCESSES'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_batch_worker
+            )
+        return _batch_pool
+
+def reset_batch_pool(pool):
+    """Drop a broken pool (a worker died) so the next batch starts a new one"""
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is pool:
+            _batch_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def batch_form_values(fields, count):
+    """
+    Per-image values of batch form fields
+    
+    Each field takes one value for every image or one value per image, in
+    upload order; missing fields get their BATCH_DEFAULTS value (None if
+    there is none).
+    
+    Returns:
+        (success, result): {field: [value per image]} or error message
+    """
+    values = {}
+    for field in fields:
+        given = request.form.getlist(field) or [BATCH_DEFAULTS.get(field)]
+        if len(given) not in (1, count):
+            return False, f'Send one {field} for all images or one per image ({count})'
+        values[field] = given * count if len(given) == 1 else given
+    return True, values
+
+def init_batch_worker():
+    """Batch worker setup: items run in parallel, so each embeds single-threaded"""
+    RGBChannelSteganography.THREADS = 1
+
+def encode_upload(data, message, channel, bits_per_channel, compression, output, latency_budget, progress=None):
+    """
+    Encode an uploaded image held in memory, for batch worker processes and jobs
+    
+    Follows /encode: animations and multi-page TIFFs are encoded frame by
+    frame and uncompressed BMP/PPM/TIFF edited in place.
+    
+    Args:
+        data: Bytes of the uploaded image
+        progress: Optional callback(fraction, stage) reporting how far encoding got
+        Others as for /encode, already validated
+    
+    Returns:
+        (success, result): result is (encoded file bytes, metadata) or an error message
+    """
+    progress = progress or (lambda fraction, stage: None)
+    try:
+        image = Image.open(io.BytesIO(data))
+        frames = FrameSequence.open(image) if RGBChannelSteganography.ENGINE != 'legacy' else None
+        raw_image = None
+        if frames is None and output in (None, 'same') and RGBChannelSteganography.ENGINE != 'legacy':
+            layout = RawPixelImage.layout(image)
+            if layout is not None:
+                raw_image = RawPixelImage(bytearray(data), image.format, image.size, layout, mode=image.mode)
+    except Exception as e:
+        return False, f'Invalid image file: {str(e)}'
+    
+    try:
+        if frames is not None:
+            profile = frames_output_profile(frames, output, latency_budget)
+            if profile is None:
+                return False, f'Output {output} cannot hold {len(frames)} frames; use a PNG profile (animations) or tiff'
+        
+        progress(0.1, 'embedding')
+        payload_report = {}
+        if frames is not None:
+            success, result = RGBChannelSteganography.encode_frames(
+                frames, message, channel, bits_per_channel, compression, payload_report
+            )
+        elif raw_image is not None:
+            success, result = RGBChannelSteganography.encode_in_place(
+                raw_image, message, channel, bits_per_channel, compression, payload_report
+            )
+        else:
+            source_format = image.format
+            success, result = RGBChannelSteganography.encode_message(
+                image, message, channel, bits_per_channel, in_place=True,
+                compression=compression, report=payload_report
+            )
+        if not success:
+            return False, result
+        
+        try:
+            if frames is not None:
+                # Frames are embedded as the output consumes them
+                def tracked(images):
+                    for index, image in enumerate(images):
+                        yield image
+                        progress(0.1 + 0.9 * (index + 1) / len(frames), 'encoding frames')
+                
+                img_buffer, encode_seconds = encode_output_frames(frames, tracked(result), profile)
+                encoded = img_buffer.getvalue()
+            elif raw_image is not None:
+                profile, encode_seconds = 'same', 0.0
+                encoded = bytes(memoryview(raw_image.buffer)[:raw_image.length])
+            else:
+                profile = output_profile(output or 'balanced', result.size[0], result.size[1], latency_budget,
+                                         source_format)
+                progress(0.5, 'writing output')
+                img_buffer, encode_seconds = encode_output(result, profile)
+                encoded = img_buffer.getvalue()
+        except Exception as e:
+            return False, f'Could not write {profile} output: {str(e)}'
+        
+        output_format = raw_image.format if raw_image is not None else OUTPUT_PROFILES[profile]['format']
+        return True, (encoded, encode_metadata(
+            channel, bits_per_channel, message, payload_report, output_format, profile, encode_seconds,
+            len(frames) if frames is not None else 1
+        ))
+    except Exception as e:
+        return False, f'Server error: {str(e)}'
+
+def decode_upload(data, channel, bits_per_channel, max_length, progress=None):
+    """
+    Decode an uploaded image held in memory, for batch worker processes and jobs
+    
+    Follows /decode: PNGs are streamed, animations and multi-page TIFFs read
+    frame by frame and uncompressed BMP/PPM/TIFF rows read from the bytes.
+    
+    Args:
+        data: Bytes of the uploaded image
+        progress: Optional callback(fraction, stage) reporting how far decoding got
+        Others as for /decode, already validated
+    
+    Returns:
+        (success, result): result is (message, metadata) or an error message
+    """
+    progress = progress or (lambda fraction, stage: None)
+    start = time.perf_counter()
+    try:
+        stream = io.BytesIO(data)
+        image = frames = None
+        if RGBChannelSteganography.ENGINE != 'legacy':
+            image = PNGStreamImage.open(stream)
+        if image is None:
+            image = Image.open(stream)
+            if RGBChannelSteganography.ENGINE != 'legacy':
+                frames = FrameSequence.open(image)
+                layout = RawPixelImage.layout(image) if frames is None else None
+                if layout is not None:
+                    image = RawPixelImage(data, image.format, image.size, layout, mode=image.mode)
+    except Exception as e:
+        return False, f'Invalid image file: {str(e)}'
+    
+    try:
+        progress(0.1, 'decoding')
+        channel_detected = channel == 'AUTO'
+        if channel_detected:
+            image = next(iter(frames)) if frames is not None else RGBChannelSteganography.native_image(image)
+            channel = RGBChannelSteganography.detect_channel(image)
+            if channel is None:
+                return False, 'No hidden message found in any channel'
+        
+        if frames is not None:
+            success, result = RGBChannelSteganography.decode_frames(frames, channel, max_length, bits_per_channel)
+        else:
+            success, result = RGBChannelSteganography.decode_message(image, channel, max_length, bits_per_channel)
+        if not success:
+            return False, result
+        if not result.strip():
+            return False, 'No hidden message found or wrong channel'
+        
+        metadata = decode_metadata(channel, channel_detected, result, len(frames) if frames is not None else 1)
+        return True, (result, dict(metadata, decode_seconds=round(time.perf_counter() - start, 4)))
+    except Exception as e:
+        return False, f'Server error: {str(e)}'
 
-@app.route('/', methods=['GET'])
-def home():
-    """API information endpoint"""
-    return jsonify({
-        'service': 'Steganography API',
-        'version': '1.1.0',
-        'status': 'running',
-        'description': 'RGB Channel Steganography API',
-        'endpoints': {
-            'GET /': 'API information',
-            'GET /health': 'Health check',
-            'POST /encode': 'Encode message into image (returns JSON with base64)',
-            'POST /encode-download': 'Encode message into image (returns file for download)',
-            'POST /decode': 'Decode message from image',
-            'POST /info': 'Get image capacity information'
-        },
-        'usage': {
-            'encode': 'Send multipart form with "image" file and "message" text, optional "channel" (R/G/B/ALL)',
-            'encode-download': 'Same as encode but returns file directly for download',
-            'decode': 'Send multipart form with "image" file and optional "channel" (R/G/B/ALL)',
-            'info': 'Send multipart form with "image" file'
-        }
-    })
+def iter_batch_results(pool, futures):
+    """
+    Yield (index, success, result) for batch futures as they complete
+    
+    futures maps each future to its item index; a worker crash fails the
+    remaining items and retires the pool. Items not started yet are
+    cancelled if the client goes away.
+    """
+    try:
+        for future in as_completed(futures):
+            try:
+                success, result = future.result()
+            except BrokenProcessPool:
+                reset_batch_pool(pool)
+                success, result = False, 'Batch worker process died'
+            except Exception as e:
+                success, result = False, f'Server error: {str(e)}'
+            yield futures[future], success, result
+    finally:
+        for future in futures:
+            future.cancel()
 
-@app.route('/health', methods=['GET'])
-def health():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'service': 'steganography-api'
-    })
+class ChunkSink:
+    """Write-only file collecting the bytes ZipFile writes, so an archive can be streamed"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def take(self):
+        """Bytes written since the last call"""
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
 
-@app.route('/encode', methods=['POST'])
-def encode():
-    """Encode message into image - returns JSON with base64"""
+@app.route('/encode/batch', methods=['POST'])
+def encode_batch():
+    """Encode messages into many images - streams a ZIP or NDJSON as items finish"""
     try:
         # Validate request
-        if 'image' not in request.files:
+        files = request.files.getlist('image')
+        if not files:
             return jsonify({'error': 'No image file provided'}), 400
         
         if 'message' not in request.form:
             return jsonify({'error': 'No message provided'}), 400
         
-        file = request.files['image']
-        message = request.form['message']
-        channel = request.form.get('channel', 'R').upper()
+        if len(files) > app.config['BATCH_MAX_ITEMS']:
+            return jsonify({'error': f"A batch holds at most {app.config['BATCH_MAX_ITEMS']} images"}), 400
         
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
+        response_format = request.form.get('format', 'zip').lower()
+        latency_budget = request.form.get('latency_budget')
         
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'File type not supported'}), 400
+        if response_format not in ['zip', 'ndjson']:
+            return jsonify({'error': 'Format must be zip or ndjson'}), 400
         
-        if channel not in ['R', 'G', 'B', 'ALL']:
-            return jsonify({'error': 'Channel must be R, G, B, or ALL'}), 400
+        if latency_budget is not None:
+            latency_budget = parse_latency_budget(latency_budget)
+            if latency_budget is None:
+                return jsonify({'error': 'latency_budget must be a positive number of seconds'}), 400
+        # Resolved here: workers don't see this app's configuration
+        if latency_budget is None:
+            latency_budget = app.config['OUTPUT_LATENCY_BUDGET']
         
-        if not message.strip():
-            return jsonify({'error': 'Message cannot be empty'}), 400
+        success, values = batch_form_values(['message', 'channel', 'bits_per_channel', 'compression', 'output'],
+                                            len(files))
+        if not success:
+            return jsonify({'error': values}), 400
         
-        # Load image
-        try:
-            image = Image.open(file.stream)
-        except Exception as e:
-            return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
+        items = []
+        for index, file in enumerate(files):
+            message = values['message'][index]
+            channel = values['channel'][index].upper()
+            bits_per_channel = parse_bits_per_channel(values['bits_per_channel'][index])
+            compression = values['compression'][index].lower()
+            output = values['output'][index].lower() or None
+            
+            if file.filename == '':
+                return jsonify({'error': f'Image {index}: No file selected'}), 400
+            
+            if not allowed_file(file.filename):
+                return jsonify({'error': f'Image {index}: File type not supported'}), 400
+            
+            if channel not in ['R', 'G', 'B', 'A', 'ALL']:
+                return jsonify({'error': f'Image {index}: Channel must be R, G, B, A, or ALL'}), 400
+            
+            if bits_per_channel is None:
+                return jsonify({'error': f'Image {index}: bits_per_channel must be 1, 2, 3 or 4'}), 400
+            
+            if compression not in ['auto'] + RGBChannelSteganography.CODECS:
+                return jsonify({'error': f'Image {index}: Compression must be auto, none, zlib, bz2, or lzma'}), 400
+            
+            if output is not None and output not in ['auto', 'same'] + list(OUTPUT_PROFILES):
+                return jsonify({'error': f'Image {index}: Output must be auto, same, fastest, balanced, smallest, '
+                                         f'webp, bmp, or tiff'}), 400
+            
+            if not message.strip():
+                return jsonify({'error': f'Image {index}: Message cannot be empty'}), 400
+            
+            items.append((file, message, channel, bits_per_channel, compression, output))
         
-        # Encode message
-        success, result = RGBChannelSteganography.encode_message(image, message, channel)
+        # Uploads are read now: they are closed at request end, while the
+        # results are still being streamed
+        pool = batch_pool()
+        futures = {}
+        names = []
+        for index, (file, message, channel, bits_per_channel, compression, output) in enumerate(items):
+            future = pool.submit(encode_upload, file.read(), message, channel, bits_per_channel,
+                                 compression, output, latency_budget)
+            futures[future] = index
+            names.append((file.filename, f"{index}_encoded_{os.path.splitext(secure_filename(file.filename))[0]}_{channel}"))
+        
+        def entry(index, success, result):
+            filename = names[index][0]
+            if not success:
+                return {'index': index, 'original_filename': filename, 'success': False, 'error': result}
+            return {'index': index, 'original_filename': filename, 'success': True, 'metadata': result[1]}
+        
+        if response_format == 'ndjson':
+            def generate():
+                for index, success, result in iter_batch_results(pool, futures):
+                    line = entry(index, success, result)
+                    if success:
+                        line['image_base64'] = base64.b64encode(result[0]).decode('ascii')
+                    yield json.dumps(line) + '\n'
+            
+            response = app.response_class(generate(), mimetype='application/x-ndjson')
+        else:
+            def generate():
+                # Images are already compressed, so entries are stored; results.json
+                # (per-item metadata and errors) is written last
+                sink = ChunkSink()
+                results = []
+                with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+                    for index, success, result in iter_batch_results(pool, futures):
+                        line = entry(index, success, result)
+                        if success:
+                            line['file'] = f"{names[index][1]}.{result[1]['output_format'].lower()}"
+                            archive.writestr(line['file'], result[0])
+                            yield sink.take()
+                        results.append(line)
+                    results.sort(key=lambda line: line['index'])
+                    archive.writestr('results.json', json.dumps(results, indent=2))
+                yield sink.take()
+            
+            response = app.response_class(generate(), mimetype='application/zip')
+            response.headers.set('Content-Disposition', 'attachment', filename='encoded_batch.zip')
+        
+        response.headers['X-Stego-Batch-Items'] = str(len(items))
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/decode/batch', methods=['POST'])
+def decode_batch():
+    """Decode messages from many images - streams an NDJSON line per image as it finishes"""
+    try:
+        # Validate request
+        files = request.files.getlist('image')
+        if not files:
+            return jsonify({'error': 'No image file provided'}), 400
         
+        if len(files) > app.config['BATCH_MAX_ITEMS']:
+            return jsonify({'error': f"A batch holds at most {app.config['BATCH_MAX_ITEMS']} images"}), 400
+        
+        success, values = batch_form_values(['channel', 'bits_per_channel', 'max_length'], len(files))
         if not success:
-            return jsonify({'error': result}), 400
+            return jsonify({'error': values}), 400
         
-        # Convert result image to base64
-        img_buffer = io.BytesIO()
-        result.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
+        items = []
+        for index, file in enumerate(files):
+            channel = values['channel'][index].upper()
+            bits_per_channel = values['bits_per_channel'][index]
+            max_length = values['max_length'][index]
+            
+            if file.filename == '':
+                return jsonify({'error': f'Image {index}: No file selected'}), 400
+            
+            if not allowed_file(file.filename):
+                return jsonify({'error': f'Image {index}: File type not supported'}), 400
+            
+            if channel not in ['R', 'G', 'B', 'A', 'ALL', 'AUTO']:
+                return jsonify({'error': f'Image {index}: Channel must be R, G, B, A, ALL, or AUTO'}), 400
+            
+            # Only an explicit bits_per_channel overrides the one in the image header
+            if 'bits_per_channel' not in request.form:
+                bits_per_channel = None
+            else:
+                bits_per_channel = parse_bits_per_channel(bits_per_channel)
+                if bits_per_channel is None:
+                    return jsonify({'error': f'Image {index}: bits_per_channel must be 1, 2, 3 or 4'}), 400
+            
+            if max_length is not None:
+                try:
+                    max_length = int(max_length)
+                except ValueError:
+                    return jsonify({'error': f'Image {index}: max_length must be a positive integer'}), 400
+                if max_length <= 0:
+                    return jsonify({'error': f'Image {index}: max_length must be a positive integer'}), 400
+            
+            items.append((file, channel, bits_per_channel, max_length))
         
-        # Return base64 encoded image
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
+        # Uploads are read now: they are closed at request end, while the
+        # results are still being streamed
+        start = time.perf_counter()
+        pool = batch_pool()
+        futures = {}
+        for index, (file, channel, bits_per_channel, max_length) in enumerate(items):
+            future = pool.submit(decode_upload, file.read(), channel, bits_per_channel, max_length)
+            futures[future] = index
+        filenames = [file.filename for file, *_ in items]
         
-        return jsonify({
-            'success': True,
-            'message': 'Message successfully encoded',
-            'image_base64': img_base64,
-            'metadata': {
-                'original_filename': file.filename,
-                'channel_used': channel,
-                'message_length': len(message),
-                'output_format': 'PNG'
-            }
-        })
+        def generate():
+            # Lines are sent in completion order, so a slow image holds up no other
+            for index, success, result in iter_batch_results(pool, futures):
+                line = {'index': index, 'original_filename': filenames[index], 'success': success}
+                if success:
+                    line.update({'message': result[0], 'metadata': result[1]})
+                else:
+                    line['error'] = result
+                line['elapsed_seconds'] = round(time.perf_counter() - start, 4)
+                yield json.dumps(line) + '\n'
+        
+        response = app.response_class(generate(), mimetype='application/x-ndjson')
+        response.headers['X-Stego-Batch-Items'] = str(len(items))
+        return response
         
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
-@app.route('/encode-download', methods=['POST'])
-def encode_download():
-    """Encode message into image - returns file directly for download"""
+# Jobs
+
+class JobStore:
+    """
+    Storage for job state, inputs and results
+    
+    A job is a dict with id, kind ('encode' or 'decode'), status ('queued',
+    'running', 'done' or 'failed'), progress (0-1), stage, params (the
+    validated request fields), metadata (set when done), error (when
+    failed), owner (owner_token of the worker running it), created and updated
+    (epoch seconds). Subclasses implement the storage.
+    """
+    
+    def create(self, kind, params, stream):
+        """Store a new queued job with its input image (copied from stream); returns the job"""
+        raise NotImplementedError
+    
+    def get(self, job_id):
+        """Job dict, or None if it does not exist (or expired)"""
+        raise NotImplementedError
+    
+    def update(self, job_id, **fields):
+        """Set fields of a job (and its updated time)"""
+        raise NotImplementedError
+    
+    def read_input(self, job_id):
+        """Bytes of the job's input image"""
+        raise NotImplementedError
+    
+    def discard_input(self, job_id):
+        """Drop the input image once the job has finished"""
+        raise NotImplementedError
+    
+    def write_result(self, job_id, data):
+        """Store the result bytes of a job"""
+        raise NotImplementedError
+    
+    def open_result(self, job_id):
+        """Binary file object over the result of a job"""
+        raise NotImplementedError
+    
+    def purge(self, before):
+        """
+        Delete jobs last updated before the given epoch time that are finished,
+        or queued/running on a worker that has exited (lost jobs nobody polled)
+        """
+        raise NotImplementedError
+    
+    @staticmethod
+    def expired(job, before):
+        """Whether purge deletes a job"""
+        if job['updated'] >= before:
+            return False
+        return job['status'] in ('done', 'failed') or not process_alive(job['owner'])
+    
+    @staticmethod
+    def new_job(kind, params):
+        """Job dict for a newly queued job"""
+        now = time.time()
+        return {
+            'id': uuid.uuid4().hex, 'kind': kind, 'status': 'queued', 'progress': 0.0, 'stage': 'queued',
+            'params': params, 'metadata': None, 'error': None, 'owner': owner_token(), 'created': now, 'updated': now,
+        }
+
+class MemoryJobStore(JobStore):
+    """Jobs in this process's memory; only visible to (and lost with) one worker"""
+    
+    def __init__(self, directory=None):
+        self.jobs = {}
+        self.inputs = {}
+        self.results = {}
+        self.lock = threading.Lock()
+    
+    def create(self, kind, params, stream):
+        job = JobStore.new_job(kind, params)
+        data = stream.read()
+        with self.lock:
+            self.jobs[job['id']] = job
+            self.inputs[job['id']] = data
+        return dict(job)
+    
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+    
+    def update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields, updated=time.time())
+    
+    def read_input(self, job_id):
+        return self.inputs[job_id]
+    
+    def discard_input(self, job_id):
+        with self.lock:
+            self.inputs.pop(job_id, None)
+    
+    def write_result(self, job_id, data):
+        with self.lock:
+            self.results[job_id] = bytes(data)
+    
+    def open_result(self, job_id):
+        return io.BytesIO(self.results[job_id])
+    
+    def purge(self, before):
+        with self.lock:
+            for job_id in [job_id for job_id, job in self.jobs.items() if JobStore.expired(job, before)]:
+                del self.jobs[job_id]
+                self.inputs.pop(job_id, None)
+                self.results.pop(job_id, None)
+
+class SQLiteJobStore(JobStore):
+    """
+    Jobs in an SQLite database, with inputs and results as files beside it
+    
+    Every worker process on the host sees the same jobs, and finished jobs
+    survive worker restarts. A connection is opened per call, so the store
+    is safe to share between threads.
+    """
+    
+    COLUMNS = ['id', 'kind', 'status', 'progress', 'stage', 'params', 'metadata', 'error', 'owner', 'created', 'updated']
+    JSON_COLUMNS = {'params', 'metadata'}
+    
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'jobs.sqlite3')
+        with self.connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT, status TEXT, progress REAL, '
+                       'stage TEXT, params TEXT, metadata TEXT, error TEXT, owner TEXT, created REAL, updated REAL)')
+    
+    def connect(self):
+        """Connection committing on exit of a with block (closed by the caller)"""
+        return sqlite3.connect(self.path, timeout=30)
+    
+    def file(self, job_id, name):
+        """Path of the input or result file of a job"""
+        return os.path.join(self.directory, f'{job_id}.{name}')
+    
+    def create(self, kind, params, stream):
+        job = JobStore.new_job(kind, params)
+        with open(self.file(job['id'], 'input'), 'wb') as target:
+            shutil.copyfileobj(stream, target, 1 << 20)
+        row = [json.dumps(job[column]) if column in SQLiteJobStore.JSON_COLUMNS else job[column]
+               for column in SQLiteJobStore.COLUMNS]
+        db = self.connect()
+        try:
+            with db:
+                db.execute(f"INSERT INTO jobs VALUES ({', '.join('?' * len(row))})", row)
+        finally:
+            db.close()
+        return job
+    
+    def get(self, job_id):
+        db = self.connect()
+        try:
+            row = db.execute(f"SELECT {', '.join(SQLiteJobStore.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        return {column: json.loads(value) if column in SQLiteJobStore.JSON_COLUMNS else value
+                for column, value in zip(SQLiteJobStore.COLUMNS, row)}
+    
+    def update(self, job_id, **fields):
+        fields['updated'] = time.time()
+        values = [json.dumps(value) if column in SQLiteJobStore.JSON_COLUMNS else value
+                  for column, value in fields.items()]
+        db = self.connect()
+        try:
+            with db:
+                db.execute(f"UPDATE jobs SET {', '.join(f'{column} = ?' for column in fields)} WHERE id = ?",
+                           values + [job_id])
+        finally:
+            db.close()
+    
+    def read_input(self, job_id):
+        with open(self.file(job_id, 'input'), 'rb') as source:
+            return source.read()
+    
+    def discard_input(self, job_id):
+        try:
+            os.remove(self.file(job_id, 'input'))
+        except FileNotFoundError:
+            pass
+    
+    def write_result(self, job_id, data):
+        # Written aside and renamed, so other workers never serve a partial file
+        partial = self.file(job_id, 'result.partial')
+        with open(partial, 'wb') as target:
+            target.write(data)
+        os.replace(partial, self.file(job_id, 'result'))
+    
+    def open_result(self, job_id):
+        return open(self.file(job_id, 'result'), 'rb')
+    
+    def purge(self, before):
+        db = self.connect()
+        try:
+            with db:
+                expired = [job_id for job_id, status, owner, updated in db.execute(
+                    'SELECT id, status, owner, updated FROM jobs WHERE updated < ?', (before,)
+                ) if JobStore.expired({'status': status, 'owner': owner, 'updated': updated}, before)]
+                db.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in expired])
+        finally:
+            db.close()
+        for job_id in expired:
+            for name in ('input', 'result'):
+                try:
+                    os.remove(self.file(job_id, name))
+                except FileNotFoundError:
+                    pass
+
+JOB_STORES = {'memory': MemoryJobStore, 'sqlite': SQLiteJobStore}
+
+_job_store = None
+_job_executor = None
+_jobs_lock = threading.Lock()
+
+def job_store():
+    """The configured JobStore, created on first use"""
+    global _job_store
+    with _jobs_lock:
+        if _job_store is None:
+            _job_store = JOB_STORES[app.config['JOB_STORE']](app.config['JOB_DIR'])
+        return _job_store
+
+def job_executor():
+    """Thread pool running this worker's jobs, created on first use"""
+    global _job_executor
+    with _jobs_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'], thread_name_prefix='stego-job')
+        return _job_executor
+
+def submit_job(kind, params, stream):
+    """
+    Queue an encode or decode job on this worker
+    
+    stream is the upload, read from its start; params are the validated
+    request fields passed to encode_upload/decode_upload. Expired jobs are
+    purged first.
+    """
+    store = job_store()
+    store.purge(time.time() - app.config['JOB_TTL'])
+    stream.seek(0)
+    job = store.create(kind, params, stream)
+    job_executor().submit(run_job, store, job['id'])
+    return job
+
+def encode_job_params(file, message, channel, bits_per_channel, compression, output, latency_budget):
+    """Params of an encode job from validated /encode fields"""
+    name_without_ext = os.path.splitext(secure_filename(file.filename))[0]
+    return {
+        'filename': file.filename, 'download_name': f'encoded_{name_without_ext}_{channel}',
+        'message': message, 'channel': channel, 'bits_per_channel': bits_per_channel, 'compression': compression,
+        'output': output,
+        'latency_budget': app.config['OUTPUT_LATENCY_BUDGET'] if latency_budget is None else latency_budget,
+    }
+
+def decode_job_params(file, channel, bits_per_channel, max_length):
+    """Params of a decode job from validated /decode fields"""
+    return {
+        'filename': file.filename, 'channel': channel, 'bits_per_channel': bits_per_channel, 'max_length': max_length,
+    }
+
+def run_job(store, job_id):
+    """Run a queued job, recording progress, then its result or error"""
+    job = store.get(job_id)
+    params = job['params']
+    store.update(job_id, status='running', stage='loading', owner=owner_token())
+    
+    def progress(fraction, stage):
+        store.update(job_id, progress=round(fraction, 3), stage=stage)
+    
+    try:
+        data = store.read_input(job_id)
+        if job['kind'] == 'encode':
+            success, result = encode_upload(
+                data, params['message'], params['channel'], params['bits_per_channel'], params['compression'],
+                params['output'], params['latency_budget'], progress
+            )
+        else:
+            success, result = decode_upload(
+                data, params['channel'], params['bits_per_channel'], params['max_length'], progress
+            )
+        del data
+        if success:
+            output, metadata = result
+            store.write_result(job_id, output if job['kind'] == 'encode' else output.encode('utf-8'))
+            metadata['original_filename'] = params['filename']
+            store.update(job_id, status='done', progress=1.0, stage='done', metadata=metadata)
+        else:
+            store.update(job_id, status='failed', stage='failed', error=result)
+    except Exception as e:
+        store.update(job_id, status='failed', stage='failed', error=f'Server error: {str(e)}')
+    finally:
+        store.discard_input(job_id)
+
+def process_start(pid):
+    """Start time of a process in clock ticks after boot (from /proc), or None where unavailable"""
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as stat:
+            # Fields after the parenthesized command name, which may hold spaces
+            fields = stat.read().rsplit(b')', 1)[1].split()
+        return fields[19].decode()
+    except (OSError, IndexError):
+        return None
+
+def owner_token():
+    """
+    Identity of this worker process for JobStore owners
+    
+    'pid:start' with the process start time, so a later process that gets
+    the same pid (as workers do after a container or gunicorn restart) is
+    not taken for the owner; just the pid where /proc is unavailable.
+    """
+    pid = os.getpid()
+    start = process_start(pid)
+    return f'{pid}:{start}' if start is not None else str(pid)
+
+def process_alive(owner):
+    """Whether the process an owner_token (or bare pid) names is still running on this host"""
+    pid, _, start = str(owner).partition(':')
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return not start or process_start(pid) in (None, start)
+
+def promote_seconds(image, frames=None, profile=None):
+    """
+    Estimated seconds of a synchronous request if it should run as a job instead
+    
+    None when the estimate (decoding every frame, plus writing them with
+    profile) is within ASYNC_PROMOTE_SECONDS.
+    """
+    threshold = app.config['ASYNC_PROMOTE_SECONDS']
+    if not threshold:
+        return None
+    sizes = [size for size, mode in frames.frames] if frames is not None else [image.size]
+    megapixels = sum(width * height for width, height in sizes) / 1e6
+    estimate = estimate_seconds(megapixels, frames.format if frames is not None else image.format, profile)
+    return estimate if estimate > threshold else None
+
+def job_accepted(job, estimate=None):
+    """
+    202 response pointing at a newly queued job
+    
+    success is False: the work is not done yet, and clients that only check
+    success must not take the job for a finished /encode or /decode result.
+    """
+    body = {
+        'success': False,
+        'job_id': job['id'],
+        'status': job['status'],
+        'status_url': f"/jobs/{job['id']}",
+    }
+    if estimate is not None:
+        body['estimated_seconds'] = round(estimate, 1)
+    response = jsonify(body)
+    response.status_code = 202
+    response.headers['Location'] = body['status_url']
+    return response
+
+@app.route('/jobs/encode', methods=['POST'])
+def create_encode_job():
+    """Queue an encode job - same form as /encode, returns 202 with the job id"""
     try:
         # Validate request
         if 'image' not in request.files:
@@ -271,6 +4109,10 @@ def encode_download():
         file = request.files['image']
         message = request.form['message']
         channel = request.form.get('channel', 'R').upper()
+        bits_per_channel = parse_bits_per_channel(request.form.get('bits_per_channel', 1))
+        compression = request.form.get('compression', 'auto').lower()
+        output = request.form.get('output', '').lower() or None
+        latency_budget = request.form.get('latency_budget')
         
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
@@ -278,48 +4120,42 @@ def encode_download():
         if not allowed_file(file.filename):
             return jsonify({'error': 'File type not supported'}), 400
         
-        if channel not in ['R', 'G', 'B', 'ALL']:
-            return jsonify({'error': 'Channel must be R, G, B, or ALL'}), 400
+        if channel not in ['R', 'G', 'B', 'A', 'ALL']:
+            return jsonify({'error': 'Channel must be R, G, B, A, or ALL'}), 400
+        
+        if bits_per_channel is None:
+            return jsonify({'error': 'bits_per_channel must be 1, 2, 3 or 4'}), 400
+        
+        if compression not in ['auto'] + RGBChannelSteganography.CODECS:
+            return jsonify({'error': 'Compression must be auto, none, zlib, bz2, or lzma'}), 400
+        
+        if output is not None and output not in ['auto', 'same'] + list(OUTPUT_PROFILES):
+            return jsonify({'error': 'Output must be auto, same, fastest, balanced, smallest, webp, bmp, or tiff'}), 400
+        
+        if latency_budget is not None:
+            latency_budget = parse_latency_budget(latency_budget)
+            if latency_budget is None:
+                return jsonify({'error': 'latency_budget must be a positive number of seconds'}), 400
         
         if not message.strip():
             return jsonify({'error': 'Message cannot be empty'}), 400
         
-        # Load image
+        # Only the header is read here; the job decodes the image
         try:
-            image = Image.open(file.stream)
+            Image.open(upload_stream(file))
         except Exception as e:
             return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
         
-        # Encode message
-        success, result = RGBChannelSteganography.encode_message(image, message, channel)
-        
-        if not success:
-            return jsonify({'error': result}), 400
-        
-        # Create file buffer
-        img_buffer = io.BytesIO()
-        result.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
-        
-        # Generate download filename
-        original_name = secure_filename(file.filename)
-        name_without_ext = os.path.splitext(original_name)[0]
-        download_filename = f"encoded_{name_without_ext}_{channel}.png"
-        
-        # Return file for download
-        return send_file(
-            img_buffer,
-            mimetype='image/png',
-            as_attachment=True,
-            download_name=download_filename
-        )
+        job = submit_job('encode', encode_job_params(file, message, channel, bits_per_channel, compression,
+                                                     output, latency_budget), file.stream)
+        return job_accepted(job)
         
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
-@app.route('/decode', methods=['POST'])
-def decode():
-    """Decode message from image"""
+@app.route('/jobs/decode', methods=['POST'])
+def create_decode_job():
+    """Queue a decode job - same form as /decode, returns 202 with the job id"""
     try:
         # Validate request
         if 'image' not in request.files:
@@ -334,33 +4170,98 @@ def decode():
         if not allowed_file(file.filename):
             return jsonify({'error': 'File type not supported'}), 400
         
-        if channel not in ['R', 'G', 'B', 'ALL']:
-            return jsonify({'error': 'Channel must be R, G, B, or ALL'}), 400
+        if channel not in ['R', 'G', 'B', 'A', 'ALL', 'AUTO']:
+            return jsonify({'error': 'Channel must be R, G, B, A, ALL, or AUTO'}), 400
+        
+        bits_per_channel = request.form.get('bits_per_channel')
+        if bits_per_channel is not None:
+            bits_per_channel = parse_bits_per_channel(bits_per_channel)
+            if bits_per_channel is None:
+                return jsonify({'error': 'bits_per_channel must be 1, 2, 3 or 4'}), 400
+        
+        max_length = request.form.get('max_length')
+        if max_length is not None:
+            try:
+                max_length = int(max_length)
+            except ValueError:
+                return jsonify({'error': 'max_length must be a positive integer'}), 400
+            if max_length <= 0:
+                return jsonify({'error': 'max_length must be a positive integer'}), 400
         
-        # Load image
         try:
-            image = Image.open(file.stream)
+            Image.open(upload_stream(file))
         except Exception as e:
             return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
         
-        # Decode message
-        success, result = RGBChannelSteganography.decode_message(image, channel)
+        job = submit_job('decode', decode_job_params(file, channel, bits_per_channel, max_length), file.stream)
+        return job_accepted(job)
         
-        if not success:
-            return jsonify({'error': result}), 400
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a job; includes the message of finished decode jobs"""
+    try:
+        store = job_store()
+        job = store.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
         
-        if not result.strip():
-            return jsonify({'error': 'No hidden message found or wrong channel'}), 400
+        # A job whose worker exited (e.g. restarted by gunicorn) will never finish
+        if job['status'] in ('queued', 'running') and not process_alive(job['owner']):
+            store.update(job_id, status='failed', stage='failed',
+                         error='Job was lost: its worker process exited before it finished')
+            job = store.get(job_id)
         
-        return jsonify({
-            'success': True,
-            'message': result,
-            'metadata': {
-                'original_filename': file.filename,
-                'channel_used': channel,
-                'message_length': len(result)
-            }
-        })
+        body = {
+            'job_id': job['id'],
+            'kind': job['kind'],
+            'status': job['status'],
+            'progress': job['progress'],
+            'stage': job['stage'],
+            'created': job['created'],
+            'updated': job['updated'],
+        }
+        if job['status'] == 'failed':
+            body['error'] = job['error']
+        if job['status'] == 'done':
+            body['metadata'] = job['metadata']
+            if job['kind'] == 'decode':
+                with store.open_result(job_id) as result:
+                    body['message'] = result.read().decode('utf-8')
+            else:
+                body['result_url'] = f'/jobs/{job_id}/result'
+        return jsonify(body)
+        
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Result of a finished job: the encoded image file, or the decoded message as text"""
+    try:
+        store = job_store()
+        job = store.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        if job['status'] == 'failed':
+            return jsonify({'error': job['error']}), 409
+        
+        if job['status'] != 'done':
+            return jsonify({'error': f"Job is {job['status']}; poll /jobs/{job_id} until it is done"}), 409
+        
+        if job['kind'] == 'decode':
+            return send_file(store.open_result(job_id), mimetype='text/plain; charset=utf-8')
+        
+        output_format = job['metadata']['output_format']
+        return send_file(
+            store.open_result(job_id),
+            mimetype=OUTPUT_MIMETYPES[output_format],
+            as_attachment=True,
+            download_name=f"{job['params']['download_name']}.{output_format.lower()}"
+        )
         
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
@@ -380,22 +4281,37 @@ def get_image_info():
         if not allowed_file(file.filename):
             return jsonify({'error': 'File type not supported'}), 400
         
-        # Load and analyze image
+        # Read the header only: Image.open is lazy and pixels are never decoded,
+        # so a truncated upload holding just the first few KB is enough
         try:
-            image = Image.open(file.stream)
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
+            stream = upload_stream(file)
+            image = Image.open(stream)
             width, height = image.size
-            img_array = np.array(image)
-            
+            mode = image.mode
         except Exception as e:
             return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
         
-        # Calculate capacity
+        # Frame counts of animations and multi-page TIFFs walk the frame
+        # headers; if the upload ends before the last one, the count is
+        # unknown (null) and the capacity is that of the first frame
+        try:
+            frames = FrameSequence.open(image)
+            frames_known = frames is not None or FrameSequence.complete(image, stream)
+        except Exception:
+            frames, frames_known = None, False
+        
+        # Calculate capacity in the mode the image is embedded in (alpha is a
+        # fourth channel; grayscale, palette and 16-bit images have one),
+        # summed over every frame
+        layout = frames.frames if frames is not None else [((width, height), RGBChannelSteganography.native_mode(mode))]
+        native_mode = layout[0][1]
         total_pixels = width * height
-        capacity_per_channel = total_pixels  # 1 bit per pixel per channel
-        total_capacity_all = total_pixels * 3  # All 3 channels
+        capacity_per_channel = sum(w * h for (w, h), _ in layout)  # 1 bit per pixel per channel
+        total_capacity_all = sum(
+            w * h * RGBChannelSteganography.samples_per_pixel(mode) for (w, h), mode in layout
+        )
+        chars_per_channel = sum(RGBChannelSteganography.frame_capacities(layout, 'R'))
+        chars_all = sum(RGBChannelSteganography.frame_capacities(layout, 'ALL'))
         
         return jsonify({
             'filename': file.filename,
@@ -405,22 +4321,32 @@ def get_image_info():
                 'total_pixels': total_pixels
             },
             'format': image.format,
-            'mode': image.mode,
+            'mode': mode,
+            'native_mode': native_mode,
+            'channels': RGBChannelSteganography.samples_per_pixel(native_mode),
+            'frames': len(layout) if frames_known else None,
             'capacity': {
                 'per_channel': {
                     'bits': capacity_per_channel,
-                    'characters': capacity_per_channel // 8,
-                    'estimated_words': (capacity_per_channel // 8) // 5
+                    'characters': chars_per_channel,
+                    'estimated_words': chars_per_channel // 5
                 },
                 'all_channels': {
                     'bits': total_capacity_all,
-                    'characters': total_capacity_all // 8,
-                    'estimated_words': (total_capacity_all // 8) // 5
+                    'characters': chars_all,
+                    'estimated_words': chars_all // 5
                 }
             },
+            'capacity_by_bits_per_channel': {
+                str(bits): {
+                    'per_channel_characters': sum(RGBChannelSteganography.frame_capacities(layout, 'R', bits)),
+                    'all_channels_characters': sum(RGBChannelSteganography.frame_capacities(layout, 'ALL', bits))
+                }
+                for bits in range(1, RGBChannelSteganography.MAX_BITS_PER_CHANNEL + 1)
+            },
             'recommendations': {
-                'single_channel': f"Up to {capacity_per_channel // 8} characters",
-                'all_channels': f"Up to {total_capacity_all // 8} characters",
+                'single_channel': f"Up to {chars_per_channel} characters",
+                'all_channels': f"Up to {chars_all} characters",
                 'best_practice': "Use 'ALL' channels for longer messages"
             }
         })
@@ -428,10 +4354,110 @@ def get_image_info():
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+@app.before_request
+def check_upload_limit():
+    """Reject bodies above the endpoint's upload limit before parsing them"""
+    if request.content_length is not None and request.content_length > upload_limit():
+        abort(413)
+    # Bodies without a Content-Length are limited while they are read; forms
+    # are parsed and raw bodies spooled here, so an oversized one is a 413
+    # rather than a view error
+    if request.content_length is None and request.mimetype.startswith('multipart/'):
+        request.files
+    elif request.content_length is None and request.endpoint in ('encode_raw', 'decode_raw'):
+        g.raw_upload_stream = raw_upload_stream()
+
+def reset_peak_rss():
+    """
+    Reset this process's peak resident set size to its current size
+    
+    Returns the current RSS in bytes, or None where /proc/self/clear_refs
+    is unavailable (not Linux).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return resident_bytes('VmRSS')
+    except (OSError, ValueError):
+        return None
+
+def peak_rss():
+    """Peak resident set size in bytes since the last reset_peak_rss (or process start)"""
+    return resident_bytes('VmHWM')
+
+def resident_bytes(field):
+    """A kB field of /proc/self/status in bytes"""
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+    raise ValueError(f'No {field} in /proc/self/status')
+
+# Requests in flight and requests started, for the allocation report
+_allocation_requests = {'active': 0, 'started': 0}
+_allocation_lock = threading.Lock()
+
+@app.before_request
+def start_allocation_report():
+    """
+    Note this worker's resident memory when allocation reporting is enabled
+    
+    The peak is process-wide, so it is only measured (and the high-water
+    mark reset) for a request that starts alone; C allocations by Pillow and
+    NumPy count, unlike with tracemalloc.
+    """
+    if app.config['ALLOCATION_REPORT']:
+        with _allocation_lock:
+            _allocation_requests['active'] += 1
+            _allocation_requests['started'] += 1
+            g.allocation_started = _allocation_requests['started']
+            alone = _allocation_requests['active'] == 1
+            g.allocation_baseline = reset_peak_rss() if alone else None
+
+@app.after_request
+def add_cache_header(response):
+    """X-Cache: HIT or MISS on endpoints that consult the result cache"""
+    if 'cache_status' in g:
+        response.headers['X-Cache'] = g.cache_status
+    return response
+
+@app.after_request
+def finish_allocation_report(response):
+    """Attach the peak resident memory added by a request that ran alone as a debug header"""
+    if 'allocation_started' in g:
+        with _allocation_lock:
+            alone = g.allocation_baseline is not None and _allocation_requests['started'] == g.allocation_started
+            allocated = peak_rss() - g.allocation_baseline if alone else None
+        if allocated is not None:
+            response.headers['X-Allocated-Bytes'] = str(allocated)
+            app.logger.info('%s %s allocated_bytes=%d', request.method, request.path, allocated)
+        else:
+            app.logger.info('%s %s allocated_bytes=unknown', request.method, request.path)
+    return response
+
+@app.teardown_request
+def end_allocation_report(exc):
+    """Count the request out of the allocation report, even if it failed"""
+    if 'allocation_started' in g:
+        with _allocation_lock:
+            _allocation_requests['active'] -= 1
+
+@app.teardown_request
+def close_upload_maps(exc):
+    """Unmap spooled uploads; multipart temp files are closed with the request"""
+    for upload_map in g.pop('upload_maps', []):
+        try:
+            upload_map.close()
+        except BufferError:
+            # Still exported (e.g. a NumPy view); released with its last reference
+            pass
+    for spool in getattr(request, '_spool_files', []):
+        spool.close()
+
 @app.errorhandler(413)
 def too_large(e):
     """Handle file too large error"""
-    return jsonify({'error': 'File too large. Maximum size is 16MB'}), 413
+    return jsonify({'error': f'File too large. Maximum size is {upload_limit() // (1024 * 1024)}MB'}), 413
 
 @app.errorhandler(404)
 def not_found(e):
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# Keep job state and the shared cache of test runs apart from a running server
+_state = tempfile.mkdtemp(prefix='stego-tests-')
+os.environ.setdefault('STEGO_JOB_DIR', os.path.join(_state, 'jobs'))
+os.environ.setdefault('STEGO_SHARED_CACHE_DIR', os.path.join(_state, 'cache'))
+# Every request is computed unless a test enables the caches
+os.environ.setdefault('STEGO_CACHE_MB', '0')
+os.environ.setdefault('STEGO_SHARED_CACHE_MB', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,124 @@
+"""Payload wire format: container header, legacy delimiter images and round trips"""
+import io
+import struct
+import zlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from main import RGBChannelSteganography as S
+
+CHANNELS = ['R', 'G', 'B', 'A', 'ALL']
+MESSAGE = 'Meet at the old mill at dawn; bring the map. ' * 3
+
+
+def random_cover(mode='RGBA', width=96, height=64, seed=0):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (height, width, len(mode)), dtype=np.uint8), mode)
+
+
+def channel_samples(image, channel):
+    """Samples of a channel selection in embedding order, read independently of main"""
+    pixels = np.asarray(image)
+    if channel == 'ALL':
+        return pixels.reshape(-1)
+    return pixels[..., image.mode.index(channel)].reshape(-1)
+
+
+def pack_low_bits(samples, k):
+    """Bytes from the low k bits of each sample, most significant bit first"""
+    bits = (samples[:, None] >> np.arange(k - 1, -1, -1)) & 1
+    return np.packbits(bits.reshape(-1)).tobytes()
+
+
+def embedded_container(image, channel):
+    """(header fields, stored payload) read straight from the sample bits"""
+    samples = channel_samples(image, channel)
+    header = pack_low_bits(samples[:S.HEADER_BITS], 1)
+    magic, version, flags, length, checksum = struct.unpack('>4sBBII', header)
+    k = (flags & 0x03) + 1
+    payload = pack_low_bits(samples[S.HEADER_BITS:S.HEADER_BITS + -(-length * 8 // k)], k)[:length]
+    return (magic, version, flags, length, checksum), payload
+
+
+def test_header_bytes_are_pinned():
+    """Magic, version 1, flags (bits 0-1: k - 1, bits 2-3: codec id), length and CRC32, big-endian"""
+    assert S.HEADER_FORMAT == '>4sBBII' and S.HEADER_SIZE == 14
+    assert S.CODECS == ['none', 'zlib', 'bz2', 'lzma']
+    assert S.build_header(b'hello', 3, 'bz2') == bytes.fromhex('89535447' '01' '0a' '00000005' '3610a686')
+    assert S.build_header(b'', 1, 'none') == b'\x89STG\x01\x00' + bytes(4) + struct.pack('>I', zlib.crc32(b''))
+
+
+@pytest.mark.parametrize('codec', ['none', 'zlib', 'bz2', 'lzma'])
+@pytest.mark.parametrize('k', [1, 2, 3, 4])
+@pytest.mark.parametrize('channel', CHANNELS)
+def test_round_trip(channel, k, codec):
+    """Every channel x bits per channel x codec decodes, and the bits land where the format says"""
+    success, encoded = S.encode_message(random_cover(), MESSAGE, channel, k, compression=codec)
+    assert success, encoded
+
+    # Through a lossless file, as clients receive it
+    buffer = io.BytesIO()
+    encoded.save(buffer, format='PNG')
+    encoded = Image.open(io.BytesIO(buffer.getvalue()))
+    assert S.decode_message(encoded, channel) == (True, MESSAGE)
+    assert S.decode_message(encoded, channel, bits_per_channel=k) == (True, MESSAGE)
+    assert S.decode_message(encoded, channel, max_length=4) == (True, MESSAGE[:4])
+
+    (magic, version, flags, length, checksum), stored = embedded_container(encoded, channel)
+    assert (magic, version) == (b'\x89STG', 1)
+    assert flags == (k - 1) | (S.CODECS.index(codec) << 2)
+    assert length == len(stored) and checksum == zlib.crc32(stored)
+    assert S.decompress_payload(stored, codec) == MESSAGE.encode('utf-8')
+
+
+@pytest.mark.parametrize('channel', ['R', 'G', 'B', 'ALL'])
+def test_rgb_cover_matches_legacy_engine(channel):
+    """1-bit containers in RGB covers decode the same with both engines"""
+    success, encoded = S.encode_message(random_cover('RGB'), MESSAGE, channel, 1, compression='auto')
+    assert success, encoded
+    assert S.decode_message(encoded, channel, engine='legacy') == (True, MESSAGE)
+    assert S.decode_message(encoded, channel, engine='vectorized') == (True, MESSAGE)
+
+
+def test_wrong_bits_per_channel_and_corruption_are_reported():
+    success, encoded = S.encode_message(random_cover(), MESSAGE, 'R', 2)
+    assert success, encoded
+    success, error = S.decode_message(encoded, 'R', bits_per_channel=1)
+    assert not success and '2 bit(s)' in error
+
+    # Flip a payload bit: the CRC32 catches it
+    pixels = np.array(encoded)
+    pixels.reshape(-1, 4)[S.HEADER_BITS + 5, 0] ^= 1
+    assert S.decode_message(Image.fromarray(pixels, 'RGBA'), 'R') == (False, 'Payload checksum mismatch')
+
+
+def test_auto_compression_picks_a_codec_only_when_it_pays():
+    text = 'log line: status=ok latency=12ms\n' * 40
+    success, encoded = S.encode_message(random_cover(width=256, height=128), text, 'ALL', 1, compression='auto')
+    assert success, encoded
+    (_, _, flags, length, _), _ = embedded_container(encoded, 'ALL')
+    assert flags >> 2 != 0 and length < len(text)
+
+    success, encoded = S.encode_message(random_cover(), 'short', 'ALL', 1, compression='auto')
+    assert success, encoded
+    (_, _, flags, length, _), _ = embedded_container(encoded, 'ALL')
+    assert flags >> 2 == 0 and length == len('short')
+
+
+@pytest.mark.parametrize('channel', ['R', 'G', 'B', 'ALL'])
+def test_legacy_delimiter_images_decode(channel):
+    """Images from before the container header (text bits ended by 1111111111111110) still decode"""
+    cover = random_cover('RGB')
+    bits = np.unpackbits(np.frombuffer(b'legacy payload' + b'\xff\xfe', dtype=np.uint8))
+    pixels = np.array(cover)
+    samples = pixels.reshape(-1) if channel == 'ALL' else pixels[..., 'RGB'.index(channel)].reshape(-1).copy()
+    samples[:len(bits)] = (samples[:len(bits)] & 0xFE) | bits
+    if channel != 'ALL':
+        pixels[..., 'RGB'.index(channel)] = samples.reshape(pixels.shape[:2])
+    legacy = Image.fromarray(pixels)
+
+    assert S.decode_message(legacy, channel) == (True, 'legacy payload')
+    assert S.decode_message(legacy, channel, engine='legacy') == (True, 'legacy payload')
+    assert S.decode_message(legacy, channel, max_length=6) == (True, 'legacy')
@@ -0,0 +1,255 @@
+"""Regression checks for the streaming and upload paths"""
+import io
+import os
+import re
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from main import RGBChannelSteganography, app
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def random_png(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    image = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', compress_level=1)
+    return image, buffer.getvalue()
+
+
+def test_parallel_decode_of_streamed_png(client, monkeypatch):
+    """Payloads of PARALLEL_MIN_BYTES or more are extracted on several threads from one PNG stream"""
+    monkeypatch.setattr(RGBChannelSteganography, 'THREADS', 4)
+    image, _ = random_png(1500, 1500)
+    message = ''.join(chr(97 + i % 26) for i in range(1_500_000))
+    success, result = RGBChannelSteganography.encode_message(image, message, 'ALL', 2, compression='none')
+    assert success, result
+    buffer = io.BytesIO()
+    result.save(buffer, format='PNG', compress_level=1)
+
+    response = client.post('/decode', data={'image': (io.BytesIO(buffer.getvalue()), 'cover.png'), 'channel': 'ALL'})
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['message'] == message
+
+    response = client.post('/decode/raw?channel=ALL', data=buffer.getvalue())
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == message
+
+
+def test_shared_cover_published_on_second_use(client, monkeypatch, tmp_path):
+    """Single-use covers are not copied into the shared cache; one reused in another worker is"""
+    import main
+    monkeypatch.setitem(app.config, 'SHARED_CACHE_BYTES', 64 << 20)
+    monkeypatch.setitem(app.config, 'SHARED_CACHE_DIR', str(tmp_path))
+    monkeypatch.setitem(app.config, 'SHARED_COVER_MIN_PIXELS', 1)
+    monkeypatch.setattr(main, '_shared_cache', None)
+    _, cover = random_png(64, 48)
+
+    def encode(message):
+        response = client.post('/encode', data={'image': (io.BytesIO(cover), 'cover.png'), 'message': message})
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()
+
+    cover_entry = tmp_path / main.cache_key('cover', main.upload_digest(io.BytesIO(cover)))
+    encode('first')
+    assert not cover_entry.exists()
+    # The second upload lands on another worker, with its own SharedCache
+    monkeypatch.setattr(main, '_shared_cache', None)
+    encode('second')
+    assert cover_entry.exists()
+    hits = main.shared_cache().hits
+    assert encode('third')['metadata']['message_length'] == 5
+    assert main.shared_cache().hits == hits + 1
+
+
+@pytest.mark.parametrize('mode,transparency', [('L', 7), ('RGB', (1, 2, 3))])
+def test_grayscale_and_color_key_pngs_stream(client, monkeypatch, mode, transparency):
+    """L PNGs are decoded by the streaming reader, and a tRNS color key survives encoding"""
+    import main
+    rng = np.random.default_rng(2)
+    shape = (120, 160) if mode == 'L' else (120, 160, 3)
+    buffer = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, shape, dtype=np.uint8), mode).save(
+        buffer, format='PNG', transparency=transparency
+    )
+    opened = []
+    open_stream = main.PNGStreamImage.open
+    monkeypatch.setattr(main.PNGStreamImage, 'open', lambda stream: opened.append(open_stream(stream)) or opened[-1])
+
+    for min_pixels in [app.config['STREAM_MIN_PIXELS'], 1]:
+        monkeypatch.setitem(app.config, 'STREAM_MIN_PIXELS', min_pixels)
+        response = client.post('/encode-download',
+                               data={'image': (io.BytesIO(buffer.getvalue()), 'cover.png'), 'message': 'key'})
+        assert response.status_code == 200, response.get_json()
+        encoded = Image.open(io.BytesIO(response.data))
+        assert encoded.mode == mode and encoded.info.get('transparency') == transparency
+
+        opened.clear()
+        response = client.post('/decode', data={'image': (io.BytesIO(response.data), 'encoded.png')})
+        assert response.get_json()['message'] == 'key'
+        assert opened and opened[-1] is not None and opened[-1].mode == mode
+
+
+@pytest.mark.parametrize('format, name', [('GIF', 'cover.gif'), ('TIFF', 'cover.tiff')])
+def test_info_accepts_truncated_multi_frame_files(client, format, name):
+    """/info reads a header prefix of a multi-frame file; the frame count is unknown, not 1"""
+    rng = np.random.default_rng(1)
+    frames = [Image.fromarray(rng.integers(0, 256, (200, 300, 3), dtype=np.uint8)) for _ in range(4)]
+    if format == 'GIF':
+        frames = [frame.quantize(64) for frame in frames]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format=format, save_all=True, append_images=frames[1:])
+    data = buffer.getvalue()
+
+    whole = client.post('/info', data={'image': (io.BytesIO(data), name)}).get_json()
+    assert whole['frames'] == 4
+    response = client.post('/info', data={'image': (io.BytesIO(data[:4096]), name)})
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['frames'] is None
+    assert response.get_json()['capacity']['per_channel']['bits'] == whole['capacity']['per_channel']['bits'] // 4
+
+
+def test_chunked_upload_limited_per_endpoint(client, monkeypatch):
+    """Uploads without a Content-Length get the endpoint's limit, not the largest one"""
+    monkeypatch.setitem(app.config, 'UPLOAD_LIMIT', 1 << 20)
+    body = (b'--b\r\nContent-Disposition: form-data; name="image"; filename="a.png"\r\n'
+            b'Content-Type: image/png\r\n\r\n' + b'x' * (3 << 20) + b'\r\n--b--\r\n')
+    for path in ['/encode', '/decode', '/info']:
+        response = client.post(path, input_stream=io.BytesIO(body), content_type='multipart/form-data; boundary=b',
+                               headers={'Transfer-Encoding': 'chunked'},
+                               environ_overrides={'wsgi.input_terminated': True})
+        assert response.status_code == 413, path
+
+
+def peak_rss(width, height):
+    """Peak RSS (MB) of `benchmark.py gigapixel` strip-encoding and decoding a width x height PNG"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, 'benchmark.py', 'gigapixel', '--size', f'{width}x{height}', '--rss-limit', '100000'],
+        cwd=root, capture_output=True, text=True, timeout=600
+    )
+    assert result.returncode == 0, result.stderr
+    return float(re.search(r'peak RSS (\d+) MB', result.stdout).group(1))
+
+
+def test_streamed_png_memory_does_not_grow_with_size():
+    """Strip-wise encode/decode holds a bounded working set: 4x the pixels (a 150 MB frame) costs < 64 MB more"""
+    assert peak_rss(8192, 6144) - peak_rss(4096, 3072) < 64
+
+
+def test_sync_and_job_metadata_match(client):
+    """/encode and /decode report the same metadata as the job/batch helpers"""
+    from main import decode_upload, encode_upload
+    _, cover = random_png(80, 60)
+    response = client.post('/encode', data={'image': (io.BytesIO(cover), 'cover.png'), 'message': 'same shape'})
+    sync = response.get_json()['metadata']
+    del sync['original_filename']
+    success, (encoded, metadata) = encode_upload(cover, 'same shape', 'R', 1, 'auto', None, None)
+    assert success
+    assert metadata.keys() == sync.keys()
+    assert {k: v for k, v in metadata.items() if k != 'output_encode_seconds'} == \
+        {k: v for k, v in sync.items() if k != 'output_encode_seconds'}
+
+    sync = client.post('/decode', data={'image': (io.BytesIO(encoded), 'e.png')}).get_json()['metadata']
+    del sync['original_filename']
+    success, (_, metadata) = decode_upload(encoded, 'R', None, None)
+    assert success
+    del metadata['decode_seconds']
+    assert metadata == sync
+
+
+def test_purge_removes_lost_jobs(tmp_path):
+    """Expired jobs left queued by an exited worker are purged with their input file, even if its pid is reused"""
+    from main import SQLiteJobStore
+    store = SQLiteJobStore(str(tmp_path))
+    lost = store.create('decode', {}, io.BytesIO(b'input'))
+    reused = store.create('decode', {}, io.BytesIO(b'input'))
+    live = store.create('decode', {}, io.BytesIO(b'input'))
+    exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+    store.update(lost['id'], owner=int(exited.stdout))
+    # An earlier process with this worker's pid (started at another time)
+    pid, _, start = live['owner'].partition(':')
+    assert start, 'owner tokens carry the process start time on Linux'
+    store.update(reused['id'], owner=f'{pid}:{int(start) - 1}')
+
+    store.purge(time.time() + 1)
+    assert store.get(lost['id']) is None
+    assert store.get(reused['id']) is None
+    assert not os.path.exists(store.file(lost['id'], 'input'))
+    assert store.get(live['id'])['status'] == 'queued'
+
+
+def test_promoted_request_is_not_reported_as_done(client, monkeypatch):
+    """A synchronous request promoted to a job answers 202 with success false and a status_url to poll"""
+    monkeypatch.setitem(app.config, 'ASYNC_PROMOTE_SECONDS', 1e-9)
+    image, _ = random_png(64, 48)
+    jpeg = io.BytesIO()
+    image.save(jpeg, format='JPEG')
+
+    response = client.post('/encode', data={'image': (io.BytesIO(jpeg.getvalue()), 'cover.jpg'), 'message': 'm'})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['success'] is False and body['status'] == 'queued' and 'metadata' not in body
+
+    deadline = time.time() + 30
+    while True:
+        job = client.get(body['status_url']).get_json()
+        if job['status'] in ('done', 'failed') or time.time() > deadline:
+            break
+        time.sleep(0.05)
+    assert job['status'] == 'done', job
+    assert job['metadata']['output_format'] == 'PNG'
+
+
+def test_allocation_report_counts_pillow_buffers(client, monkeypatch):
+    """X-Allocated-Bytes includes the frame Pillow decodes in C, which tracemalloc never saw"""
+    monkeypatch.setitem(app.config, 'ALLOCATION_REPORT', True)
+    _, cover = random_png(1500, 1000)
+    response = client.post('/encode', data={'image': (io.BytesIO(cover), 'cover.png'), 'message': 'm'})
+    assert response.status_code == 200, response.get_json()
+    assert int(response.headers['X-Allocated-Bytes']) >= 1500 * 1000 * 3
+
+
+def test_palette_index_flips_keep_transparency(client):
+    """Palette entries of equal tRNS alpha are paired, so embedding never makes a pixel (in)visible"""
+    rng = np.random.default_rng(5)
+    image = Image.fromarray(rng.integers(0, 32, (120, 160), dtype=np.uint8), 'P')
+    image.putpalette(rng.integers(0, 256, 96, dtype=np.uint8).tobytes())
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', transparency=bytes(0 if i % 2 else 255 for i in range(32)))
+    before = np.asarray(Image.open(io.BytesIO(buffer.getvalue())).convert('RGBA'))[..., 3]
+
+    response = client.post('/encode-download',
+                           data={'image': (io.BytesIO(buffer.getvalue()), 'cover.png'), 'message': 'x' * 2000})
+    assert response.status_code == 200, response.get_json()
+    encoded = Image.open(io.BytesIO(response.data))
+    assert encoded.mode == 'P'
+    assert np.array_equal(np.asarray(encoded.convert('RGBA'))[..., 3], before)
+
+
+def test_chunked_raw_bodies(client, monkeypatch):
+    """Raw endpoints accept chunked bodies, reject empty ones and cut off oversized ones with 413"""
+    _, cover = random_png(200, 150)
+
+    def chunked(path, body):
+        return client.post(path, input_stream=io.BytesIO(body), content_type='application/octet-stream',
+                           headers={'Transfer-Encoding': 'chunked'}, environ_overrides={'wsgi.input_terminated': True})
+
+    encoded = chunked('/encode/raw?message_bytes=7', cover + b'chunked')
+    assert encoded.status_code == 200, encoded.get_json()
+    decoded = chunked('/decode/raw', encoded.data)
+    assert decoded.status_code == 200 and decoded.get_data(as_text=True) == 'chunked'
+    assert chunked('/decode/raw', b'').get_json()['error'] == 'No image provided'
+
+    monkeypatch.setitem(app.config, 'UPLOAD_LIMIT', len(cover) // 2)
+    assert chunked('/encode/raw?message=m', cover).status_code == 413
+    assert chunked('/decode/raw', encoded.data).status_code == 413